@@ -0,0 +1,234 @@
+"""
+Benchmark the bronze/silver pipeline end to end on synthetic data; Results go to a json file comparable across commits
+"""
+
+from pathlib import Path
+from datetime import datetime
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_ROOT = Path(os.getenv("DATA_ROOT", PROJECT_ROOT / "data"))
+RESULTS_ROOT = DATA_ROOT / "benchmarks"
+
+benchmarks_path = str(PROJECT_ROOT / "benchmarks")
+
+if benchmarks_path not in sys.path:
+    sys.path.append(benchmarks_path)
+
+
+import synthetic_data
+
+
+# Stage entry points; Each runs in a fresh interpreter so peak RSS is per stage
+STAGES = {
+    "write_raw_parquet": (
+        "bronze",
+        "import write_raw_parquet; write_raw_parquet.main(overwrite=True, workers={workers}, dataset_path={dataset!r})",
+        "bronze/intraday_prices",
+    ),
+    "clean_data": (
+        "silver",
+        "import clean_data; clean_data.main(folder_path={data!r} + '/bronze/intraday_prices', overwrite=True, workers={workers})",
+        "silver/cleaning",
+    ),
+    "normalize_data": (
+        "silver",
+        "import normalize_data; normalize_data.main(folder_path={data!r} + '/silver/cleaning', overwrite=True)",
+        "silver/normalize",
+    ),
+}
+
+
+# ----------------------------
+# Helpers
+# ----------------------------
+
+"""
+Total size of the files under a folder
+
+@param:Path path - folder
+@returns: int - bytes
+"""
+def folder_bytes(path: Path) -> int:
+    return sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file())
+
+
+"""
+Current git commit of the project, if any
+
+@returns: str - short commit hash or "unknown"
+"""
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+"""
+Run one stage in a subprocess against an isolated DATA_ROOT
+
+@param:str name - stage name (key of STAGES)
+@param:Path data_root - DATA_ROOT of the run
+@param:Path dataset - synthetic dataset folder
+@param:int workers - worker count passed to the stage
+@param:int rows - rows fed to the stage
+@returns: dict - wall time, rows/sec, peak RSS and output bytes
+"""
+def run_stage(name: str, data_root: Path, dataset: Path, workers: int, rows: int) -> dict:
+
+    folder, code, output = STAGES[name]
+
+    env = dict(os.environ, DATA_ROOT=str(data_root))
+
+    command = [sys.executable, "-c", code.format(workers=workers, dataset=str(dataset), data=str(data_root))]
+
+    # A file, not a pipe; A stage writing more than the pipe buffer would block before wait4 returns
+    with tempfile.TemporaryFile() as stderr_file:
+
+        start = time.perf_counter()
+
+        process = subprocess.Popen(command, cwd=PROJECT_ROOT / folder, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=stderr_file)
+
+        # wait4 reports the rusage of this child and the workers it reaped
+        _, status, usage = os.wait4(process.pid, 0)
+
+        wall = time.perf_counter() - start
+
+        stderr_file.seek(0)
+        stderr = stderr_file.read().decode()
+
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise Exception(f"Stage {name} failed:\n{stderr}")
+
+    return {
+        "wall_s": round(wall, 4),
+        "cpu_s": round(usage.ru_utime + usage.ru_stime, 4),
+        "rows_per_s": round(rows / wall, 1) if wall else None,
+        # ru_maxrss is KiB on Linux
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+        "output_bytes": folder_bytes(data_root / output),
+    }
+
+
+"""
+Print the per stage speedup of a run against a previous results file
+
+@param:dict results - current results
+@param:Path baseline_path - previous results json
+@returns: None
+"""
+def compare(results: dict, baseline_path: Path) -> None:
+
+    with open(baseline_path) as json_file:
+        baseline = json.load(json_file)
+
+    print(f"Compared to {baseline.get('commit')} ({baseline_path}):")
+
+    for name, stage in results["stages"].items():
+        previous = baseline["stages"].get(name)
+
+        if not previous:
+            continue
+
+        print(f"  {name}: {previous['wall_s']:.2f}s -> {stage['wall_s']:.2f}s "
+              f"({previous['wall_s'] / stage['wall_s']:.2f}x), "
+              f"peak {previous['peak_rss_mb']} -> {stage['peak_rss_mb']} MB")
+
+
+# ----------------------------
+# Main
+# ----------------------------
+
+"""
+Main func for benchmarks - Generates data, runs every stage, writes a results json
+@param:int weeks - number of synthetic weekly files
+@param:int rows_per_file - rows per weekly file
+@param:int workers - worker count for stages with a process pool
+@param:Path | None output - results json path; Defaults to DATA_ROOT/benchmarks/<commit>_<time>.json
+@param:Path | None baseline - previous results json to compare against
+@returns: dict - results
+"""
+def main(weeks: int = 20, rows_per_file: int = 50_000, workers: int = 1,
+         output: Path | None = None, baseline: Path | None = None) -> dict:
+
+    with tempfile.TemporaryDirectory(prefix="intraday_bench_") as tmp:
+        tmp = Path(tmp)
+
+        dataset = tmp / "dataset"
+        data_root = tmp / "data"
+
+        start = time.perf_counter()
+        summary = synthetic_data.generate(dataset, weeks=weeks, rows_per_file=rows_per_file)
+        generate_s = time.perf_counter() - start
+
+        print(f"Generated {summary['total_rows']} rows in {weeks} files ({generate_s:.2f}s)")
+
+        results = {
+            "commit": git_commit(),
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "config": {"weeks": weeks, "rows_per_file": rows_per_file, "workers": workers,
+                       "cpu_count": os.cpu_count()},
+            "dataset": {**summary, "input_bytes": folder_bytes(dataset)},
+            "stages": {},
+        }
+
+        for name in STAGES:
+            results["stages"][name] = run_stage(name, data_root, dataset, workers, summary["total_rows"])
+
+            stage = results["stages"][name]
+            print(f"{name}: {stage['wall_s']:.2f}s, {stage['rows_per_s']:.0f} rows/s, "
+                  f"peak {stage['peak_rss_mb']} MB, {stage['output_bytes']} bytes out")
+
+    wall = sum(stage["wall_s"] for stage in results["stages"].values())
+
+    results["end_to_end"] = {
+        "wall_s": round(wall, 4),
+        "rows_per_s": round(summary["total_rows"] / wall, 1) if wall else None,
+        "peak_rss_mb": max(stage["peak_rss_mb"] for stage in results["stages"].values()),
+    }
+
+    print(f"End to end: {wall:.2f}s, {results['end_to_end']['rows_per_s']:.0f} rows/s")
+
+    # -----------------
+    # Write results
+    # -----------------
+
+    if output is None:
+        output = RESULTS_ROOT / f"{results['commit']}_{datetime.now():%Y%m%d_%H%M%S}.json"
+
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+
+    with open(output, "w") as json_file:
+        json.dump(results, json_file, indent=4)
+
+    print(f"Results written to {output}")
+
+    if baseline is not None:
+        compare(results, Path(baseline))
+
+    return results
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic weekly data")
+    parser.add_argument("--weeks", type=int, default=20, help="Number of weekly files")
+    parser.add_argument("--rows-per-file", type=int, default=50_000, help="Rows per weekly file")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for bronze and cleaning")
+    parser.add_argument("--output", type=Path, default=None, help="Results json path")
+    parser.add_argument("--baseline", type=Path, default=None, help="Previous results json to compare against")
+
+    args = parser.parse_args()
+
+    main(weeks=args.weeks, rows_per_file=args.rows_per_file, workers=args.workers,
+         output=args.output, baseline=args.baseline)
@@ -0,0 +1,196 @@
+"""
+Generate a synthetic Kaggle-like dataset of weekly intraday csv files for benchmarks and offline runs
+"""
+
+from pathlib import Path
+from datetime import date, timedelta
+import argparse
+import numpy as np
+import polars as pl
+
+
+VALID_COLS = ['ID', 'TimeStamp', '/ES', '/NQ', '/RTY', 'SPY', 'QQQ', 'IWM']
+
+# Rough price level of each instrument; Prices follow a random walk around it
+BASE_PRICES = {
+    "/ES": 4000.0,
+    "/NQ": 14000.0,
+    "/RTY": 2000.0,
+    "SPY": 400.0,
+    "QQQ": 350.0,
+    "IWM": 200.0,
+}
+
+# Session covered by each generated day (seconds from midnight)
+SESSION_START = 4 * 3600
+SESSION_END = 20 * 3600
+
+# Schema issues (See README.md); Every SCHEMA_ISSUE_PERIOD weeks one week of each kind is generated
+SCHEMA_ISSUE_PERIOD = 40
+SCHEMA_ISSUE_1_OFFSET = 1
+SCHEMA_ISSUE_2_OFFSET = 21
+
+FIRST_WEEK_ENDING = date(2020, 1, 31)
+
+
+# ----------------------------
+# Helpers
+# ----------------------------
+
+"""
+TimeStamp format used by the real files in a given year
+
+@param:int year - year of the week
+@returns: str - strftime format
+"""
+def timestamp_format(year: int) -> str:
+    if year <= 2021:
+        return "%-m/%-d/%y %H:%M"         # 8/9/20 17:59
+    if year == 2022:
+        return "%-m/%-d/%Y %H:%M:%S"      # 11/22/2022 18:45:39
+
+    return "%Y-%m-%d %H:%M:%S.000"        # 2023-01-06 18:45:39.000
+
+
+"""
+Kaggle file name of a week; Reproduces the misnamed 2024 09 13 file
+
+@param:date week_ending - friday ending the week
+@returns: str - csv file name
+"""
+def week_file_name(week_ending: date) -> str:
+    if week_ending == date(2024, 9, 13):
+        return "TOS Kaggle data week ending 2024 09 013csv.csv"
+
+    return f"TOS Kaggle data week ending {week_ending:%Y %m %d}.csv"
+
+
+"""
+Build one synthetic week of snapshot rows
+
+@param:date week_ending - friday ending the week
+@param:int rows - number of rows in the week
+@param:np.random.Generator rng - random generator
+@returns: pl.DataFrame - week with VALID_COLS, TimeStamp formatted as in the real file of that year
+"""
+def build_week(week_ending: date, rows: int, rng: np.random.Generator) -> pl.DataFrame:
+
+    monday = week_ending - timedelta(days=4)
+
+    # Spread rows evenly over the five sessions of the week
+    per_day = max(rows // 5, 1)
+    offsets = np.linspace(SESSION_START, SESSION_END, per_day, endpoint=False).astype("int64")
+
+    seconds = np.concatenate([offsets + day * 86_400 for day in range(5)])[:rows]
+
+    start = np.datetime64(monday, "ms")
+    timestamps = pl.Series("TimeStamp", start + (seconds * 1000).astype("timedelta64[ms]"))
+
+    # Minute grain formats repeat minutes, like the real files
+    fmt = timestamp_format(week_ending.year)
+
+    data = {
+        "ID": np.arange(len(seconds), dtype="int64"),
+        "TimeStamp": timestamps.dt.strftime(fmt),
+    }
+
+    for col, base in BASE_PRICES.items():
+        steps = rng.normal(0.0, base * 0.0002, len(seconds))
+        data[col] = np.round(base + np.cumsum(steps), 2)
+
+    return pl.DataFrame(data).select(VALID_COLS)
+
+
+"""
+Write a week to csv with the schema quirk assigned to it
+
+@param:pl.DataFrame week - week to write
+@param:Path path - csv path
+@param:str quirk - "none", "schema_issue_1" (no header row) or "schema_issue_2" (tab separated)
+@returns: None
+"""
+def write_week(week: pl.DataFrame, path: Path, quirk: str) -> None:
+
+    if quirk == "schema_issue_1":
+        week.write_csv(path, include_header=False)
+    elif quirk == "schema_issue_2":
+        week.write_csv(path, separator="\t")
+    else:
+        week.write_csv(path)
+
+
+"""
+Schema quirk of the n-th generated week
+
+@param:int index - week index
+@returns: str - quirk name
+"""
+def week_quirk(index: int) -> str:
+    if index % SCHEMA_ISSUE_PERIOD == SCHEMA_ISSUE_1_OFFSET:
+        return "schema_issue_1"
+    if index % SCHEMA_ISSUE_PERIOD == SCHEMA_ISSUE_2_OFFSET:
+        return "schema_issue_2"
+
+    return "none"
+
+
+# ----------------------------
+# Main
+# ----------------------------
+
+"""
+Generate a Kaggle-like dataset folder; Weekly files live under "Zipped data" like the real download
+
+@param:Path out_dir - dataset folder to create
+@param:int weeks - number of weekly files
+@param:int rows_per_file - rows per weekly file
+@param:date first_week_ending - friday ending the first week
+@param:int seed - random seed
+@returns: dict - summary of what was generated
+"""
+def generate(out_dir: Path, weeks: int = 20, rows_per_file: int = 50_000,
+             first_week_ending: date = FIRST_WEEK_ENDING, seed: int = 0) -> dict:
+
+    out_dir = Path(out_dir)
+    week_dir = out_dir / "Zipped data"
+    week_dir.mkdir(parents=True, exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+
+    quirks = {"none": 0, "schema_issue_1": 0, "schema_issue_2": 0}
+    total_rows = 0
+
+    for index in range(weeks):
+        week_ending = first_week_ending + timedelta(weeks=index)
+
+        quirk = week_quirk(index)
+        week = build_week(week_ending, rows_per_file, rng)
+
+        write_week(week, week_dir / week_file_name(week_ending), quirk)
+
+        quirks[quirk] += 1
+        total_rows += week.height
+
+    # Example file outside "Zipped data"; Bronze must skip it
+    build_week(first_week_ending, 10, rng).write_csv(out_dir / "TOS Kaggle data example.csv")
+
+    return {
+        "weeks": weeks,
+        "rows_per_file": rows_per_file,
+        "total_rows": total_rows,
+        "quirks": quirks,
+        "seed": seed,
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic weekly intraday dataset")
+    parser.add_argument("out_dir", help="Dataset folder to create")
+    parser.add_argument("--weeks", type=int, default=20, help="Number of weekly files")
+    parser.add_argument("--rows-per-file", type=int, default=50_000, help="Rows per weekly file")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+
+    args = parser.parse_args()
+
+    print(generate(Path(args.out_dir), weeks=args.weeks, rows_per_file=args.rows_per_file, seed=args.seed))
@@ -3,10 +3,16 @@ Write parquet files from Kaggle dataset for Bronze level
 """
 
 from pathlib import Path
-import kagglehub
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import argparse
+import csv
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
 import os
 import json
+import time
 
 
 import sys
@@ -20,6 +26,10 @@ if helper_path not in sys.path:
 
 
 import add_metadata
+import dataset_cache
+import manifest
+import stage_metrics
+import table_log
 
 
 
@@ -35,8 +45,20 @@ load_dotenv()
 DATASET_ID = os.getenv("KAGGLE_PATH")
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
-BRONZE_ROOT = PROJECT_ROOT / "data" / "bronze" / "intraday_prices"
-BRONZE_META = PROJECT_ROOT / "data" / "bronze" / "metadata" 
+DATA_ROOT = Path(os.getenv("DATA_ROOT", PROJECT_ROOT / "data"))
+BRONZE_ROOT = DATA_ROOT / "bronze" / "intraday_prices"
+BRONZE_META = DATA_ROOT / "bronze" / "metadata" 
+
+# Streaming conversion settings; memory is bounded by one row group plus one read block
+DEFAULT_ROW_GROUP_SIZE = 250_000
+DEFAULT_COMPRESSION = "zstd"
+CSV_BLOCK_SIZE = 16 << 20
+
+# Version of this stage's logic; Bumps whenever this file or a helper it builds its outputs with changes
+CODE_VERSION = manifest.code_version(__file__, add_metadata.__file__, table_log.__file__)
+
+# Format string that never matches; Keeps TimeStamp (and any header-as-data col) raw in bronze
+NO_TIMESTAMP_INFERENCE = ["no timestamp inference"]
 
 # ----------------------------
 # Helpers
@@ -61,88 +83,271 @@ def list_csv_files(dataset_path: Path) -> list[Path]:
     return list(dataset_path.rglob("*.csv"))
 
 
+# ----------------------------
+# Per-file Conversion
+# ----------------------------
+
+"""
+Read the header of a csv and make names unique the way pandas.read_csv does (x, x.1, x.2...)
+
+@param:Path path - path to csv
+@returns: list[str] - column names
+"""
+def read_header(path: Path) -> list[str]:
+    with open(path, newline="") as f:
+        header = next(csv.reader(f), [])
+
+    names = []
+    seen = {}
+
+    for name in header:
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        names.append(name if count == 0 else f"{name}.{count}")
+
+    return names
+
+
+"""
+Stream a csv into a parquet one record batch at a time; Row groups are flushed as they fill
+
+@param:Path path - path to csv
+@param:Path out_path - parquet path to write
+@param:int row_group_size - rows per parquet row group
+@param:str compression - parquet compression codec
+@param:bool as_strings - read every col as string instead of inferring types
+@returns: int - number of rows written
+"""
+def stream_csv_to_parquet(path: Path, out_path: Path, row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+                          compression: str = DEFAULT_COMPRESSION, as_strings: bool = False) -> int:
+
+    names = read_header(path)
+
+    read_options = pv.ReadOptions(column_names=names, skip_rows=1, block_size=CSV_BLOCK_SIZE)
+    convert_options = pv.ConvertOptions(timestamp_parsers=NO_TIMESTAMP_INFERENCE,
+                                        column_types={name: pa.string() for name in names} if as_strings else None)
+
+    reader = pv.open_csv(path, read_options=read_options, convert_options=convert_options)
+
+    rows = 0
+    buffer = []
+    buffered_rows = 0
+
+    with pq.ParquetWriter(out_path, reader.schema, compression=compression) as writer:
+        for batch in reader:
+            buffer.append(batch)
+            buffered_rows += batch.num_rows
+
+            # Flush whole row groups only; The remainder carries into the next group
+            if buffered_rows >= row_group_size:
+                table = pa.Table.from_batches(buffer, schema=reader.schema)
+                full_rows = buffered_rows - buffered_rows % row_group_size
+
+                writer.write_table(table.slice(0, full_rows), row_group_size=row_group_size)
+                rows += full_rows
+
+                buffer = table.slice(full_rows).to_batches()
+                buffered_rows -= full_rows
+
+        if buffer:
+            writer.write_table(pa.Table.from_batches(buffer, schema=reader.schema), row_group_size=row_group_size)
+            rows += buffered_rows
+
+    return rows
+
+
+"""
+Resolve the bronze dataset name for a csv; Applies explicit renames (See README.md)
+
+@param:Path path - path to csv
+@returns: str - dataset name used for the bronze parquet
+"""
+def resolve_dataset_name(path: Path) -> str:
+    dataset_name = Path(path).stem
+
+    # Fix single entry error
+    if dataset_name == "TOS Kaggle data week ending 2024 09 013csv":
+        dataset_name = "TOS Kaggle data week ending 2024 09 13"
+
+    return dataset_name
+
+
+"""
+Check if a csv should be ignored for bronze ingestion
+
+@param:Path path - path to csv
+@param:str dataset_name - resolved dataset name
+@returns: bool - True if file is to be skipped
+"""
+def is_skip_file(path: Path, dataset_name: str) -> bool:
+    # Ignore the example and any file not organized properly
+    return "Zipped data" not in str(path) or dataset_name == "TOS Kaggle data example.parquet"
+
+
+"""
+Convert a single csv to a bronze parquet; Safe to run within a worker process
+
+@param:Path path - path to csv
+@param:int row_group_size - rows per parquet row group
+@param:str compression - parquet compression codec
+@returns: tuple[dict, list] - metadata record and metrics records for the file
+"""
+def convert_csv(path: Path, row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+                compression: str = DEFAULT_COMPRESSION) -> tuple[dict, list]:
+
+    dataset_name = resolve_dataset_name(path)
+
+    out_path = BRONZE_ROOT / f"{dataset_name}.parquet"
+    tmp_path = BRONZE_ROOT / f".{dataset_name}.parquet.tmp"
+
+    metrics = []
+
+    try:
+        with stage_metrics.measure(metrics, out_path, "bronze", "ingest", "total") as counts:
+
+            counts["bytes_read"] = stage_metrics.file_bytes(path)
+
+            notes = "N/A"
+
+            # Types are inferred from the first block; A later block that disagrees restarts as strings
+            try:
+                rows = stream_csv_to_parquet(path, tmp_path, row_group_size, compression)
+            except pa.ArrowInvalid:
+                rows = stream_csv_to_parquet(path, tmp_path, row_group_size, compression, as_strings=True)
+                notes = "Mixed col types; written as string"
+
+            os.replace(tmp_path, out_path)
+
+            counts["rows_in"] = counts["rows_out"] = rows
+            counts["bytes_written"] = stage_metrics.file_bytes(out_path)
+
+        print(f"Wrote parquet {dataset_name} ({rows} rows)")
+
+        return add_metadata.add_clean_metadata_instance(file=f"{BRONZE_ROOT}/{dataset_name}.parquet",
+                                layer="bronze",
+                                process= "ingest",
+                                sub_process= "N/A",
+                                status= "conforming",
+                                issue= "N/A",
+                                action= "processed",
+                                notes= notes), metrics
+
+    except Exception:
+        print(f"Unexpected error on dataset {dataset_name}")
+
+        tmp_path.unlink(missing_ok=True)
+
+        return add_metadata.add_clean_metadata_instance(file=f"{BRONZE_ROOT}/{dataset_name}.parquet",
+                                    layer="bronze",
+                                    process= "ingest",
+                                    sub_process= "N/A",
+                                    status= "non_onforming",
+                                    issue= "Unknown",
+                                    action= "skipped",
+                                    notes= "Skipped parquet due to unknown error"), metrics
+
+
 # ----------------------------
 # Main Ingestion Logic
 # ----------------------------
 
 """
 Main func for ingestion - Makes parquety files
-@param:bool overwrite - bool indicating if to overwrite if file already exists; False by default 
+@param:bool overwrite - bool indicating if to rebuild every file regardless of the manifest; False by default 
+@param:int workers - number of worker processes; 1 runs serially in process
+@param:int row_group_size - rows per parquet row group
+@param:str compression - parquet compression codec
+@param:Path | None dataset_path - local folder of the dataset; Resolved through the dataset cache when None
 @returns: None
 """
-def main(overwrite: bool = False) -> None:
-    print("Downloading dataset from Kaggle...")
-    dataset_path = Path(kagglehub.dataset_download(DATASET_ID))
+def main(overwrite: bool = False, workers: int = 1, row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+         compression: str = DEFAULT_COMPRESSION, dataset_path: Path | None = None) -> None:
+
+    if dataset_path is None:
+        dataset_path = dataset_cache.resolve_dataset(DATASET_ID)
 
-    csv_files = list_csv_files(dataset_path)
+    dataset_path = Path(dataset_path)
+
+    # Sorted so metadata order is stable regardless of worker count
+    csv_files = sorted(list_csv_files(dataset_path))
     if not csv_files:
         raise FileNotFoundError("No CSV files found in Kaggle dataset")
 
     ensure_dir(BRONZE_ROOT)
 
-    parquet_count = 0
+    # -----------------
+    # Decide what to rebuild from the manifest
+    # -----------------
+
+    build_manifest = manifest.load_manifest(BRONZE_META)
+
+    csv_files = [path for path in csv_files if not is_skip_file(path, resolve_dataset_name(path))]
+
+    to_build = []
+    fingerprints = {}
+
+    for path in csv_files:
+        dataset_name = resolve_dataset_name(path)
+        out_path = BRONZE_ROOT / f"{dataset_name}.parquet"
+
+        stale, fingerprints[path] = manifest.needs_rebuild(build_manifest, out_path.name, path, out_path, CODE_VERSION)
+
+        if overwrite or stale:
+            to_build.append(path)
+        else:
+            print(f"Parquete {dataset_name} is up to date")
+
+    start = time.perf_counter()
+
+    with stage_metrics.profile_stage("ingest", BRONZE_META):
+        if workers > 1 and len(to_build) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # map yields in submission order, so records line up with to_build
+                results = list(executor.map(convert_csv, to_build, repeat(row_group_size),
+                                            repeat(compression), chunksize=4))
+        else:
+            results = [convert_csv(path, row_group_size, compression) for path in to_build]
+
+    elapsed = time.perf_counter() - start
+
+    built = {path: record for path, (record, _) in zip(to_build, results)}
+
+    metrics = [m for _, file_metrics in results for m in file_metrics]
+
+    # -----------------
+    # Update manifest; Failed files are left out so the next run retries them
+    # -----------------
 
     metadata = []
 
+    committed = []
+
     for path in csv_files:
-        
-        try:
-              
-            dataset_name = Path(path).stem
-
-            
-            # Fix single entry error
-            if dataset_name == "TOS Kaggle data week ending 2024 09 013csv":
-                dataset_name = "TOS Kaggle data week ending 2024 09 13"
-
-
-            skip_flag = False
-            # Ignore the example and any file not organized properly
-            if "Zipped data" not in str(path) or dataset_name == "TOS Kaggle data example.parquet":            
-                skip_flag = True
-            
-            
-            # Only establish if not a skip file, overwrite is false, and does not already exist
-            if not skip_flag and (overwrite or not os.path.exists(f"{BRONZE_ROOT}/{dataset_name}.parquet")):
-                df = pd.read_csv(path)
-                
-                df.to_parquet(f"{BRONZE_ROOT}/{dataset_name}.parquet", engine="pyarrow")
-            
-                print(df)
-            
-                parquet_count += 1
-                
-                metadata.append(add_metadata.add_clean_metadata_instance(file=f"{BRONZE_ROOT}/{dataset_name}.parquet",
-                                     layer="bronze",
-                                    process= "ingest",
-                                    sub_process= "N/A",
-                                    status= "conforming",
-                                    issue= "N/A",
-                                    action= "processed",
-                                    notes= "N/A"))
-                                            
-                
-            else:
-                print(f"Parquete {dataset_name} already exists")
-                
-        except:
-            print(f"Unexpected error on dataset {dataset_name}")
-            
-            metadata.append(add_metadata.add_clean_metadata_instance(file=f"{BRONZE_ROOT}/{dataset_name}.parquet",
-                                     layer="bronze",
-                                    process= "ingest",
-                                    sub_process= "N/A",
-                                    status= "non_onforming",
-                                    issue= "Unknown",
-                                    action= "skipped",
-                                    notes= "Skipped parquet due to unknown error"))
-            
+        out_path = BRONZE_ROOT / f"{resolve_dataset_name(path)}.parquet"
+
+        if path not in built:
+            metadata.extend(manifest.stored_records(build_manifest, out_path.name))
             continue
-        
-        
-    
+
+        record = built[path]
+        metadata.append(record)
+
+        if record["action"] == "processed":
+            manifest.record_build(build_manifest, out_path.name, fingerprints[path], out_path, CODE_VERSION, [record])
+            committed.append(out_path)
+
+    # One snapshot for the whole run; Readers of the log see every new file or none
+    table_log.commit(BRONZE_ROOT, committed, operation="ingest")
+    table_log.gc(BRONZE_ROOT)
+
+    manifest.save_manifest(BRONZE_META, build_manifest)
+
+    parquet_count = sum(1 for record in built.values() if record["action"] == "processed")
+
     print(f"Established {parquet_count} parquets")
-    
+    print(f"Ingested {len(to_build)} of {len(csv_files)} csv files in {elapsed:.2f}s with {workers} worker(s) "
+          f"({len(to_build) / elapsed if elapsed else 0:.2f} files/s)")
+
     # -----------------
     # Write metadata
     # -----------------
@@ -151,12 +356,23 @@ def main(overwrite: bool = False) -> None:
 
     with open(BRONZE_META / "ingestion_metadata.json", "w") as json_file:
         json.dump(metadata, json_file, indent=4)
-    
-    json_file.close()
 
-        
-        
+    stage_metrics.write_metrics(BRONZE_META, "ingestion_metrics.json", metrics)
+
+    if metrics:
+        print("Slowest files:")
+        stage_metrics.print_slowest(metrics)
 
 
 if __name__ == "__main__":
-    main()
+
+    parser = argparse.ArgumentParser(description="Write bronze parquets from the Kaggle dataset")
+    parser.add_argument("--overwrite", action="store_true", help="Rebuild every parquet, ignoring the manifest")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    parser.add_argument("--row-group-size", type=int, default=DEFAULT_ROW_GROUP_SIZE, help="Rows per parquet row group")
+    parser.add_argument("--compression", default=DEFAULT_COMPRESSION, help="Parquet compression codec (zstd, snappy, gzip, none...)")
+
+    args = parser.parse_args()
+
+    main(overwrite=args.overwrite, workers=args.workers, row_group_size=args.row_group_size,
+         compression=args.compression)
@@ -0,0 +1,232 @@
+"""
+Build the gold fact_prices table (long format) from the normalized silver dataset
+"""
+
+import os
+from pathlib import Path
+import json
+import polars as pl
+
+
+import sys
+
+
+root_dir = Path(__file__).resolve().parent.parent
+helper_path = str(root_dir / "helpers")
+
+if helper_path not in sys.path:
+    sys.path.append(helper_path)
+
+
+import add_metadata
+import manifest
+import stage_metrics
+
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_ROOT = Path(os.getenv("DATA_ROOT", PROJECT_ROOT / "data"))
+SILVER_NORMALIZE = DATA_ROOT / "silver" / "normalize"
+GOLD_ROOT = DATA_ROOT / "gold" / "fact_prices"
+GOLD_META = DATA_ROOT / "gold" / "fact_prices_metadata"
+
+
+SYMBOLS = ['/ES', '/NQ', '/RTY', 'SPY', 'QQQ', 'IWM']
+
+# Dictionary encoded symbol; Enum order is the clustering order of the table
+SYMBOL_DTYPE = pl.Enum(SYMBOLS)
+
+# Rows per row group; Small enough that one symbol of a file spans few, contiguous row groups
+ROW_GROUP_SIZE = 100_000
+
+# Version of this stage's logic; Bumps whenever this file or a helper it builds its outputs with changes
+CODE_VERSION = manifest.code_version(__file__, add_metadata.__file__)
+
+# ----------------------------
+# Helpers
+# ----------------------------
+
+"""
+Ensure directory of root is estavlished correctly
+
+@param: Path path - Path of directory
+@returns: None
+"""
+def ensure_dir(path: Path) -> None:
+    path.mkdir(parents=True, exist_ok=True)
+
+
+"""
+List silver partition files (year=YYYY/month=MM/*.parquet), ordered alphabeticaly
+
+@param:Path folder_path - root of the partitioned silver dataset
+@returns: list[Path] - partition files
+"""
+def list_partition_files(folder_path: Path) -> list[Path]:
+    return sorted(Path(folder_path).glob("year=*/month=*/*.parquet"))
+
+
+"""
+Gold file and manifest key of a silver partition file; The gold file mirrors its year/month partition
+
+@param:Path parquet - silver partition file
+@param:Path folder_path - root of the partitioned silver dataset
+@returns: tuple[Path, str] - gold file, manifest key
+"""
+def fact_path(parquet: Path, folder_path: Path = SILVER_NORMALIZE) -> tuple[Path, str]:
+    partition = Path(parquet).parent.relative_to(folder_path)
+    out_path = GOLD_ROOT / partition / Path(parquet).name.replace("_normalized", "_fact_prices")
+
+    return out_path, str(partition / out_path.name)
+
+
+"""
+Lazy unpivot of a wide silver file into (timestamp, time_key, symbol, price), clustered by symbol then timestamp;
+time_key joins dim_time on an int and is null outside the dim_time range (rows are kept, the file is flagged)
+
+@param:Path parquet - silver partition file
+@returns: pl.LazyFrame - long format plan
+"""
+def build_fact_plan(parquet: Path) -> pl.LazyFrame:
+    return (
+        pl.scan_parquet(parquet)
+        .select(["TimeStamp", "time_key", *SYMBOLS])
+        .unpivot(index=["TimeStamp", "time_key"], on=SYMBOLS, variable_name="symbol", value_name="price")
+        .select(
+            pl.col("TimeStamp").alias("timestamp"),
+            pl.col("time_key"),
+            pl.col("symbol").cast(SYMBOL_DTYPE),
+            pl.col("price"),
+        )
+        # Prices that could not be coerced in cleaning carry no fact
+        .filter(pl.col("price").is_not_null() & pl.col("price").is_not_nan())
+        .sort(["symbol", "timestamp"])
+    )
+
+
+"""
+Write the fact file of one silver partition file; Safe to run within a worker process
+
+@param:Path parquet - silver partition file
+@param:Path out_path - gold file to write
+@returns: tuple[list, list] - metadata records, metrics records
+"""
+def build_fact_file(parquet: Path, out_path: Path) -> tuple[list, list]:
+
+    metrics = []
+
+    print(f"Adding fact_prices for {parquet}")
+
+    with stage_metrics.measure(metrics, parquet, "gold", "fact_prices", "unpivot") as counts:
+
+        counts["bytes_read"] = stage_metrics.file_bytes(parquet)
+
+        ensure_dir(out_path.parent)
+
+        tmp_path = out_path.with_name(f".{out_path.name}.tmp")
+
+        build_fact_plan(parquet).sink_parquet(tmp_path, row_group_size=ROW_GROUP_SIZE)
+
+        os.replace(tmp_path, out_path)
+
+        counts["rows_in"] = pl.scan_parquet(parquet).select(pl.len()).collect().item()
+        counts["rows_out"], missing_keys = (
+            pl.scan_parquet(out_path).select(pl.len(), pl.col("time_key").null_count()).collect().row(0)
+        )
+        counts["bytes_written"] = stage_metrics.file_bytes(out_path)
+
+    records = [add_metadata.add_clean_metadata_instance(file=str(parquet),
+                                            layer= "gold",
+                                            process= "fact_prices",
+                                            sub_process= "unpivot",
+                                            status= "conforming",
+                                            issue= "N/A",
+                                            action="processed",
+                                            notes="N/A")]
+
+    # Rows outside dim_time have no time_key; They are loaded, but drop out of joins to dim_time
+    if missing_keys:
+        records.append(add_metadata.add_clean_metadata_instance(file=str(parquet),
+                                                layer= "gold",
+                                                process= "fact_prices",
+                                                sub_process= "time_key",
+                                                status= "non_conforming",
+                                                issue= "gold_fact_prices_time_key_1",
+                                                action="flagged",
+                                                notes=f"{missing_keys} rows outside dim_time; time_key is null"))
+
+    return records, metrics
+
+
+# -----------------------
+# Main func for fact_prices
+# ----------------------
+
+"""
+Main func for fact_prices - Makes one gold file per silver partition file, mirroring its year/month partition
+@param: Path folder_path - root of the partitioned silver dataset
+@param: bool overwrite - rebuild every file regardless of the manifest; False by default
+@returns: None
+"""
+def main(folder_path: Path = SILVER_NORMALIZE, overwrite: bool = False):
+
+    folder_path = Path(folder_path)
+
+    silver_files = list_partition_files(folder_path)
+
+    ensure_dir(GOLD_ROOT)
+
+    build_manifest = manifest.load_manifest(GOLD_META)
+
+    metadata = []
+
+    metrics = []
+
+    try:
+        with stage_metrics.profile_stage("fact_prices", GOLD_META):
+            for parquet in silver_files:
+
+                out_path, key = fact_path(parquet, folder_path)
+
+                # Skip files whose silver input and fact logic are unchanged
+                stale, input_fingerprint = manifest.needs_rebuild(build_manifest, key, parquet, out_path, CODE_VERSION)
+
+                if not (overwrite or stale):
+                    metadata.extend(manifest.stored_records(build_manifest, key))
+                    continue
+
+                records, file_metrics = build_fact_file(parquet, out_path)
+
+                metrics.extend(file_metrics)
+
+                metadata.extend(records)
+
+                manifest.record_build(build_manifest, key, input_fingerprint, out_path, CODE_VERSION, records)
+
+            # Drop gold files whose silver partition file no longer exists
+            expected = {str(fact_path(parquet, folder_path)[0]) for parquet in silver_files}
+
+            for key in list(build_manifest["entries"]):
+                stale_outputs = [path for path in manifest.stored_outputs(build_manifest, key) if path not in expected]
+
+                for path in stale_outputs:
+                    Path(path).unlink(missing_ok=True)
+
+                if stale_outputs:
+                    del build_manifest["entries"][key]
+
+    finally:
+        manifest.save_manifest(GOLD_META, build_manifest)
+
+    # -----------------
+    # Write metadata
+    # -----------------
+
+    with open(GOLD_META / "fact_prices_metadata.json", "w") as json_file:
+        json.dump(metadata, json_file, indent=4)
+
+    stage_metrics.write_metrics(GOLD_META, "fact_prices_metrics.json", metrics)
+
+
+if __name__ == "__main__":
+    main()
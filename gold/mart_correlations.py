@@ -0,0 +1,520 @@
+"""
+Build the gold cross-asset correlation mart from the normalized silver dataset.
+Per session sufficient statistics (n, mean, co-moment matrix) are computed once per file; Any window or date range is a merge of them
+"""
+
+import os
+from pathlib import Path
+from datetime import date
+import argparse
+import json
+import numpy as np
+import polars as pl
+
+
+import sys
+
+
+root_dir = Path(__file__).resolve().parent.parent
+helper_path = str(root_dir / "helpers")
+silver_path = str(root_dir / "silver")
+
+for path in [helper_path, silver_path]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+
+import add_metadata
+import dim_time
+import manifest
+import stage_metrics
+
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_ROOT = Path(os.getenv("DATA_ROOT", PROJECT_ROOT / "data"))
+SILVER_NORMALIZE = DATA_ROOT / "silver" / "normalize"
+GOLD_ROOT = DATA_ROOT / "gold" / "mart_correlations"
+GOLD_META = DATA_ROOT / "gold" / "mart_correlations_metadata"
+
+# Per session sufficient statistics; One file per silver partition file
+STATS_ROOT = GOLD_ROOT / "session_stats"
+
+
+SYMBOLS = ['/ES', '/NQ', '/RTY', 'SPY', 'QQQ', 'IWM']
+
+# Future and the ETF tracking the same index
+FUTURES_ETF_PAIRS = [('/ES', 'SPY'), ('/NQ', 'QQQ'), ('/RTY', 'IWM')]
+
+# Rolling windows in sessions
+DEFAULT_WINDOWS = [5, 20, 60]
+
+# Version of this stage's logic; Bumps whenever this file or a helper it builds its outputs with changes
+CODE_VERSION = manifest.code_version(__file__, add_metadata.__file__, dim_time.__file__)
+
+# ----------------------------
+# Helpers
+# ----------------------------
+
+"""
+Ensure directory of root is estavlished correctly
+
+@param: Path path - Path of directory
+@returns: None
+"""
+def ensure_dir(path: Path) -> None:
+    path.mkdir(parents=True, exist_ok=True)
+
+
+"""
+List silver partition files (year=YYYY/month=MM/*.parquet), ordered alphabeticaly
+
+@param:Path folder_path - root of the partitioned silver dataset
+@returns: list[Path] - partition files
+"""
+def list_partition_files(folder_path: Path) -> list[Path]:
+    return sorted(Path(folder_path).glob("year=*/month=*/*.parquet"))
+
+
+"""
+Session stats file of a silver partition file
+
+@param:Path folder_path - root of the partitioned silver dataset
+@param:Path parquet - silver partition file
+@returns: Path - stats file
+"""
+def stats_path(folder_path: Path, parquet: Path) -> Path:
+    return STATS_ROOT / parquet.parent.relative_to(folder_path) / parquet.name.replace("_normalized", "_stats")
+
+
+"""
+First and last TimeStamp of a silver file
+
+@param:Path parquet - silver partition file
+@returns: tuple - first, last TimeStamp
+"""
+def time_range(parquet: Path) -> tuple:
+    bounds = pl.scan_parquet(parquet).select(pl.col("TimeStamp").min().alias("first"),
+                                             pl.col("TimeStamp").max().alias("last")).collect()
+
+    return bounds["first"][0], bounds["last"][0]
+
+
+"""
+Files of older weeks sharing TimeStamps with a silver file. Duplicated rows have the same TimeStamp and so the same
+trading date, hence the same partition; Week names sort chronologically (stitch_series.week_sources)
+
+@param:Path parquet - silver partition file
+@param:dict ranges - silver file -> (first, last) TimeStamp
+@returns: list[Path] - overlapping files of older weeks
+"""
+def older_overlaps(parquet: Path, ranges: dict) -> list[Path]:
+    first, last = ranges[parquet]
+
+    return [
+        other for other, (other_first, other_last) in ranges.items()
+        if other.parent == parquet.parent and other.name < parquet.name
+        and other_first is not None and first is not None and other_first <= last and first <= other_last
+    ]
+
+
+"""
+Upper triangle (incl. diagonal) index pairs of the symbol matrix
+
+@returns: list[tuple[int, int]] - (i, j) with i <= j
+"""
+def triangle() -> list[tuple[int, int]]:
+    return [(i, j) for i in range(len(SYMBOLS)) for j in range(i, len(SYMBOLS))]
+
+
+"""
+Column names of a session stats frame
+
+@returns: tuple[list[str], list[str]] - mean cols, co-moment cols (upper triangle)
+"""
+def stats_columns() -> tuple[list[str], list[str]]:
+    means = [f"mean_{symbol}" for symbol in SYMBOLS]
+    comoments = [f"comoment_{SYMBOLS[i]}_{SYMBOLS[j]}" for i, j in triangle()]
+
+    return means, comoments
+
+
+# ----------------------------
+# Streaming covariance
+# ----------------------------
+
+"""
+Single pass sufficient statistics of a block of rows
+
+@param:np.ndarray x - (rows, symbols) returns, no NaN
+@returns: tuple[int, np.ndarray, np.ndarray] - n, mean vector, co-moment matrix (sum of centered cross products)
+"""
+def block_stats(x: np.ndarray) -> tuple[int, np.ndarray, np.ndarray]:
+    n = x.shape[0]
+
+    if n == 0:
+        return 0, np.zeros(x.shape[1]), np.zeros((x.shape[1], x.shape[1]))
+
+    mean = x.mean(axis=0)
+    centered = x - mean
+
+    return n, mean, centered.T @ centered
+
+
+"""
+Merge two sets of sufficient statistics (pairwise update of Chan et al.); Exact and order independent
+
+@param:tuple a - (n, mean, comoment)
+@param:tuple b - (n, mean, comoment)
+@returns: tuple[int, np.ndarray, np.ndarray] - merged (n, mean, comoment)
+"""
+def merge_stats(a: tuple, b: tuple) -> tuple[int, np.ndarray, np.ndarray]:
+    n_a, mean_a, comoment_a = a
+    n_b, mean_b, comoment_b = b
+
+    n = n_a + n_b
+
+    if n_a == 0:
+        return b
+    if n_b == 0:
+        return a
+
+    delta = mean_b - mean_a
+
+    mean = mean_a + delta * (n_b / n)
+    comoment = comoment_a + comoment_b + np.outer(delta, delta) * (n_a * n_b / n)
+
+    return n, mean, comoment
+
+
+"""
+Correlation matrix of a set of sufficient statistics
+
+@param:np.ndarray comoment - co-moment matrix
+@returns: np.ndarray - correlation matrix; NaN where a symbol has no variance
+"""
+def correlation(comoment: np.ndarray) -> np.ndarray:
+    scale = np.sqrt(np.diag(comoment))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return comoment / np.outer(scale, scale)
+
+
+# ----------------------------
+# Session stats
+# ----------------------------
+
+"""
+Per session sufficient statistics of the log returns of one silver file. A session is a trading date
+(dim_time.trading_date), so the 18:00 evening session counts with the day it trades for; Returns are taken within a
+session, so the gap between sessions never enters a correlation. A TimeStamp an older week also holds keeps that
+week's row (stitch_series' rule), so overlapping weeks count every row once
+
+@param:Path parquet - silver partition file
+@param:list[Path] | None older - overlapping files of older weeks
+@returns: pl.DataFrame - one row per session_date: n, mean_<symbol>, comoment_<a>_<b>
+"""
+def session_stats(parquet: Path, older: list[Path] | None = None) -> pl.DataFrame:
+
+    lazy_df = (
+        pl.scan_parquet(parquet)
+        .select(["TimeStamp", *SYMBOLS])
+        .sort("TimeStamp")
+        .with_columns(dim_time.trading_date().alias("session_date"))
+        .with_columns([(pl.col(symbol) / pl.col(symbol).shift(1)).log().over("session_date") for symbol in SYMBOLS])
+    )
+
+    # Returns are taken before dropping duplicates, so the first row past an overlap keeps its return
+    if older:
+        lazy_df = lazy_df.join(pl.scan_parquet(older).select("TimeStamp").unique(), on="TimeStamp", how="anti",
+                               maintain_order="left")
+
+    returns = (
+        lazy_df
+        # Rows where any instrument has no return are left out of every pair
+        .drop_nulls(SYMBOLS)
+        .filter(pl.all_horizontal([pl.col(symbol).is_finite() for symbol in SYMBOLS]))
+        .collect()
+    )
+
+    means, comoments = stats_columns()
+    rows = []
+
+    for (session_date,), session in returns.group_by("session_date", maintain_order=True):
+        n, mean, comoment = block_stats(session.select(SYMBOLS).to_numpy())
+
+        rows.append([session_date, n, *mean, *(comoment[i, j] for i, j in triangle())])
+
+    schema = {"session_date": pl.Date, "n": pl.Int64, **{col: pl.Float64 for col in means + comoments}}
+
+    return pl.DataFrame(rows, schema=schema, orient="row")
+
+
+"""
+Sufficient statistics of one stats row
+
+@param:dict row - row of a session stats frame
+@returns: tuple[int, np.ndarray, np.ndarray] - n, mean, comoment
+"""
+def row_stats(row: dict) -> tuple[int, np.ndarray, np.ndarray]:
+    means, _ = stats_columns()
+
+    comoment = np.zeros((len(SYMBOLS), len(SYMBOLS)))
+
+    for i, j in triangle():
+        comoment[i, j] = comoment[j, i] = row[f"comoment_{SYMBOLS[i]}_{SYMBOLS[j]}"]
+
+    return row["n"], np.array([row[col] for col in means]), comoment
+
+
+"""
+Read the stored session stats, merging sessions split over several files; Rows duplicated by overlapping weeks are
+already left out of the newer week's stats
+
+@param:date | None start - first session (inclusive)
+@param:date | None end - last session (inclusive)
+@param:Path root - session stats root
+@returns: list[tuple[date, tuple]] - (session_date, sufficient statistics), ordered by date
+"""
+def read_session_stats(start: date | None = None, end: date | None = None, root: Path = STATS_ROOT) -> list[tuple[date, tuple]]:
+
+    files = sorted(Path(root).glob("year=*/month=*/*.parquet"))
+
+    if not files:
+        return []
+
+    lazy_df = pl.scan_parquet(files)
+
+    if start is not None:
+        lazy_df = lazy_df.filter(pl.col("session_date") >= start)
+    if end is not None:
+        lazy_df = lazy_df.filter(pl.col("session_date") <= end)
+
+    sessions = {}
+
+    for row in lazy_df.sort("session_date").collect().iter_rows(named=True):
+        stats = row_stats(row)
+
+        previous = sessions.get(row["session_date"])
+        sessions[row["session_date"]] = stats if previous is None else merge_stats(previous, stats)
+
+    return list(sessions.items())
+
+
+"""
+Long format correlation rows of one window, one row per symbol pair
+
+@param:date window_end - last session of the window
+@param:int window - window length in sessions (0 for a single session)
+@param:tuple stats - merged sufficient statistics
+@returns: list[dict] - rows
+"""
+def correlation_rows(window_end: date, window: int, stats: tuple) -> list[dict]:
+    n, _, comoment = stats
+
+    matrix = correlation(comoment)
+
+    futures_etf = {frozenset(pair) for pair in FUTURES_ETF_PAIRS}
+
+    return [
+        {
+            "session_date": window_end,
+            "window_sessions": window,
+            "symbol_a": SYMBOLS[i],
+            "symbol_b": SYMBOLS[j],
+            "pair_type": "futures_etf" if frozenset((SYMBOLS[i], SYMBOLS[j])) in futures_etf else "cross_asset",
+            "n": n,
+            "correlation": float(matrix[i, j]),
+        }
+        for i, j in triangle() if i != j
+    ]
+
+
+# ----------------------------
+# Query entry point
+# ----------------------------
+
+"""
+Correlation matrix of any date range, merged from the stored per session statistics (no raw rows are read)
+
+@param:date | None start - first session (inclusive)
+@param:date | None end - last session (inclusive)
+@param:Path root - session stats root
+@returns: pl.DataFrame - symbol col plus one col per symbol
+"""
+def correlation_matrix(start: date | None = None, end: date | None = None, root: Path = STATS_ROOT) -> pl.DataFrame:
+
+    stats = (0, np.zeros(len(SYMBOLS)), np.zeros((len(SYMBOLS), len(SYMBOLS))))
+
+    for _, session in read_session_stats(start, end, root):
+        stats = merge_stats(stats, session)
+
+    matrix = correlation(stats[2])
+
+    return pl.DataFrame({"symbol": SYMBOLS, **{symbol: matrix[:, i] for i, symbol in enumerate(SYMBOLS)}})
+
+
+# -----------------------
+# Main func for mart_correlations
+# ----------------------
+
+"""
+Main func for mart_correlations - Updates session stats for changed silver files, then rebuilds the per session and rolling
+correlation tables from the stats (a few hundred bytes per session)
+@param: Path folder_path - root of the partitioned silver dataset
+@param: list[int] windows - rolling windows in sessions
+@param: bool overwrite - rebuild every file regardless of the manifest; False by default
+@returns: None
+"""
+def main(folder_path: Path = SILVER_NORMALIZE, windows: list[int] = DEFAULT_WINDOWS, overwrite: bool = False):
+
+    folder_path = Path(folder_path)
+
+    silver_files = list_partition_files(folder_path)
+
+    ensure_dir(GOLD_ROOT)
+
+    build_manifest = manifest.load_manifest(GOLD_META)
+
+    metadata = []
+
+    metrics = []
+
+    try:
+        with stage_metrics.profile_stage("mart_correlations", GOLD_META):
+            ranges = {parquet: time_range(parquet) for parquet in silver_files}
+
+            for parquet in silver_files:
+
+                partition = parquet.parent.relative_to(folder_path)
+                out_path = stats_path(folder_path, parquet)
+
+                key = str(partition / out_path.name)
+
+                stale, input_fingerprint = manifest.needs_rebuild(build_manifest, key, parquet, out_path, CODE_VERSION)
+
+                # Older weeks are built first (same partition, sorted by week), so their entries hold their current content
+                older = older_overlaps(parquet, ranges)
+                older_inputs = {}
+
+                for path in older:
+                    older_key = str(partition / stats_path(folder_path, path).name)
+                    older_inputs[older_key] = build_manifest["entries"][older_key]["input"]["sha256"]
+
+                stale = stale or manifest.cached_value(build_manifest, key, "older_inputs", input_fingerprint) != older_inputs
+
+                if not (overwrite or stale):
+                    metadata.extend(manifest.stored_records(build_manifest, key))
+                    continue
+
+                print(f"Adding session stats for {parquet}")
+
+                with stage_metrics.measure(metrics, parquet, "gold", "mart_correlations", "session_stats") as counts:
+
+                    counts["bytes_read"] = stage_metrics.file_bytes(parquet)
+
+                    stats = session_stats(parquet, older)
+
+                    ensure_dir(out_path.parent)
+
+                    tmp_path = out_path.with_name(f".{out_path.name}.tmp")
+
+                    stats.write_parquet(tmp_path)
+
+                    os.replace(tmp_path, out_path)
+
+                    counts["rows_in"] = int(stats["n"].sum())
+                    counts["rows_out"] = stats.height
+                    counts["bytes_written"] = stage_metrics.file_bytes(out_path)
+
+                records = [add_metadata.add_clean_metadata_instance(file=str(parquet),
+                                                        layer= "gold",
+                                                        process= "mart_correlations",
+                                                        sub_process= "session_stats",
+                                                        status= "conforming",
+                                                        issue= "N/A",
+                                                        action="processed",
+                                                        notes=f"{stats.height} sessions, {len(older)} overlapping older week file(s)")]
+
+                metadata.extend(records)
+
+                manifest.record_build(build_manifest, key, input_fingerprint, out_path, CODE_VERSION, records,
+                                      extra={"older_inputs": older_inputs})
+
+            # Drop stats whose silver partition file no longer exists
+            expected = {str(stats_path(folder_path, parquet)) for parquet in silver_files}
+
+            for key in list(build_manifest["entries"]):
+                stale_outputs = [path for path in manifest.stored_outputs(build_manifest, key) if path not in expected]
+
+                for path in stale_outputs:
+                    Path(path).unlink(missing_ok=True)
+
+                if stale_outputs:
+                    del build_manifest["entries"][key]
+
+            # -----------------
+            # Correlation tables
+            # -----------------
+
+            with stage_metrics.measure(metrics, STATS_ROOT, "gold", "mart_correlations", "correlations") as counts:
+
+                sessions = read_session_stats()
+
+                tables = {"sessions": [row for session_date, stats in sessions
+                                       for row in correlation_rows(session_date, 0, stats)]}
+
+                for window in windows:
+                    rows = []
+
+                    # Sliding merge of the last `window` sessions; Stats are tiny, so each window is re-merged
+                    for end in range(window - 1, len(sessions)):
+                        merged = sessions[end - window + 1][1]
+
+                        for _, stats in sessions[end - window + 2:end + 1]:
+                            merged = merge_stats(merged, stats)
+
+                        rows.extend(correlation_rows(sessions[end][0], window, merged))
+
+                    tables[f"rolling_{window}"] = rows
+
+                written = []
+
+                for name, rows in tables.items():
+                    out_path = GOLD_ROOT / f"{name}.parquet"
+                    tmp_path = out_path.with_name(f".{out_path.name}.tmp")
+
+                    pl.DataFrame(rows, schema={"session_date": pl.Date, "window_sessions": pl.Int64,
+                                               "symbol_a": pl.String, "symbol_b": pl.String, "pair_type": pl.String,
+                                               "n": pl.Int64, "correlation": pl.Float64}).write_parquet(tmp_path)
+
+                    os.replace(tmp_path, out_path)
+
+                    written.append(out_path)
+
+                counts["rows_in"] = len(sessions)
+                counts["rows_out"] = sum(len(rows) for rows in tables.values())
+                counts["bytes_written"] = stage_metrics.file_bytes(written)
+
+    finally:
+        manifest.save_manifest(GOLD_META, build_manifest)
+
+    # -----------------
+    # Write metadata
+    # -----------------
+
+    with open(GOLD_META / "mart_correlations_metadata.json", "w") as json_file:
+        json.dump(metadata, json_file, indent=4)
+
+    stage_metrics.write_metrics(GOLD_META, "mart_correlations_metrics.json", metrics)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Build the cross-asset correlation mart")
+    parser.add_argument("--windows", type=int, nargs="+", default=DEFAULT_WINDOWS, help="Rolling windows in sessions")
+    parser.add_argument("--overwrite", action="store_true", help="Rebuild every file, ignoring the manifest")
+
+    args = parser.parse_args()
+
+    main(windows=args.windows, overwrite=args.overwrite)
@@ -0,0 +1,323 @@
+"""
+Build the gold intraday metrics mart (log returns, rolling stats, session high/low) from fact_prices, incrementally
+"""
+
+import os
+from pathlib import Path
+import argparse
+import json
+import polars as pl
+
+
+import sys
+
+
+root_dir = Path(__file__).resolve().parent.parent
+helper_path = str(root_dir / "helpers")
+
+if helper_path not in sys.path:
+    sys.path.append(helper_path)
+
+
+import add_metadata
+import manifest
+import stage_metrics
+
+
+silver_path = str(root_dir / "silver")
+
+if silver_path not in sys.path:
+    sys.path.append(silver_path)
+
+
+import dim_time
+
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_ROOT = Path(os.getenv("DATA_ROOT", PROJECT_ROOT / "data"))
+FACT_ROOT = DATA_ROOT / "gold" / "fact_prices"
+GOLD_ROOT = DATA_ROOT / "gold" / "mart_intraday_metrics"
+GOLD_META = DATA_ROOT / "gold" / "mart_intraday_metrics_metadata"
+
+# Tail of each file carried into the next one, so windows never need the full history
+STATE_ROOT = GOLD_META / "state"
+
+
+# Rolling windows in rows (snapshots) per symbol
+DEFAULT_WINDOWS = [20, 60, 390]
+
+# Version of this stage's logic; Bumps whenever this file or a helper it builds its outputs with changes
+CODE_VERSION = manifest.code_version(__file__, add_metadata.__file__, dim_time.__file__)
+
+# ----------------------------
+# Helpers
+# ----------------------------
+
+"""
+Ensure directory of root is estavlished correctly
+
+@param: Path path - Path of directory
+@returns: None
+"""
+def ensure_dir(path: Path) -> None:
+    path.mkdir(parents=True, exist_ok=True)
+
+
+"""
+List fact_prices files in chronological order (partition, then week)
+
+@param:Path folder_path - root of the fact_prices dataset
+@returns: list[Path] - fact files
+"""
+def list_fact_files(folder_path: Path) -> list[Path]:
+    return sorted(Path(folder_path).glob("year=*/month=*/*.parquet"))
+
+
+"""
+Manifest key and outputs of a fact file
+
+@param:Path folder_path - root of the fact_prices dataset
+@param:Path parquet - fact file
+@returns: tuple[str, list[Path]] - key, [rolling, sessions, tail state] files
+"""
+def output_paths(folder_path: Path, parquet: Path) -> tuple[str, list[Path]]:
+    partition = parquet.parent.relative_to(folder_path)
+    name = parquet.stem.replace("_fact_prices", "")
+
+    return str(partition / name), [GOLD_ROOT / "rolling" / partition / f"{name}_metrics.parquet",
+                                   GOLD_ROOT / "sessions" / partition / f"{name}_sessions.parquet",
+                                   STATE_ROOT / partition / f"{name}_tail.parquet"]
+
+
+"""
+Rolling metrics of a long format frame; Window kernels run per symbol
+
+@param:pl.LazyFrame lazy_df - (timestamp, symbol, price) sorted by symbol then timestamp
+@param:list[int] windows - rolling windows in rows
+@returns: pl.LazyFrame - input with log_return and one mean/std/realized vol col per window
+"""
+def rolling_metrics(lazy_df: pl.LazyFrame, windows: list[int]) -> pl.LazyFrame:
+
+    lazy_df = lazy_df.with_columns(
+        (pl.col("price") / pl.col("price").shift(1)).log().over("symbol").alias("log_return")
+    )
+
+    columns = []
+
+    for window in windows:
+        columns.extend([
+            pl.col("price").rolling_mean(window).over("symbol").alias(f"price_mean_{window}"),
+            pl.col("log_return").rolling_std(window).over("symbol").alias(f"return_std_{window}"),
+            (pl.col("log_return") ** 2).rolling_sum(window).sqrt().over("symbol").alias(f"realized_vol_{window}"),
+        ])
+
+    return lazy_df.with_columns(columns)
+
+
+"""
+Session high/low/open/close per symbol, trading date and session; Trading date and session come from dim_time, so an
+evening session that opens the day before stays with its trading date
+
+@param:pl.LazyFrame lazy_df - (timestamp, time_key, symbol, price) sorted by symbol then timestamp
+@param:pl.LazyFrame dim - dim_time (time_key, trading_date, session)
+@returns: pl.LazyFrame - one row per symbol, trading date and session
+"""
+def session_ranges(lazy_df: pl.LazyFrame, dim: pl.LazyFrame) -> pl.LazyFrame:
+    return (
+        lazy_df
+        .join(dim.select("time_key", "trading_date", "session"), on="time_key", how="left", maintain_order="left")
+        .group_by("symbol", "trading_date", "session", maintain_order=True)
+        .agg(
+            pl.col("price").first().alias("open"),
+            pl.col("price").max().alias("high"),
+            pl.col("price").min().alias("low"),
+            pl.col("price").last().alias("close"),
+            pl.len().alias("rows"),
+        )
+    )
+
+
+"""
+Compute the metrics of one fact file, seeded with the tail of the previous file
+
+@param:Path parquet - fact file
+@param:pl.DataFrame | None tail - last rows per symbol of the previous file; None for the first file
+@param:list[int] windows - rolling windows in rows
+@param:Path dim_path - dim_time parquet
+@returns: tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame] - rolling metrics, session ranges, tail for the next file
+"""
+def compute_file(parquet: Path, tail: pl.DataFrame | None, windows: list[int],
+                 dim_path: Path = dim_time.DIM_TIME_PATH) -> tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame]:
+
+    current = pl.scan_parquet(parquet).select("timestamp", "time_key", "symbol", "price").with_columns(pl.lit(False).alias("carried"))
+
+    if tail is not None:
+        carried = tail.lazy().with_columns(pl.lit(True).alias("carried"))
+
+        current = pl.concat([carried, current], how="vertical_relaxed").sort(["symbol", "timestamp"], maintain_order=True)
+
+    metrics = rolling_metrics(current, windows).collect()
+
+    # Returns need one price before the largest window
+    tail_rows = max(windows) + 1
+
+    next_tail = (
+        metrics
+        .filter(pl.int_range(pl.len()).over("symbol") >= pl.len().over("symbol") - tail_rows)
+        .select("timestamp", "time_key", "symbol", "price")
+    )
+
+    metrics = metrics.filter(~pl.col("carried")).drop("carried")
+
+    # Only the minutes of this file; time_key stats prune the dimension's row groups
+    dim = pl.scan_parquet(dim_path).filter(pl.col("time_key").is_between(metrics["time_key"].min(), metrics["time_key"].max()))
+
+    sessions = session_ranges(metrics.lazy().select("timestamp", "time_key", "symbol", "price"), dim).collect()
+
+    return metrics, sessions, next_tail
+
+
+"""
+Write a frame atomically
+
+@param:pl.DataFrame df - frame to write
+@param:Path out_path - parquet path
+@returns: None
+"""
+def write_atomic(df: pl.DataFrame, out_path: Path) -> None:
+    ensure_dir(out_path.parent)
+
+    tmp_path = out_path.with_name(f".{out_path.name}.tmp")
+
+    df.write_parquet(tmp_path)
+
+    os.replace(tmp_path, out_path)
+
+
+# -----------------------
+# Main func for mart_intraday_metrics
+# ----------------------
+
+"""
+Main func for the intraday metrics mart - Only files whose fact input changed (and the files after them) are recomputed.
+A new week loads the tail state of the previous week instead of recomputing the history
+@param: Path folder_path - root of the fact_prices dataset
+@param: list[int] windows - rolling windows in rows
+@param: bool overwrite - rebuild every file regardless of the manifest; False by default
+@returns: None
+"""
+def main(folder_path: Path = FACT_ROOT, windows: list[int] = DEFAULT_WINDOWS, overwrite: bool = False):
+
+    folder_path = Path(folder_path)
+
+    fact_files = list_fact_files(folder_path)
+
+    # Sessions are keyed by the time dimension
+    if not dim_time.DIM_TIME_PATH.is_file():
+        dim_time.main()
+
+    ensure_dir(GOLD_ROOT)
+
+    build_manifest = manifest.load_manifest(GOLD_META)
+
+    # Windows are part of the logic; Changing them rebuilds the mart
+    version = f"{CODE_VERSION}-{'_'.join(str(window) for window in windows)}"
+
+    metadata = []
+
+    metrics_records = []
+
+    tail = None
+
+    # Once a file is rebuilt every later file is too, since its windows start from the new tail
+    dirty = overwrite
+
+    try:
+        with stage_metrics.profile_stage("mart_intraday_metrics", GOLD_META):
+            # Drop the outputs of fact files that no longer exist
+            expected = {output_paths(folder_path, parquet)[0] for parquet in fact_files}
+            removed = sorted(key for key in build_manifest["entries"] if key not in expected)
+
+            for key in removed:
+                for path in manifest.stored_outputs(build_manifest, key):
+                    Path(path).unlink(missing_ok=True)
+
+                del build_manifest["entries"][key]
+
+            for index, parquet in enumerate(fact_files):
+
+                key, (rolling_path, session_path, state_path) = output_paths(folder_path, parquet)
+
+                stale, input_fingerprint = manifest.needs_rebuild(build_manifest, key, parquet,
+                                                                  [rolling_path, session_path, state_path], version)
+
+                # Files after a removed one were seeded from a tail that no longer exists
+                stale = stale or (bool(removed) and key > removed[0])
+
+                if not (dirty or stale):
+                    metadata.extend(manifest.stored_records(build_manifest, key))
+
+                    # Tail is only loaded from disk when the next file needs it
+                    tail = None
+                    continue
+
+                dirty = True
+
+                # Seed from the previous file's stored tail when it was not computed in this run
+                if tail is None and index > 0:
+                    previous_state = output_paths(folder_path, fact_files[index - 1])[1][2]
+
+                    tail = pl.read_parquet(previous_state) if previous_state.is_file() else None
+
+                print(f"Adding intraday metrics for {parquet}")
+
+                with stage_metrics.measure(metrics_records, parquet, "gold", "mart_intraday_metrics", "rolling") as counts:
+
+                    counts["bytes_read"] = stage_metrics.file_bytes(parquet)
+
+                    rolling, sessions, tail = compute_file(parquet, tail, windows)
+
+                    write_atomic(rolling, rolling_path)
+                    write_atomic(sessions, session_path)
+                    write_atomic(tail, state_path)
+
+                    counts["rows_in"] = counts["rows_out"] = rolling.height
+                    counts["bytes_written"] = stage_metrics.file_bytes([rolling_path, session_path])
+
+                records = [add_metadata.add_clean_metadata_instance(file=str(parquet),
+                                                        layer= "gold",
+                                                        process= "mart_intraday_metrics",
+                                                        sub_process= "rolling",
+                                                        status= "conforming",
+                                                        issue= "N/A",
+                                                        action="processed",
+                                                        notes=f"windows {windows}")]
+
+                metadata.extend(records)
+
+                manifest.record_build(build_manifest, key, input_fingerprint,
+                                      [rolling_path, session_path, state_path], version, records)
+
+    finally:
+        manifest.save_manifest(GOLD_META, build_manifest)
+
+    # -----------------
+    # Write metadata
+    # -----------------
+
+    with open(GOLD_META / "mart_intraday_metrics_metadata.json", "w") as json_file:
+        json.dump(metadata, json_file, indent=4)
+
+    stage_metrics.write_metrics(GOLD_META, "mart_intraday_metrics_metrics.json", metrics_records)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Build the intraday metrics mart from fact_prices")
+    parser.add_argument("--windows", type=int, nargs="+", default=DEFAULT_WINDOWS, help="Rolling windows in rows")
+    parser.add_argument("--overwrite", action="store_true", help="Rebuild every file, ignoring the manifest")
+
+    args = parser.parse_args()
+
+    main(windows=args.windows, overwrite=args.overwrite)
@@ -0,0 +1,375 @@
+"""
+Build gold OHLC bars per instrument at several resolutions from the normalized silver dataset.
+The finest resolution is aggregated from raw rows, every coarser one from the resolution before it; Bars of each week file
+are merged per partition, so a bar spanning two files is one bar
+"""
+
+import os
+from pathlib import Path
+import argparse
+import json
+import polars as pl
+
+
+import sys
+
+
+root_dir = Path(__file__).resolve().parent.parent
+helper_path = str(root_dir / "helpers")
+gold_path = str(root_dir / "gold")
+silver_path = str(root_dir / "silver")
+
+for path in [helper_path, gold_path, silver_path]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+
+import add_metadata
+import manifest
+import stage_metrics
+import dim_time
+import fact_prices
+
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_ROOT = Path(os.getenv("DATA_ROOT", PROJECT_ROOT / "data"))
+SILVER_NORMALIZE = DATA_ROOT / "silver" / "normalize"
+GOLD_ROOT = DATA_ROOT / "gold" / "bars"
+GOLD_META = DATA_ROOT / "gold" / "bars_metadata"
+
+# Bars of each silver week file before they are merged per partition
+PARTIAL_ROOT = DATA_ROOT / "gold" / "bars_partial"
+
+
+# Resolution name -> polars duration, finest first; Each resolution must divide the next one
+RESOLUTIONS = {
+    "1m": "1m",
+    "5m": "5m",
+    "15m": "15m",
+    "1h": "1h",
+    "1d": "1d",
+}
+
+# Daily bars are trading dates (dim_time.trading_date), so the 18:00 evening session opens the next day's bar
+TRADING_DAY = "1d"
+
+# Version of this stage's logic; Bumps whenever this file or a helper it builds its outputs with changes
+CODE_VERSION = manifest.code_version(__file__, add_metadata.__file__, fact_prices.__file__, dim_time.__file__)
+
+# ----------------------------
+# Helpers
+# ----------------------------
+
+"""
+Ensure directory of root is estavlished correctly
+
+@param: Path path - Path of directory
+@returns: None
+"""
+def ensure_dir(path: Path) -> None:
+    path.mkdir(parents=True, exist_ok=True)
+
+
+"""
+Partial bar file of one resolution and silver partition file
+
+@param:str resolution - resolution name (key of RESOLUTIONS)
+@param:Path partition - year=YYYY/month=MM of the silver file
+@param:str name - silver file name
+@returns: Path - data/gold/bars_partial/resolution=<r>/year=YYYY/month=MM/<week>_bars.parquet
+"""
+def bar_path(resolution: str, partition: Path, name: str) -> Path:
+    return PARTIAL_ROOT / f"resolution={resolution}" / partition / name.replace("_normalized", "_bars")
+
+
+"""
+Merged bar file of one resolution and partition
+
+@param:str resolution - resolution name (key of RESOLUTIONS)
+@param:Path partition - year=YYYY/month=MM
+@returns: Path - data/gold/bars/resolution=<r>/year=YYYY/month=MM/bars.parquet
+"""
+def merged_path(resolution: str, partition: Path) -> Path:
+    return GOLD_ROOT / f"resolution={resolution}" / partition / "bars.parquet"
+
+
+"""
+Partition (year=YYYY/month=MM) of a partial bar file
+
+@param:Path path - partial bar file
+@returns: Path - partition
+"""
+def partial_partition(path: Path) -> Path:
+    return Path(*Path(path).parts[-3:-1])
+
+
+"""
+Bars at the finest resolution from raw (timestamp, symbol, price) rows
+
+@param:pl.LazyFrame lazy_df - long format rows, sorted by symbol then timestamp
+@param:str every - bar length (polars duration)
+@returns: pl.LazyFrame - symbol, bar_start, open, high, low, close, ticks
+"""
+def bars_from_rows(lazy_df: pl.LazyFrame, every: str) -> pl.LazyFrame:
+    return (
+        lazy_df
+        .group_by_dynamic("timestamp", every=every, group_by="symbol", label="left", closed="left")
+        .agg(
+            pl.col("price").first().alias("open"),
+            pl.col("price").max().alias("high"),
+            pl.col("price").min().alias("low"),
+            pl.col("price").last().alias("close"),
+            pl.len().cast(pl.Int64).alias("ticks"),
+        )
+        .rename({"timestamp": "bar_start"})
+    )
+
+
+"""
+Aggregations combining bars into one bar; Input bars in time order
+
+@returns: list[pl.Expr] - open, high, low, close, ticks
+"""
+def combine_bars() -> list[pl.Expr]:
+    return [
+        pl.col("open").first(),
+        pl.col("high").max(),
+        pl.col("low").min(),
+        pl.col("close").last(),
+        pl.col("ticks").sum(),
+    ]
+
+
+"""
+Coarser bars from finer bars; Exact since every fine bar falls in exactly one coarse bar. Daily bars group by trading
+date (bar_start is the trading date at midnight); Every finer bar starts on the hour or finer, so none spans 18:00
+
+@param:pl.LazyFrame bars - finer bars, sorted by symbol then bar_start
+@param:str every - bar length (polars duration)
+@returns: pl.LazyFrame - symbol, bar_start, open, high, low, close, ticks
+"""
+def bars_from_bars(bars: pl.LazyFrame, every: str) -> pl.LazyFrame:
+    if every == TRADING_DAY:
+        return (
+            bars
+            .with_columns(dim_time.trading_date("bar_start").cast(pl.Datetime("ms")).alias("trading_day"))
+            .group_by("symbol", "trading_day", maintain_order=True)
+            .agg(combine_bars())
+            .rename({"trading_day": "bar_start"})
+        )
+
+    return (
+        bars
+        .group_by_dynamic("bar_start", every=every, group_by="symbol", label="left", closed="left")
+        .agg(combine_bars())
+    )
+
+
+"""
+Merge the partial bars of every week file of a partition; Bars sharing a bar_start (a period spanning two files) become
+one bar: open of the oldest week, max high, min low, close of the newest week, summed ticks
+
+@param:list[Path] paths - partial bar files of one resolution and partition
+@returns: pl.DataFrame - symbol, bar_start, open, high, low, close, ticks
+"""
+def merge_partials(paths: list[Path]) -> pl.DataFrame:
+    return (
+        pl.scan_parquet(sorted(paths), include_file_paths="part")
+        # Week names sort chronologically
+        .sort("symbol", "bar_start", "part")
+        .group_by("symbol", "bar_start", maintain_order=True)
+        .agg(combine_bars())
+        .collect()
+    )
+
+
+"""
+Plans of every resolution of one silver file; The raw rows are only scanned for the finest one
+
+@param:Path parquet - silver partition file
+@returns: dict[str, pl.LazyFrame] - resolution name -> bars plan
+"""
+def build_bar_plans(parquet: Path) -> dict[str, pl.LazyFrame]:
+
+    plans = {}
+    previous = None
+
+    for resolution, every in RESOLUTIONS.items():
+        if previous is None:
+            plans[resolution] = bars_from_rows(fact_prices.build_fact_plan(parquet), every)
+        else:
+            plans[resolution] = bars_from_bars(plans[previous], every)
+
+        previous = resolution
+
+    return plans
+
+
+# -----------------------
+# Main func for ohlc_bars
+# ----------------------
+
+"""
+Main func for ohlc_bars - Makes partial bars per resolution and silver partition file, then merges the partials of every
+changed partition into one bar file per resolution, partitioned by resolution/year/month
+@param: Path folder_path - root of the partitioned silver dataset
+@param: bool overwrite - rebuild every file regardless of the manifest; False by default
+@returns: None
+"""
+def main(folder_path: Path = SILVER_NORMALIZE, overwrite: bool = False):
+
+    folder_path = Path(folder_path)
+
+    silver_files = fact_prices.list_partition_files(folder_path)
+
+    ensure_dir(GOLD_ROOT)
+
+    build_manifest = manifest.load_manifest(GOLD_META)
+
+    metadata = []
+
+    metrics = []
+
+    # Partitions whose partial bars changed; Their merged bars are rebuilt
+    touched = set()
+
+    try:
+        with stage_metrics.profile_stage("ohlc_bars", GOLD_META):
+            for parquet in silver_files:
+
+                partition = parquet.parent.relative_to(folder_path)
+                out_paths = {resolution: bar_path(resolution, partition, parquet.name) for resolution in RESOLUTIONS}
+
+                key = str(partition / parquet.name)
+
+                stale, input_fingerprint = manifest.needs_rebuild(build_manifest, key, parquet,
+                                                                  list(out_paths.values()), CODE_VERSION)
+
+                if not (overwrite or stale):
+                    metadata.extend(manifest.stored_records(build_manifest, key))
+
+                    if not all(merged_path(resolution, partition).is_file() for resolution in RESOLUTIONS):
+                        touched.add(partition)
+                    continue
+
+                print(f"Adding bars for {parquet}")
+
+                with stage_metrics.measure(metrics, parquet, "gold", "ohlc_bars", "resample") as counts:
+
+                    counts["bytes_read"] = stage_metrics.file_bytes(parquet)
+
+                    plans = build_bar_plans(parquet)
+
+                    # One collect; The shared finer plans are computed once
+                    frames = dict(zip(plans, pl.collect_all(list(plans.values()))))
+
+                    for resolution, bars in frames.items():
+                        out_path = out_paths[resolution]
+
+                        ensure_dir(out_path.parent)
+
+                        tmp_path = out_path.with_name(f".{out_path.name}.tmp")
+
+                        bars.write_parquet(tmp_path)
+
+                        os.replace(tmp_path, out_path)
+
+                    counts["rows_in"] = int(frames[next(iter(RESOLUTIONS))]["ticks"].sum())
+                    counts["rows_out"] = sum(bars.height for bars in frames.values())
+                    counts["bytes_written"] = stage_metrics.file_bytes(list(out_paths.values()))
+
+                records = [add_metadata.add_clean_metadata_instance(file=str(parquet),
+                                                        layer= "gold",
+                                                        process= "ohlc_bars",
+                                                        sub_process= "resample",
+                                                        status= "conforming",
+                                                        issue= "N/A",
+                                                        action="processed",
+                                                        notes=", ".join(f"{resolution}: {bars.height} bars" for resolution, bars in frames.items()))]
+
+                metadata.extend(records)
+
+                # Outputs of an older layout
+                for path in manifest.stored_outputs(build_manifest, key):
+                    if path not in {str(out_path) for out_path in out_paths.values()}:
+                        Path(path).unlink(missing_ok=True)
+
+                manifest.record_build(build_manifest, key, input_fingerprint, list(out_paths.values()), CODE_VERSION, records)
+
+                touched.add(partition)
+
+            # Drop bars whose silver partition file no longer exists
+            expected = {str(bar_path(resolution, parquet.parent.relative_to(folder_path), parquet.name))
+                        for parquet in silver_files for resolution in RESOLUTIONS}
+
+            for key in list(build_manifest["entries"]):
+                stale_outputs = [path for path in manifest.stored_outputs(build_manifest, key) if path not in expected]
+
+                for path in stale_outputs:
+                    Path(path).unlink(missing_ok=True)
+
+                    touched.add(partial_partition(path))
+
+                if stale_outputs:
+                    del build_manifest["entries"][key]
+
+            # -----------------
+            # Merged bars
+            # -----------------
+
+            for partition in sorted(touched):
+                with stage_metrics.measure(metrics, GOLD_ROOT / partition, "gold", "ohlc_bars", "merge") as counts:
+                    read = []
+                    written = []
+                    rows_out = 0
+
+                    for resolution in RESOLUTIONS:
+                        partials = sorted((PARTIAL_ROOT / f"resolution={resolution}" / partition).glob("*.parquet"))
+                        out_path = merged_path(resolution, partition)
+
+                        if not partials:
+                            out_path.unlink(missing_ok=True)
+                            continue
+
+                        print(f"Merging {resolution} bars of {partition}")
+
+                        bars = merge_partials(partials)
+
+                        ensure_dir(out_path.parent)
+
+                        tmp_path = out_path.with_name(f".{out_path.name}.tmp")
+
+                        bars.write_parquet(tmp_path)
+
+                        os.replace(tmp_path, out_path)
+
+                        read.extend(partials)
+                        written.append(out_path)
+                        rows_out += bars.height
+
+                    counts["rows_out"] = rows_out
+                    counts["bytes_read"] = stage_metrics.file_bytes(read)
+                    counts["bytes_written"] = stage_metrics.file_bytes(written)
+
+    finally:
+        manifest.save_manifest(GOLD_META, build_manifest)
+
+    # -----------------
+    # Write metadata
+    # -----------------
+
+    with open(GOLD_META / "bars_metadata.json", "w") as json_file:
+        json.dump(metadata, json_file, indent=4)
+
+    stage_metrics.write_metrics(GOLD_META, "bars_metrics.json", metrics)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Build OHLC bars at every resolution from the normalized silver dataset")
+    parser.add_argument("--overwrite", action="store_true", help="Rebuild every file, ignoring the manifest")
+
+    args = parser.parse_args()
+
+    main(overwrite=args.overwrite)
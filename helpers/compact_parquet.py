@@ -0,0 +1,494 @@
+"""
+Helper for compacting the bronze and silver lakes; Rewrites a layer's small weekly parquets into target sized, sorted files
+with per col encodings. Each compaction is a new version folder, published by atomically replacing a pointer file
+"""
+
+from pathlib import Path
+from datetime import datetime
+import argparse
+import json
+import os
+import shutil
+import time
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import manifest
+import stage_metrics
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_ROOT = Path(os.getenv("DATA_ROOT", PROJECT_ROOT / "data"))
+COMPACTED_ROOT = DATA_ROOT / "compacted"
+
+# Layer -> (source folder, Hive partitioned, sort col); Bronze and cleaning TimeStamps are raw text, so those layers keep
+# the week and row (ID) order of their source files instead of a TimeStamp sort
+LAYERS = {
+    "intraday_prices": (DATA_ROOT / "bronze" / "intraday_prices", False, None),
+    "cleaning": (DATA_ROOT / "silver" / "cleaning", False, None),
+    "normalize": (DATA_ROOT / "silver" / "normalize", True, "TimeStamp"),
+}
+
+# Input bytes per compacted file
+TARGET_FILE_BYTES = 128 * 1024 ** 2
+
+# Rows per row group; About a week of minute rows, so TimeStamp stats prune to the week
+ROW_GROUP_ROWS = 131_072
+
+COMPRESSION = "zstd"
+COMPRESSION_LEVEL = 9
+
+# Rows of a col encoded both ways to choose its encoding
+ENCODING_SAMPLE_ROWS = 65_536
+
+# Provenance col added to every compacted row; Dictionary encoded, one value per source week
+SOURCE_COL = "source_file"
+
+# Published version of a layer
+POINTER_NAME = "_current.json"
+
+# Versions kept on disk, the published one included
+KEEP_VERSIONS = 2
+
+# Version of this helper's logic; Bumps whenever this file changes
+CODE_VERSION = manifest.code_version(__file__)
+
+# ----------------------------
+# Helpers
+# ----------------------------
+
+"""
+Source files of a layer; In-progress temp files are ignored
+
+@param:Path source_root - layer folder
+@param:bool partitioned - Hive partitioned (year=/month=) layer
+@returns: list[Path] - parquet files in name order
+"""
+def source_files(source_root: Path, partitioned: bool) -> list[Path]:
+    pattern = "year=*/month=*/*.parquet" if partitioned else "*.parquet"
+
+    return sorted(path for path in Path(source_root).glob(pattern) if not path.name.startswith("."))
+
+
+"""
+Group source files into compacted files. Files only share a bin with files of the same partition and schema
+(schema issue files keep their own cols) and a bin holds up to target_bytes of input
+
+@param:list[Path] files - source files
+@param:Path source_root - layer folder
+@param:bool partitioned - Hive partitioned layer
+@param:int target_bytes - input bytes per bin
+@returns: list[tuple[Path, list[Path]]] - (partition folder relative to the layer, files) per bin
+"""
+def plan_bins(files: list[Path], source_root: Path, partitioned: bool, target_bytes: int = TARGET_FILE_BYTES) -> list[tuple[Path, list[Path]]]:
+
+    bins = []
+    current_key = None
+    current_bytes = 0
+
+    for path in files:
+        partition = path.parent.relative_to(source_root) if partitioned else Path(".")
+        key = (partition, pq.read_schema(path).remove_metadata())
+
+        size = path.stat().st_size
+
+        if bins and key == current_key and current_bytes + size <= target_bytes:
+            bins[-1][1].append(path)
+            current_bytes += size
+            continue
+
+        bins.append((partition, [path]))
+        current_key = key
+        current_bytes = size
+
+    return bins
+
+
+"""
+Compressed size of a sample col written with one encoding
+
+@param:pa.Table sample - single col table
+@param:str | None encoding - parquet encoding; None for dictionary
+@param:int compression_level - zstd level
+@returns: int - bytes
+"""
+def encoded_size(sample: pa.Table, encoding: str | None, compression_level: int = COMPRESSION_LEVEL) -> int:
+    sink = pa.BufferOutputStream()
+
+    name = sample.column_names[0]
+
+    options = {"use_dictionary": True} if encoding is None else {"use_dictionary": False, "column_encoding": {name: encoding}}
+
+    pq.write_table(sample, sink, compression=COMPRESSION, compression_level=compression_level, **options)
+
+    return sink.getvalue().size
+
+
+"""
+Parquet encoding of each col. Ints and timestamps are delta encoded; Floats and text are encoded both ways on a sample
+(dictionary vs byte stream split / delta byte array) and keep the smaller, since tick quoted prices repeat often enough
+that dictionary usually wins
+
+@param:pa.Table table - compacted table
+@param:int compression_level - zstd level
+@returns: tuple[list[str], dict[str, str]] - dictionary encoded cols, {col: encoding} of the others
+"""
+def column_encodings(table: pa.Table, compression_level: int = COMPRESSION_LEVEL) -> tuple[list[str], dict[str, str]]:
+
+    dictionary = []
+    encodings = {}
+
+    for field in table.schema:
+        is_text = pa.types.is_string(field.type) or pa.types.is_large_string(field.type)
+
+        if pa.types.is_integer(field.type) or pa.types.is_timestamp(field.type):
+            encodings[field.name] = "DELTA_BINARY_PACKED"
+            continue
+
+        if not (pa.types.is_floating(field.type) or is_text):
+            dictionary.append(field.name)
+            continue
+
+        sample = table.select([field.name]).slice(0, ENCODING_SAMPLE_ROWS)
+        encoding = "DELTA_BYTE_ARRAY" if is_text else "BYTE_STREAM_SPLIT"
+
+        if encoded_size(sample, encoding, compression_level) < encoded_size(sample, None, compression_level):
+            encodings[field.name] = encoding
+        else:
+            dictionary.append(field.name)
+
+    return dictionary, encodings
+
+
+"""
+Write one bin as a compacted file
+
+@param:list[Path] files - source files of the bin
+@param:Path out_path - compacted file
+@param:str | None sort_col - col to sort by; None keeps source order
+@param:int row_group_rows - rows per row group
+@param:int compression_level - zstd level
+@returns: int - rows written
+"""
+def write_bin(files: list[Path], out_path: Path, sort_col: str | None, row_group_rows: int = ROW_GROUP_ROWS,
+              compression_level: int = COMPRESSION_LEVEL) -> int:
+
+    tables = []
+
+    for path in files:
+        table = pq.read_table(path)
+
+        source = pa.DictionaryArray.from_arrays(pa.repeat(pa.scalar(0, pa.int32()), table.num_rows), pa.array([path.name]))
+
+        tables.append(table.append_column(SOURCE_COL, source))
+
+    table = pa.concat_tables(tables, promote_options="permissive").combine_chunks()
+
+    # Stable, so equal TimeStamps keep their week and row order
+    if sort_col is not None:
+        table = table.sort_by(sort_col)
+
+    dictionary, encodings = column_encodings(table, compression_level)
+
+    sorting = [pq.SortingColumn(table.schema.get_field_index(sort_col))] if sort_col is not None else None
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with pq.ParquetWriter(out_path, table.schema, compression=COMPRESSION, compression_level=compression_level,
+                          use_dictionary=dictionary, column_encoding=encodings, sorting_columns=sorting,
+                          write_statistics=True) as writer:
+        writer.write_table(table, row_group_size=row_group_rows)
+
+    return table.num_rows
+
+
+"""
+File count, bytes, rows and full scan time of a set of parquets
+
+@param:list[Path] files - parquet files
+@returns: dict - {"files", "bytes", "rows", "scan_s"}
+"""
+def layout_stats(files: list[Path]) -> dict:
+
+    if not files:
+        return {"files": 0, "bytes": 0, "rows": 0, "scan_s": 0.0}
+
+    start = time.perf_counter()
+
+    # Every file on its own; Bronze files of different schemas cannot be scanned as one
+    rows = sum(pl.read_parquet(path).height for path in files)
+
+    return {
+        "files": len(files),
+        "bytes": stage_metrics.file_bytes(files),
+        "rows": rows,
+        "scan_s": round(time.perf_counter() - start, 4),
+    }
+
+
+"""
+Files of the published compacted version of a layer; Read the pointer once, then the files never change underneath
+
+@param:str layer - layer name (See LAYERS)
+@param:Path compacted_root - root of the compacted layers
+@returns: list[Path] - compacted files; Empty if the layer was never compacted
+"""
+def current_files(layer: str, compacted_root: Path = COMPACTED_ROOT) -> list[Path]:
+    pointer = Path(compacted_root) / layer / POINTER_NAME
+
+    if not pointer.is_file():
+        return []
+
+    with open(pointer) as json_file:
+        current = json.load(json_file)
+
+    return [Path(compacted_root) / layer / current["version"] / path for path in current["files"]]
+
+
+"""
+Size and mtime of source files, keyed by path relative to the layer folder
+
+@param:list[Path] files - source files
+@param:Path source_root - layer folder
+@returns: dict - relative path -> [size, mtime]
+"""
+def source_stats(files: list[Path], source_root: Path) -> dict:
+    stats = {}
+
+    for path in files:
+        stat = path.stat()
+        stats[path.relative_to(source_root).as_posix()] = [stat.st_size, stat.st_mtime]
+
+    return stats
+
+
+"""
+Publish a version by atomically replacing the layer's pointer
+
+@param:Path layer_root - compacted layer folder
+@param:dict pointer - {"version", "files", "sources", "created"}
+@returns: None
+"""
+def write_pointer(layer_root: Path, pointer: dict) -> None:
+    tmp_path = Path(layer_root) / f".{POINTER_NAME}.tmp"
+
+    with open(tmp_path, "w") as json_file:
+        json.dump(pointer, json_file, indent=4)
+
+    os.replace(tmp_path, Path(layer_root) / POINTER_NAME)
+
+
+"""
+Record new size/mtime of unchanged sources in the published pointer, so readers keep using the version
+
+@param:Path layer_root - compacted layer folder
+@param:dict sources - relative path -> [size, mtime]
+@returns: None
+"""
+def refresh_sources(layer_root: Path, sources: dict) -> None:
+    pointer_path = Path(layer_root) / POINTER_NAME
+
+    if not pointer_path.is_file():
+        return
+
+    with open(pointer_path) as json_file:
+        pointer = json.load(json_file)
+
+    if pointer.get("sources") != sources:
+        write_pointer(layer_root, {**pointer, "sources": sources})
+
+
+"""
+Layer compacted from a folder
+
+@param:Path source_root - layer folder
+@returns: str | None - layer name; None if the folder is not compacted
+"""
+def layer_of(source_root: Path) -> str | None:
+    source_root = Path(source_root).resolve()
+
+    return next((layer for layer, (root, _, _) in LAYERS.items() if Path(root).resolve() == source_root), None)
+
+
+"""
+Published compacted files of a layer, if they were built from exactly the given source files
+
+@param:str layer - layer name (See LAYERS)
+@param:dict sources - path relative to the layer folder -> [size, mtime] of the files a reader would otherwise read
+@param:Path compacted_root - root of the compacted layers
+@returns: dict | None - path relative to the version folder -> compacted file; None if not covered
+"""
+def covering_files(layer: str, sources: dict, compacted_root: Path = COMPACTED_ROOT) -> dict | None:
+    pointer = Path(compacted_root) / layer / POINTER_NAME
+
+    if not sources or not pointer.is_file():
+        return None
+
+    with open(pointer) as json_file:
+        current = json.load(json_file)
+
+    if current.get("sources") != sources:
+        return None
+
+    return {path: Path(compacted_root) / layer / current["version"] / path for path in current["files"]}
+
+
+# ----------------------------
+# Entry point
+# ----------------------------
+
+"""
+Compact one layer into a new version and publish it; Versions older than the newest KEEP_VERSIONS are removed.
+Skipped when no source file changed since the published version
+
+@param:str layer - layer name (See LAYERS)
+@param:int target_bytes - input bytes per compacted file
+@param:int row_group_rows - rows per row group
+@param:int compression_level - zstd level
+@param:bool overwrite - compact even if nothing changed
+@param:Path compacted_root - root of the compacted layers
+@returns: dict | None - before/after report; None if skipped
+"""
+def compact_layer(layer: str, target_bytes: int = TARGET_FILE_BYTES, row_group_rows: int = ROW_GROUP_ROWS,
+                  compression_level: int = COMPRESSION_LEVEL, overwrite: bool = False,
+                  compacted_root: Path = COMPACTED_ROOT) -> dict | None:
+
+    if layer not in LAYERS:
+        raise Exception(f"Unknown layer {layer}; Expected one of {list(LAYERS)}")
+
+    source_root, partitioned, sort_col = LAYERS[layer]
+
+    layer_root = Path(compacted_root) / layer
+    meta_dir = layer_root / "_metadata"
+
+    files = source_files(source_root, partitioned)
+
+    build_manifest = manifest.load_manifest(meta_dir)
+
+    previous = current_files(layer, compacted_root)
+
+    # Layout settings count as code; Changing them recompacts
+    version = f"{CODE_VERSION}:{target_bytes}:{row_group_rows}:{compression_level}"
+
+    fingerprints = {}
+    stale = overwrite or not previous
+
+    for path in files:
+        key = str(path.relative_to(source_root))
+
+        file_stale, fingerprints[key] = manifest.needs_rebuild(build_manifest, key, path, previous, version)
+
+        stale = stale or file_stale
+
+    stale = stale or set(build_manifest["entries"]) != set(fingerprints)
+
+    if not files or not stale:
+        print(f"Compacted {layer} up to date" if files else f"No files in {source_root}")
+
+        # Sources rewritten with the same content; The published version still covers them
+        if files:
+            refresh_sources(layer_root, source_stats(files, source_root))
+
+        return None
+
+    version_root = layer_root / f"v={datetime.now():%Y%m%dT%H%M%S%f}"
+
+    metrics = []
+
+    with stage_metrics.measure(metrics, source_root, layer, "compaction", "rewrite") as counts:
+
+        sources = source_stats(files, source_root)
+
+        before = layout_stats(files)
+
+        counts["bytes_read"] = before["bytes"]
+        counts["rows_in"] = before["rows"]
+
+        written = []
+        rows = 0
+
+        # Unpublished until the pointer moves; A failed run leaves a folder nothing points to
+        try:
+            for index, (partition, bin_files) in enumerate(plan_bins(files, source_root, partitioned, target_bytes)):
+                out_path = version_root / partition / f"part-{index:05d}.parquet"
+
+                rows += write_bin(bin_files, out_path, sort_col, row_group_rows, compression_level)
+
+                written.append(out_path)
+        except Exception:
+            shutil.rmtree(version_root, ignore_errors=True)
+            raise
+
+        if rows != before["rows"]:
+            shutil.rmtree(version_root, ignore_errors=True)
+            raise Exception(f"Compaction of {layer} wrote {rows} rows of {before['rows']}; Version discarded")
+
+        if source_stats(files, source_root) != sources:
+            shutil.rmtree(version_root, ignore_errors=True)
+            raise Exception(f"Source files of {layer} changed during compaction; Version discarded")
+
+        after = layout_stats(written)
+
+        counts["rows_out"] = rows
+        counts["bytes_written"] = after["bytes"]
+
+    # -----------------
+    # Publish
+    # -----------------
+
+    pointer = {
+        "version": version_root.name,
+        "files": [path.relative_to(version_root).as_posix() for path in written],
+        # What the version replaces; Readers use it only while their source files are exactly these
+        "sources": sources,
+        "created": datetime.now().isoformat(timespec="seconds"),
+    }
+
+    write_pointer(layer_root, pointer)
+
+    # Versions are named by time; The newest KEEP_VERSIONS stay for readers that listed them before the swap
+    for old_root in sorted(layer_root.glob("v=*"))[:-KEEP_VERSIONS]:
+        shutil.rmtree(old_root, ignore_errors=True)
+
+    build_manifest["entries"] = {}
+
+    for key, fp in fingerprints.items():
+        manifest.record_build(build_manifest, key, fp, written, version, [])
+
+    manifest.save_manifest(meta_dir, build_manifest)
+
+    report = {
+        "layer": layer,
+        "version": version_root.name,
+        "target_file_bytes": target_bytes,
+        "row_group_rows": row_group_rows,
+        "compression": f"{COMPRESSION}({compression_level})",
+        "before": before,
+        "after": after,
+    }
+
+    with open(meta_dir / "compaction_report.json", "w") as json_file:
+        json.dump(report, json_file, indent=4)
+
+    stage_metrics.write_metrics(meta_dir, "compaction_metrics.json", metrics)
+
+    print(f"Compacted {layer}: {before['files']} -> {after['files']} files, {before['bytes']} -> {after['bytes']} bytes, "
+          f"scan {before['scan_s']}s -> {after['scan_s']}s")
+
+    return report
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Compact bronze/silver layers into target sized, sorted parquets")
+    parser.add_argument("--layers", nargs="*", choices=list(LAYERS), default=list(LAYERS), help="Layers to compact")
+    parser.add_argument("--target-mb", type=int, default=TARGET_FILE_BYTES // 1024 ** 2, help="Input MB per compacted file")
+    parser.add_argument("--row-group-rows", type=int, default=ROW_GROUP_ROWS, help="Rows per row group")
+    parser.add_argument("--compression-level", type=int, default=COMPRESSION_LEVEL, help="zstd level")
+    parser.add_argument("--overwrite", action="store_true", help="Compact even if no source file changed")
+
+    args = parser.parse_args()
+
+    for layer in args.layers:
+        compact_layer(layer, args.target_mb * 1024 ** 2, args.row_group_rows, args.compression_level, args.overwrite)
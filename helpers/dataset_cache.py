@@ -0,0 +1,259 @@
+"""
+Helper for the local Kaggle dataset cache; One checksummed mirror per dataset ID and version, so runs resolve without the network
+"""
+
+from pathlib import Path
+from datetime import datetime
+import json
+import os
+import re
+import shutil
+
+import manifest
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_ROOT = Path(os.getenv("DATA_ROOT", PROJECT_ROOT / "data"))
+
+# Cache root; Overridden by DATASET_CACHE
+CACHE_ROOT = Path(os.getenv("DATASET_CACHE", DATA_ROOT / "cache" / "kaggle"))
+
+# Written last; A mirror without it is incomplete and is rebuilt
+CHECKSUMS_NAME = "checksums.json"
+
+# Env settings (See .env)
+DATASET_ID_ENV = "KAGGLE_PATH"
+DATASET_VERSION_ENV = "KAGGLE_VERSION"
+OFFLINE_DIR_ENV = "KAGGLE_OFFLINE_DIR"
+
+
+# ----------------------------
+# Helpers
+# ----------------------------
+
+"""
+Folder of a dataset ID in the cache
+
+@param:str dataset_id - Kaggle dataset ID (owner/name)
+@param:Path cache_root - cache root
+@returns: Path - folder holding one sub folder per version
+"""
+def dataset_dir(dataset_id: str, cache_root: Path = CACHE_ROOT) -> Path:
+    return Path(cache_root) / dataset_id.replace("/", "__")
+
+
+"""
+Mirror folder of a dataset version
+
+@param:str dataset_id - Kaggle dataset ID (owner/name)
+@param:str version - dataset version
+@param:Path cache_root - cache root
+@returns: Path - mirror folder (files/ plus checksums.json)
+"""
+def mirror_dir(dataset_id: str, version: str, cache_root: Path = CACHE_ROOT) -> Path:
+    return dataset_dir(dataset_id, cache_root) / f"version={version}"
+
+
+"""
+Load the checksums of a mirror
+
+@param:Path mirror - mirror folder
+@returns: dict | None - {"dataset_id", "version", "cached_at", "files": {relative path: fingerprint}}; None if incomplete
+"""
+def load_checksums(mirror: Path) -> dict | None:
+    checksums_path = Path(mirror) / CHECKSUMS_NAME
+
+    if not checksums_path.is_file():
+        return None
+
+    with open(checksums_path) as json_file:
+        return json.load(json_file)
+
+
+"""
+Newest complete mirror of a dataset; Found from folder names only
+
+@param:str dataset_id - Kaggle dataset ID (owner/name)
+@param:Path cache_root - cache root
+@returns: Path | None - mirror folder; None if nothing is cached
+"""
+def latest_mirror(dataset_id: str, cache_root: Path = CACHE_ROOT) -> Path | None:
+    mirrors = [mirror for mirror in dataset_dir(dataset_id, cache_root).glob("version=*")
+               if (mirror / CHECKSUMS_NAME).is_file()]
+
+    if not mirrors:
+        return None
+
+    # Numeric Kaggle versions sort as numbers
+    def version_key(mirror: Path):
+        version = mirror.name.split("=", 1)[1]
+        return (0, int(version), "") if version.isdigit() else (1, 0, version)
+
+    return max(mirrors, key=version_key)
+
+
+"""
+Version of a kagglehub download, taken from its path (.../versions/<n>)
+
+@param:Path path - folder returned by kagglehub
+@returns: str - version; "unversioned" if the path has none
+"""
+def version_from_path(path: Path) -> str:
+    match = re.search(r"versions[/\\](\d+)", str(path))
+
+    return match.group(1) if match else "unversioned"
+
+
+"""
+Verify the files of a mirror against its checksums
+
+@param:Path mirror - mirror folder
+@param:bool full - re-hash every file; Otherwise size and mtime are compared (stat only)
+@returns: list[str] - files that are missing or changed
+"""
+def verify_mirror(mirror: Path, full: bool = False) -> list[str]:
+    checksums = load_checksums(mirror)
+
+    if checksums is None:
+        return ["<incomplete mirror>"]
+
+    files_dir = Path(mirror) / "files"
+    bad = []
+
+    for relative, expected in checksums["files"].items():
+        path = files_dir / relative
+
+        if not path.is_file():
+            bad.append(relative)
+            continue
+
+        # Without the stored hash handed in, fingerprint hashes the file again
+        current = manifest.fingerprint(path, None if full else expected)
+
+        if current["sha256"] != expected["sha256"] or current["size"] != expected["size"]:
+            bad.append(relative)
+
+    return bad
+
+
+"""
+Copy a downloaded dataset into a mirror and write its checksums last
+
+@param:Path source - downloaded dataset folder
+@param:Path mirror - mirror folder to create
+@param:str dataset_id - Kaggle dataset ID
+@param:str version - dataset version
+@returns: Path - mirror folder
+"""
+def build_mirror(source: Path, mirror: Path, dataset_id: str, version: str) -> Path:
+    files_dir = Path(mirror) / "files"
+
+    # The mirror stops claiming a complete version before its files are touched, so an interrupted refresh is rebuilt
+    (Path(mirror) / CHECKSUMS_NAME).unlink(missing_ok=True)
+
+    # Leftovers of an interrupted mirror
+    if files_dir.exists():
+        shutil.rmtree(files_dir)
+
+    files = {}
+
+    for path in sorted(Path(source).rglob("*")):
+        if not path.is_file():
+            continue
+
+        relative = path.relative_to(source)
+        target = files_dir / relative
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        # Hard link when on the same filesystem; A copy keeps the mtime either way
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copy2(path, target)
+
+        files[str(relative)] = manifest.fingerprint(target)
+
+    checksums = {
+        "dataset_id": dataset_id,
+        "version": version,
+        "cached_at": datetime.now().isoformat(timespec="seconds"),
+        "files": files,
+    }
+
+    tmp_path = Path(mirror) / f".{CHECKSUMS_NAME}.tmp"
+
+    with open(tmp_path, "w") as json_file:
+        json.dump(checksums, json_file, indent=4)
+
+    os.replace(tmp_path, Path(mirror) / CHECKSUMS_NAME)
+
+    return mirror
+
+
+# ----------------------------
+# Entry point
+# ----------------------------
+
+"""
+Resolve the local folder of a Kaggle dataset. Order: offline directory, cached mirror, download into the cache.
+A cached run is a few directory stats; The network is only used when nothing usable is cached or refresh is set
+
+@param:str | None dataset_id - Kaggle dataset ID; KAGGLE_PATH when None
+@param:str | None version - dataset version; KAGGLE_VERSION when None, else the newest cached version (or latest online)
+@param:str | Path | None offline_dir - local dataset folder used as is; KAGGLE_OFFLINE_DIR when None
+@param:bool refresh - download again even if a mirror exists
+@param:bool verify - check the mirror's files against its checksums (stat only) and rebuild it on a mismatch
+@param:Path cache_root - cache root
+@returns: Path - folder with the dataset files
+"""
+def resolve_dataset(dataset_id: str | None = None, version: str | None = None, offline_dir=None,
+                    refresh: bool = False, verify: bool = False, cache_root: Path = CACHE_ROOT) -> Path:
+
+    offline_dir = offline_dir or os.getenv(OFFLINE_DIR_ENV)
+
+    if offline_dir:
+        if not Path(offline_dir).is_dir():
+            raise FileNotFoundError(f"Offline dataset directory DNE: {offline_dir}")
+
+        return Path(offline_dir)
+
+    dataset_id = dataset_id or os.getenv(DATASET_ID_ENV)
+    version = version or os.getenv(DATASET_VERSION_ENV) or None
+
+    if not dataset_id:
+        raise Exception(f"No dataset ID; Set {DATASET_ID_ENV} or {OFFLINE_DIR_ENV}")
+
+    # -----------------
+    # Cached mirror
+    # -----------------
+
+    mirror = mirror_dir(dataset_id, version, cache_root) if version else latest_mirror(dataset_id, cache_root)
+
+    if not refresh and mirror is not None and load_checksums(mirror) is not None:
+        bad = verify_mirror(mirror) if verify else []
+
+        if not bad:
+            return mirror / "files"
+
+        print(f"Cached dataset {mirror} failed verification ({len(bad)} files); Downloading again")
+
+    # -----------------
+    # Download into the cache
+    # -----------------
+
+    import kagglehub
+
+    handle = f"{dataset_id}/versions/{version}" if version else dataset_id
+
+    print(f"Downloading dataset {handle} from Kaggle...")
+
+    source = Path(kagglehub.dataset_download(handle, force_download=refresh))
+
+    version = version or version_from_path(source)
+    mirror = mirror_dir(dataset_id, version, cache_root)
+
+    build_mirror(source, mirror, dataset_id, version)
+
+    print(f"Cached dataset {dataset_id} version {version} in {mirror}")
+
+    return mirror / "files"
@@ -0,0 +1,248 @@
+"""
+Helper for the content-hash manifest used to make stage rebuilds incremental
+"""
+
+from pathlib import Path
+import hashlib
+import json
+import os
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_ROOT = Path(os.getenv("DATA_ROOT", PROJECT_ROOT / "data"))
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+"""
+Hash the contents of a file
+
+@param:Path path - path to file
+@returns: str - sha256 hex digest
+"""
+def content_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+"""
+Version of a stage's logic; Hash of the source files that define it
+
+@param:str | Path *sources - source files of the stage (usually __file__) and of the helpers it builds its outputs with
+@returns: str - short hex digest
+"""
+def code_version(*sources) -> str:
+    digest = hashlib.sha256()
+
+    for source in sources:
+        digest.update(Path(source).read_bytes())
+
+    return digest.hexdigest()[:16]
+
+
+"""
+Fingerprint an input file; Reuses the stored hash when size and mtime are unchanged
+
+@param:Path path - path to input file
+@param:dict | None previous - previously stored fingerprint of the same input
+@returns: dict - {"size", "mtime", "sha256"}
+"""
+def fingerprint(path: Path, previous: dict | None = None) -> dict:
+    stat = os.stat(path)
+
+    if previous and previous.get("size") == stat.st_size and previous.get("mtime") == stat.st_mtime_ns:
+        return dict(previous)
+
+    return {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "sha256": content_hash(path),
+    }
+
+
+"""
+Load the manifest stored in a metadata folder; Empty manifest if none exists yet
+
+@param:Path meta_dir - metadata folder of the stage
+@returns: dict - manifest
+"""
+def load_manifest(meta_dir: Path) -> dict:
+    manifest_path = Path(meta_dir) / MANIFEST_NAME
+
+    if not manifest_path.is_file():
+        return {"version": MANIFEST_VERSION, "entries": {}}
+
+    with open(manifest_path) as json_file:
+        manifest = json.load(json_file)
+
+    # Unknown layout; Start over so everything is rebuilt once
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {"version": MANIFEST_VERSION, "entries": {}}
+
+    return manifest
+
+
+"""
+Write the manifest to a metadata folder atomically
+
+@param:Path meta_dir - metadata folder of the stage
+@param:dict manifest - manifest to write
+@returns: None
+"""
+def save_manifest(meta_dir: Path, manifest: dict) -> None:
+    meta_dir = Path(meta_dir)
+    meta_dir.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = meta_dir / f".{MANIFEST_NAME}.tmp"
+
+    with open(tmp_path, "w") as json_file:
+        json.dump(manifest, json_file, indent=4)
+
+    os.replace(tmp_path, meta_dir / MANIFEST_NAME)
+
+
+"""
+Path of an output as stored in a manifest; Relative to DATA_ROOT, so a moved or remounted data folder keeps its manifests
+
+@param:str | Path path - output path
+@returns: str - path relative to DATA_ROOT; Unchanged if outside it
+"""
+def stored_path(path) -> str:
+    try:
+        return str(Path(path).resolve().relative_to(DATA_ROOT.resolve()))
+
+    except ValueError:
+        return str(path)
+
+
+"""
+Output path of a manifest under the current DATA_ROOT; Absolute paths of older manifests are kept as is
+
+@param:str path - output path as stored in a manifest
+@returns: str - output path
+"""
+def resolve_path(path: str) -> str:
+    return str(DATA_ROOT / path)
+
+
+"""
+Normalize an output description to a list of path strings
+
+@param:Path | list[Path] | None output - single output path or list of output paths
+@returns: list[str] - output paths
+"""
+def output_list(output) -> list[str]:
+    if output is None:
+        return []
+
+    if isinstance(output, (list, tuple)):
+        return [str(path) for path in output]
+
+    return [str(output)]
+
+
+"""
+Check if an output must be rebuilt; True when the input content, the code version or the output changed
+
+@param:dict manifest - manifest of the stage
+@param:str key - entry key (output file name)
+@param:Path input_path - path to input file
+@param:Path | None output_path - expected output path; None when outputs are only known after a build (partitions)
+@param:str version - current code version of the stage
+@returns: tuple[bool, dict] - rebuild flag and current input fingerprint
+"""
+def needs_rebuild(manifest: dict, key: str, input_path: Path, output_path, version: str) -> tuple[bool, dict]:
+    entry = manifest["entries"].get(key)
+
+    current = fingerprint(input_path, entry["input"] if entry else None)
+
+    if entry is None:
+        return True, current
+
+    outputs = [resolve_path(path) for path in output_list(entry.get("output"))]
+
+    if not all(Path(path).is_file() for path in outputs):
+        return True, current
+
+    stale = (entry["input"].get("sha256") != current["sha256"]
+             or entry.get("code_version") != version
+             or (output_path is not None and outputs != output_list(output_path)))
+
+    return stale, current
+
+
+"""
+Record a completed build in the manifest
+
+@param:dict manifest - manifest of the stage
+@param:str key - entry key (output file name)
+@param:dict input_fingerprint - fingerprint of the input that was built
+@param:Path | list[Path] output_path - path to output file, or every file written for a partitioned output; Stored relative to DATA_ROOT
+@param:str version - code version used for the build
+@param:list records - metadata records produced by the build
+@param:dict | None extra - stage specific values cached with the entry (e.g. detected formats)
+@returns: None
+"""
+def record_build(manifest: dict, key: str, input_fingerprint: dict, output_path, version: str,
+                 records: list, extra: dict | None = None) -> None:
+    outputs = [stored_path(path) for path in output_list(output_path)]
+
+    manifest["entries"][key] = {
+        "input": input_fingerprint,
+        "output": outputs[0] if not isinstance(output_path, (list, tuple)) else outputs,
+        "code_version": version,
+        "records": records,
+        **(extra or {}),
+    }
+
+
+"""
+Value cached with an entry; Only returned while the input content is unchanged
+
+@param:dict manifest - manifest of the stage
+@param:str key - entry key (output file name)
+@param:str field - name of the cached value
+@param:dict input_fingerprint - current fingerprint of the input
+@returns: Any - cached value; None if missing or the input changed
+"""
+def cached_value(manifest: dict, key: str, field: str, input_fingerprint: dict):
+    entry = manifest["entries"].get(key)
+
+    if not entry or entry["input"].get("sha256") != input_fingerprint.get("sha256"):
+        return None
+
+    return entry.get(field)
+
+
+"""
+Outputs recorded for an entry from a previous build
+
+@param:dict manifest - manifest of the stage
+@param:str key - entry key (output file name)
+@returns: list[str] - output paths under DATA_ROOT; Empty if entry does not exist
+"""
+def stored_outputs(manifest: dict, key: str) -> list[str]:
+    entry = manifest["entries"].get(key)
+
+    return [resolve_path(path) for path in output_list(entry.get("output"))] if entry else []
+
+
+"""
+Metadata records kept for an entry from a previous build
+
+@param:dict manifest - manifest of the stage
+@param:str key - entry key (output file name)
+@returns: list - metadata records; Empty if entry does not exist
+"""
+def stored_records(manifest: dict, key: str) -> list:
+    entry = manifest["entries"].get(key)
+
+    return list(entry.get("records", [])) if entry else []
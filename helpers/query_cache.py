@@ -0,0 +1,402 @@
+"""
+Helper for an on-disk cache of query results over silver; Keyed by the query and the content of the partitions it reads,
+size bounded with least recently used eviction
+"""
+
+from pathlib import Path
+from datetime import datetime
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import polars as pl
+import sys
+
+
+root_dir = Path(__file__).resolve().parent.parent
+silver_path = str(root_dir / "silver")
+
+if silver_path not in sys.path:
+    sys.path.append(silver_path)
+
+
+import dim_time
+import manifest
+import read_parquet
+import table_log
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_ROOT = Path(os.getenv("DATA_ROOT", PROJECT_ROOT / "data"))
+SILVER_NORMALIZE = DATA_ROOT / "silver" / "normalize"
+
+# Cache root; Overridden by QUERY_CACHE
+CACHE_ROOT = Path(os.getenv("QUERY_CACHE", DATA_ROOT / "cache" / "query"))
+
+# Total bytes of cached results kept; Overridden by QUERY_CACHE_MAX_BYTES
+MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", 1024 ** 3))
+
+INDEX_NAME = "index.json"
+
+SYMBOLS = ['/ES', '/NQ', '/RTY', 'SPY', 'QQQ', 'IWM']
+
+# ----------------------------
+# Queries
+# ----------------------------
+
+"""
+Daily high, low and range of each instrument; Days are trading dates (dim_time.trading_date), the buckets the range
+filter of scan_silver selects
+
+@param:pl.LazyFrame lazy_df - silver scan
+@param:list[str] symbols - instruments
+@returns: pl.LazyFrame - date, symbol, high, low, range
+"""
+def daily_range(lazy_df: pl.LazyFrame, symbols: list[str] = SYMBOLS) -> pl.LazyFrame:
+    return (
+        lazy_df
+        .unpivot(index="TimeStamp", on=symbols, variable_name="symbol", value_name="price")
+        .group_by(dim_time.trading_date().alias("date"), "symbol")
+        .agg(pl.col("price").max().alias("high"), pl.col("price").min().alias("low"))
+        .with_columns((pl.col("high") - pl.col("low")).alias("range"))
+        .sort("date", "symbol")
+    )
+
+
+"""
+Week over week close to close return of each instrument; Weeks are Monday weeks of the trading date
+
+@param:pl.LazyFrame lazy_df - silver scan
+@param:list[str] symbols - instruments
+@returns: pl.LazyFrame - week, symbol, close, return
+"""
+def weekly_returns(lazy_df: pl.LazyFrame, symbols: list[str] = SYMBOLS) -> pl.LazyFrame:
+    return (
+        lazy_df
+        .unpivot(index="TimeStamp", on=symbols, variable_name="symbol", value_name="price")
+        .drop_nulls("price")
+        .sort("TimeStamp")
+        .group_by(dim_time.trading_date().dt.truncate("1w").alias("week"), "symbol")
+        .agg(pl.col("price").last().alias("close"))
+        .sort("symbol", "week")
+        .with_columns((pl.col("close") / pl.col("close").shift(1).over("symbol") - 1).alias("return"))
+        .sort("week", "symbol")
+    )
+
+
+# Query name -> function of (silver scan, **params) returning a lazy result
+QUERIES = {
+    "daily_range": daily_range,
+    "weekly_returns": weekly_returns,
+}
+
+# ----------------------------
+# Index
+# ----------------------------
+
+"""
+Load the cache index; Empty index if none exists yet
+
+@param:Path cache_root - cache root
+@returns: dict - {"entries": {key: entry}, "files": {path: fingerprint}, "stats": {"hits", "misses", "evictions"}}
+"""
+def load_index(cache_root: Path = CACHE_ROOT) -> dict:
+    index_path = Path(cache_root) / INDEX_NAME
+
+    if not index_path.is_file():
+        return {"entries": {}, "files": {}, "stats": {"hits": 0, "misses": 0, "evictions": 0}}
+
+    with open(index_path) as json_file:
+        return json.load(json_file)
+
+
+"""
+Save the cache index atomically; Concurrent writers do not corrupt it, the last one wins
+
+@param:dict index - cache index
+@param:Path cache_root - cache root
+@returns: None
+"""
+def save_index(index: dict, cache_root: Path = CACHE_ROOT) -> None:
+    Path(cache_root).mkdir(parents=True, exist_ok=True)
+
+    tmp_path = Path(cache_root) / f".{INDEX_NAME}.{os.getpid()}.tmp"
+
+    with open(tmp_path, "w") as json_file:
+        json.dump(index, json_file, indent=4)
+
+    os.replace(tmp_path, Path(cache_root) / INDEX_NAME)
+
+
+"""
+Version of a query function; Hash of the file defining it, else of its bytecode, plus dim_time, which defines the
+trading dates of the range filter
+
+@param:Callable query - query function
+@returns: str - version
+"""
+def query_version(query) -> str:
+    try:
+        return manifest.code_version(inspect.getsourcefile(query), dim_time.__file__)
+    except (TypeError, OSError):
+        return hashlib.sha256(query.__code__.co_code + manifest.code_version(dim_time.__file__).encode()).hexdigest()[:16]
+
+
+"""
+Normalized description of a query; Equal queries give equal descriptions whatever the argument order
+
+@param:str name - query name
+@param:Callable query - query function
+@param:dict params - query parameters
+@param:str | None start - first date (YYYY-MM-DD)
+@param:str | None end - last date (YYYY-MM-DD)
+@param:Path root - root of the partitioned dataset
+@returns: str - canonical json
+"""
+def describe(name: str, query, params: dict, start, end, root: Path) -> str:
+    return json.dumps({
+        "query": name,
+        "version": query_version(query),
+        "params": params,
+        "start": str(start) if start is not None else None,
+        "end": str(end) if end is not None else None,
+        "root": str(Path(root).resolve()),
+    }, sort_keys=True, default=str)
+
+
+"""
+Remove an entry and its result file
+
+@param:dict index - cache index
+@param:str key - entry key
+@param:Path cache_root - cache root
+@returns: None
+"""
+def drop_entry(index: dict, key: str, cache_root: Path = CACHE_ROOT) -> None:
+    index["entries"].pop(key, None)
+
+    (Path(cache_root) / f"{key}.parquet").unlink(missing_ok=True)
+
+
+"""
+Evict least recently used entries until the cache fits max_bytes
+
+@param:dict index - cache index
+@param:int max_bytes - size bound
+@param:Path cache_root - cache root
+@returns: int - entries evicted
+"""
+def evict(index: dict, max_bytes: int = MAX_BYTES, cache_root: Path = CACHE_ROOT) -> int:
+    total = sum(entry["bytes"] for entry in index["entries"].values())
+
+    evicted = 0
+
+    for key, entry in sorted(index["entries"].items(), key=lambda item: item[1]["last_used"]):
+        if total <= max_bytes:
+            break
+
+        total -= entry["bytes"]
+        drop_entry(index, key, cache_root)
+        evicted += 1
+
+    index["stats"]["evictions"] += evicted
+
+    return evicted
+
+
+# ----------------------------
+# Entry points
+# ----------------------------
+
+"""
+Run a query over silver through the cache. The key is the query description plus the content hash of every partition
+in range; Partition hashes are reused while size and mtime are unchanged, so a lookup costs one stat per file
+
+@param:str name - query name; Looked up in QUERIES unless query is given
+@param:Callable | None query - query function of (silver scan, **params)
+@param:str | None start - first date included (YYYY-MM-DD)
+@param:str | None end - last date included (YYYY-MM-DD)
+@param:Path root - root of the partitioned dataset
+@param:int max_bytes - size bound of the cache
+@param:Path cache_root - cache root
+@param:dict params - query parameters
+@returns: pl.DataFrame - result
+"""
+def cached_query(name: str, query=None, start=None, end=None, root: Path = SILVER_NORMALIZE,
+                 max_bytes: int = MAX_BYTES, cache_root: Path = CACHE_ROOT, **params) -> pl.DataFrame:
+
+    query = query or QUERIES.get(name)
+
+    if query is None:
+        raise Exception(f"Unknown query {name}; Expected one of {list(QUERIES)}")
+
+    # Key and result come from one snapshot; A rebuild committing meanwhile is seen by the next call
+    with table_log.pinned(root) as snapshot:
+        return run_cached(name, query, start, end, root, max_bytes, cache_root, params, snapshot["version"])
+
+
+"""
+Look up or compute a cached query over one snapshot of silver
+
+@param:str name - query name
+@param:Callable query - query function of (silver scan, **params)
+@param:str | None start - first date included (YYYY-MM-DD)
+@param:str | None end - last date included (YYYY-MM-DD)
+@param:Path root - root of the partitioned dataset
+@param:int max_bytes - size bound of the cache
+@param:Path cache_root - cache root
+@param:dict params - query parameters
+@param:int | None version - snapshot read; None for a dataset without a log
+@returns: pl.DataFrame - result
+"""
+def run_cached(name: str, query, start, end, root: Path, max_bytes: int, cache_root: Path, params: dict,
+               version: int | None) -> pl.DataFrame:
+
+    index = load_index(cache_root)
+
+    # Keyed by the source partitions; A covering compaction holds the same rows, so publishing one keeps results valid
+    files = read_parquet.partition_files(read_parquet.parse_date(start), read_parquet.parse_date(end), root, version,
+                                         compacted=False)
+
+    versions = {}
+
+    for parquet in files:
+        path = str(Path(parquet).resolve())
+
+        versions[path] = manifest.fingerprint(parquet, index["files"].get(path))
+        index["files"][path] = versions[path]
+
+    description = describe(name, query, params, start, end, root)
+
+    query_key = hashlib.sha256(description.encode()).hexdigest()[:16]
+    data_key = hashlib.sha256(json.dumps({path: fp["sha256"] for path, fp in versions.items()}, sort_keys=True).encode()).hexdigest()[:16]
+
+    key = f"{query_key}_{data_key}"
+    result_path = Path(cache_root) / f"{key}.parquet"
+
+    now = datetime.now().isoformat(timespec="microseconds")
+
+    if key in index["entries"] and result_path.is_file():
+        index["entries"][key]["last_used"] = now
+        index["stats"]["hits"] += 1
+
+        save_index(index, cache_root)
+
+        return pl.read_parquet(result_path)
+
+    index["stats"]["misses"] += 1
+
+    # Fingerprints of snapshot files gc has since removed
+    for path in [path for path in index["files"] if path not in versions and not Path(path).exists()]:
+        index["files"].pop(path)
+
+    # Results of the same query over older partition content
+    for stale_key in [k for k, entry in index["entries"].items() if entry["query_key"] == query_key]:
+        drop_entry(index, stale_key, cache_root)
+
+    result = query(read_parquet.scan_silver(start=start, end=end, root=root, version=version), **params).collect()
+
+    Path(cache_root).mkdir(parents=True, exist_ok=True)
+
+    tmp_path = result_path.with_name(f".{result_path.name}.{os.getpid()}.tmp")
+
+    result.write_parquet(tmp_path)
+
+    os.replace(tmp_path, result_path)
+
+    index["entries"][key] = {
+        "query_key": query_key,
+        "description": json.loads(description),
+        # Live paths; Stages invalidate by the partitions they write, not by the snapshot files read here
+        "inputs": [str(table_log.live_path(root, path)) for path in versions],
+        "bytes": result_path.stat().st_size,
+        "rows": result.height,
+        "created": now,
+        "last_used": now,
+    }
+
+    evict(index, max_bytes, cache_root)
+
+    save_index(index, cache_root)
+
+    return result
+
+
+"""
+Drop cached results that read any of the given partition files; Called after a stage rewrites or removes them
+
+@param:list[Path | str] paths - partition files
+@param:Path cache_root - cache root
+@returns: int - entries dropped
+"""
+def invalidate(paths: list, cache_root: Path = CACHE_ROOT) -> int:
+
+    if not (Path(cache_root) / INDEX_NAME).is_file():
+        return 0
+
+    paths = {str(Path(path).resolve()) for path in paths}
+
+    index = load_index(cache_root)
+
+    stale = [key for key, entry in index["entries"].items() if paths.intersection(entry["inputs"])]
+
+    for key in stale:
+        drop_entry(index, key, cache_root)
+
+    for path in paths:
+        index["files"].pop(path, None)
+
+    save_index(index, cache_root)
+
+    return len(stale)
+
+
+"""
+Hit, miss and eviction counters plus the current size of the cache
+
+@param:Path cache_root - cache root
+@returns: dict - counters, entries and bytes
+"""
+def stats(cache_root: Path = CACHE_ROOT) -> dict:
+    index = load_index(cache_root)
+
+    return {
+        **index["stats"],
+        "entries": len(index["entries"]),
+        "bytes": sum(entry["bytes"] for entry in index["entries"].values()),
+    }
+
+
+"""
+Remove every cached result and reset the counters
+
+@param:Path cache_root - cache root
+@returns: None
+"""
+def clear(cache_root: Path = CACHE_ROOT) -> None:
+    index = load_index(cache_root)
+
+    for key in list(index["entries"]):
+        drop_entry(index, key, cache_root)
+
+    save_index({"entries": {}, "files": {}, "stats": {"hits": 0, "misses": 0, "evictions": 0}}, cache_root)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run a cached query over silver, or inspect the query cache")
+    parser.add_argument("--query", choices=list(QUERIES), default=None, help="Query to run")
+    parser.add_argument("--start", default=None, help="First date (YYYY-MM-DD)")
+    parser.add_argument("--end", default=None, help="Last date (YYYY-MM-DD)")
+    parser.add_argument("--clear", action="store_true", help="Remove every cached result")
+
+    args = parser.parse_args()
+
+    if args.clear:
+        clear()
+
+    if args.query:
+        print(cached_query(args.query, start=args.start, end=args.end))
+
+    print(stats())
@@ -1,44 +1,477 @@
 """
-Helper for reading parquete files
+Helper for reading parquete files; Partition scans plus a memory-mapped Arrow IPC read path for repeated reads
 """
 
 
 import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import numpy as np
 from pathlib import Path
+from datetime import date, datetime
+import argparse
+import hashlib
+import json
+import re
 
 import os
+import sys
 
 
-def read_one_parquet(parquete_path: str) -> None:
-    
+root_dir = Path(__file__).resolve().parent.parent
+silver_path = str(root_dir / "silver")
+
+if silver_path not in sys.path:
+    sys.path.append(silver_path)
+
+
+import compact_parquet
+import dim_time
+import manifest
+import table_log
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_ROOT = Path(os.getenv("DATA_ROOT", PROJECT_ROOT / "data"))
+SILVER_NORMALIZE = DATA_ROOT / "silver" / "normalize"
+GOLD_FACT_PRICES = DATA_ROOT / "gold" / "fact_prices"
+
+# Arrow IPC mirrors of parquet partitions; Overridden by IPC_CACHE
+IPC_ROOT = Path(os.getenv("IPC_CACHE", DATA_ROOT / "cache" / "ipc"))
+
+# Schema metadata key holding the fingerprint of the parquet a mirror was built from
+SOURCE_KEY = b"source_fingerprint"
+
+SYMBOLS = ['/ES', '/NQ', '/RTY', 'SPY', 'QQQ', 'IWM']
+
+# Timestamp col of silver (wide) and gold fact (long) tables
+TIMESTAMP_COLS = ["TimeStamp", "timestamp"]
+
+BACKENDS = ["arrow", "polars", "pandas"]
+
+# Relative path of a partition file; Anything else under a dataset root (unpartitioned or deeper files) is skipped
+PARTITION_FILE = re.compile(r"year=(\d+)/month=(\d+)/[^/]+\.parquet")
+
+
+"""
+List Hive partitions (year=YYYY/month=MM) of a dataset. A logged table lists the files of a snapshot, which later
+commits never change; Otherwise the month folders are globbed. When the published compaction of the dataset was built
+from exactly these files, its fewer, larger files are listed instead. Files outside year=*/month=*/*.parquet are skipped
+
+@param:Path root - root of the partitioned dataset
+@param:int | None version - snapshot of a logged table; None for the latest
+@param:bool compacted - prefer a covering compacted version
+@returns: list[tuple[int, int, list[Path]]] - (year, month, files) sorted oldest first
+"""
+def list_partitions(root: Path = SILVER_NORMALIZE, version: int | None = None,
+                    compacted: bool = True) -> list[tuple[int, int, list[Path]]]:
+
+    if table_log.has_log(root):
+        actions = table_log.snapshot(root, version)["files"]
+
+        files = {path: Path(root) / action["data"] for path, action in actions.items()}
+        sources = {path: [action["size"], action["mtime"]] for path, action in actions.items()}
+    else:
+        files = {path.relative_to(root).as_posix(): path for path in Path(root).glob("year=*/month=*/*.parquet")}
+        sources = None
+
+    layer = compact_parquet.layer_of(root) if compacted else None
+
+    if layer is not None:
+        if sources is None:
+            sources = compact_parquet.source_stats(list(files.values()), Path(root))
+
+        files = compact_parquet.covering_files(layer, sources) or files
+
+    partitions = {}
+
+    for relative in sorted(files):
+        match = PARTITION_FILE.fullmatch(Path(relative).as_posix())
+
+        if match is None:
+            continue
+
+        partitions.setdefault((int(match.group(1)), int(match.group(2))), []).append(files[relative])
+
+    return [(year, month, month_files) for (year, month), month_files in sorted(partitions.items())]
+
+
+"""
+Files of the partitions overlapping a date range; Only month folders in range are listed
+
+@param:date | None start - first trading date included; None for no lower bound
+@param:date | None end - last trading date included; None for no upper bound
+@param:Path root - root of the partitioned dataset
+@param:int | None version - snapshot of a logged table; None for the latest
+@param:bool compacted - prefer a covering compacted version
+@returns: list[Path] - parquet files, oldest partition first
+"""
+def partition_files(start: date | None, end: date | None, root: Path = SILVER_NORMALIZE,
+                    version: int | None = None, compacted: bool = True) -> list[Path]:
+
+    files = []
+
+    for year, month, month_files in list_partitions(root, version, compacted):
+        if start is not None and (year, month) < (start.year, start.month):
+            continue
+        if end is not None and (year, month) > (end.year, end.month):
+            continue
+
+        files.extend(month_files)
+
+    return files
+
+
+"""
+Parse an optional YYYY-MM-DD bound
+
+@param:date | str | None value - bound
+@returns: date | None - parsed bound
+"""
+def parse_date(value) -> date | None:
+    return date.fromisoformat(str(value)) if value is not None else None
+
+
+"""
+Lazily scan the partitioned silver dataset; Date range prunes partitions, then row groups via TimeStamp stats
+
+@param:date | str | None start - first trading date included (YYYY-MM-DD); None for no lower bound
+@param:date | str | None end - last trading date included (YYYY-MM-DD); None for no upper bound
+@param:list[str] | None columns - cols to read; None for all
+@param:Path root - root of the partitioned dataset
+@param:int | None version - snapshot of a logged table; None for the latest
+@returns: pl.LazyFrame - filtered scan
+"""
+def scan_silver(start=None, end=None, columns: list[str] | None = None,
+                root: Path = SILVER_NORMALIZE, version: int | None = None) -> pl.LazyFrame:
+
+    start = parse_date(start)
+    end = parse_date(end)
+
+    # Partition pruning; Only month folders overlapping the range are opened
+    files = partition_files(start, end, root, version)
+
+    if not files:
+        return pl.LazyFrame(schema={col: pl.String for col in columns} if columns else None)
+
+    # Provenance col of compacted files is dropped
+    lazy_df = pl.scan_parquet(files).select(pl.exclude(compact_parquet.SOURCE_COL))
+
+    # Row group pruning via TimeStamp min/max stats; The trading dates in range are one TimeStamp interval
+    start_ts, end_ts = dim_time.trading_date_bounds(start, end)
+
+    if start_ts is not None:
+        lazy_df = lazy_df.filter(pl.col("TimeStamp") >= start_ts)
+    if end_ts is not None:
+        lazy_df = lazy_df.filter(pl.col("TimeStamp") < end_ts)
+
+    if columns:
+        lazy_df = lazy_df.select(columns)
+
+    return lazy_df
+
+
+"""
+Read the last n sessions of a symbol; Walks partitions newest first and stops once n dates are found
+
+@param:str symbol - instrument col (e.g. /ES)
+@param:int n - number of sessions
+@param:Path root - root of the partitioned dataset
+@returns: pl.DataFrame - TimeStamp and symbol cols of the last n sessions
+"""
+def read_last_sessions(symbol: str, n: int = 5, root: Path = SILVER_NORMALIZE) -> pl.DataFrame:
+
+    dates = set()
+
+    # Both passes read the same snapshot
+    version = table_log.current_version(root)
+
+    for year, month, month_files in reversed(list_partitions(root, version)):
+        month_dates = (
+            pl.scan_parquet(month_files)
+            .select(dim_time.trading_date("TimeStamp").unique())
+            .collect()
+            .to_series()
+            .to_list()
+        )
+
+        dates.update(month_dates)
+
+        if len(dates) >= n:
+            break
+
+    if not dates:
+        return pl.DataFrame(schema={"TimeStamp": pl.Datetime("ms"), symbol: pl.Float64})
+
+    first_date = sorted(dates)[-n:][0]
+
+    return scan_silver(start=first_date, columns=["TimeStamp", symbol], root=root, version=version).sort("TimeStamp").collect()
+
+
+# ----------------------------
+# Memory-mapped Arrow IPC reads
+# ----------------------------
+
+"""
+Path of the IPC mirror of a parquet; Mirrors the layout under DATA_ROOT
+
+@param:Path parquet - parquet partition file
+@param:Path ipc_root - root of the IPC mirrors
+@returns: Path - .arrow file
+"""
+def ipc_path(parquet: Path, ipc_root: Path = IPC_ROOT) -> Path:
+    parquet = Path(parquet).resolve()
+
     try:
-        df = pd.read_parquet(parquete_path)
-        
-        print(df)
-    except FileNotFoundError:
-        print(f"File DNE on path: {parquete_path}")
+        relative = parquet.relative_to(DATA_ROOT.resolve())
+    except ValueError:
+        # Outside the lake; Keyed by folder so equal names do not collide
+        relative = Path("external") / hashlib.sha1(str(parquet.parent).encode()).hexdigest()[:12] / parquet.name
 
+    return Path(ipc_root) / relative.with_suffix(".arrow")
 
 
-def read_all_parquets_in_folder(folder_path: str) -> None:
-    
+"""
+Fingerprint of the parquet an IPC mirror was built from; Only the schema is read
+
+@param:Path path - .arrow file
+@returns: dict | None - {"size", "mtime", "sha256"}; None if missing or unreadable
+"""
+def mirror_fingerprint(path: Path) -> dict | None:
     try:
-    
-        files = []
-    
-        for filename in os.listdir(folder_path):
-            full_path = os.path.join(folder_path, filename) # Get the full path
-            if os.path.isfile(full_path) and filename not in files: # Check if it is a file
-                #print(filename)
-                files.append(filename)
-            else:
-                print("ERR; File duplicate")
-    
-    except:
-        raise Exception("Err in reading fodler")
+        with pa.memory_map(str(path)) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+
+    return json.loads(metadata[SOURCE_KEY]) if SOURCE_KEY in metadata else None
+
+
+"""
+Build the IPC mirror of a parquet unless an up to date one exists. Written uncompressed as one record batch,
+so a memory-mapped read is zero-copy and every col is one contiguous buffer
+
+@param:Path parquet - parquet partition file
+@param:Path ipc_root - root of the IPC mirrors
+@returns: Path - .arrow file
+"""
+def ensure_ipc(parquet: Path, ipc_root: Path = IPC_ROOT) -> Path:
+    path = ipc_path(parquet, ipc_root)
+
+    stored = mirror_fingerprint(path)
+
+    # Stat only while size and mtime are unchanged
+    current = manifest.fingerprint(parquet, stored)
+
+    if stored is not None and stored["sha256"] == current["sha256"]:
+        return path
+
+    table = pq.read_table(parquet).combine_chunks()
+
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), SOURCE_KEY: json.dumps(current).encode()})
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Unique per process; Readers keep mapping a replaced file until they drop it
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+
+    with pa.OSFile(str(tmp_path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=max(table.num_rows, 1))
+
+    os.replace(tmp_path, path)
+
+    return path
+
+
+"""
+Open an IPC mirror memory-mapped; Buffers point into the page cache, shared by every process mapping the file
+
+@param:Path path - .arrow file
+@param:list[str] | None columns - cols to keep; None for all
+@returns: pa.Table - zero-copy table
+"""
+def open_ipc(path: Path, columns: list[str] | None = None) -> pa.Table:
+    with pa.memory_map(str(path)) as source:
+        table = pa.ipc.open_file(source).read_all()
+
+    return table.select(columns) if columns else table
+
+
+"""
+Rows of a table within [start, end) of its timestamp col. A sorted, null free col is binary searched and sliced (zero-copy);
+Anything else is filtered
+
+@param:pa.Table table - table
+@param:str ts_col - timestamp col
+@param:datetime | None start - first timestamp included
+@param:datetime | None end - first timestamp excluded
+@returns: pa.Table - rows in range
+"""
+def slice_time(table: pa.Table, ts_col: str, start: datetime | None, end: datetime | None) -> pa.Table:
+
+    if start is None and end is None:
+        return table
+
+    timestamps = table.column(ts_col)
+
+    if timestamps.null_count or timestamps.num_chunks != 1:
+        mask = pc.and_(
+            pc.greater_equal(timestamps, pa.scalar(start, timestamps.type)) if start is not None else pa.scalar(True),
+            pc.less(timestamps, pa.scalar(end, timestamps.type)) if end is not None else pa.scalar(True),
+        )
+        return table.filter(mask)
+
+    values = timestamps.chunk(0).to_numpy(zero_copy_only=True)
+
+    lo = int(np.searchsorted(values, np.datetime64(start).astype(values.dtype))) if start is not None else 0
+    hi = int(np.searchsorted(values, np.datetime64(end).astype(values.dtype))) if end is not None else len(values)
+
+    return table.slice(lo, max(hi - lo, 0))
+
+
+"""
+Restrict one partition table to a time range and symbols. Silver (wide) keeps the symbol cols; Gold fact (long) is sorted
+by symbol then timestamp, so each symbol is a contiguous block sliced on its own
+
+@param:pa.Table table - partition table
+@param:datetime | None start - first timestamp included
+@param:datetime | None end - first timestamp excluded
+@param:list[str] | None symbols - instruments to keep; None for all
+@returns: list[pa.Table] - zero-copy slices where the sort order allows
+"""
+def restrict(table: pa.Table, start: datetime | None, end: datetime | None, symbols: list[str] | None) -> list[pa.Table]:
+
+    ts_col = next(col for col in TIMESTAMP_COLS if col in table.column_names)
+
+    if "symbol" not in table.column_names:
+        # Provenance col of compacted files is dropped
+        table = table.select([col for col in table.column_names if col != compact_parquet.SOURCE_COL
+                              and (symbols is None or col not in SYMBOLS or col in symbols)])
+
+        return [slice_time(table, ts_col, start, end)]
+
+    symbol_col = table.column("symbol")
+
+    if pa.types.is_dictionary(symbol_col.type):
+        symbol_col = symbol_col.cast(symbol_col.type.value_type)
+
+    blocks = []
+
+    for symbol in symbols if symbols is not None else pc.unique(symbol_col).to_pylist():
+        rows = pc.indices_nonzero(pc.equal(symbol_col, symbol))
+
+        if len(rows) == 0:
+            continue
+
+        first, last = rows[0].as_py(), rows[-1].as_py()
+
+        blocks.append(slice_time(table.slice(first, last - first + 1), ts_col, start, end))
+
+    return blocks
+
+
+"""
+Read partitions through their memory-mapped IPC mirrors; Mirrors are built on first read and after a partition changes.
+Repeat reads cost page cache hits instead of a parquet decode
+
+@param:date | str | None start - first trading date included (YYYY-MM-DD); None for no lower bound
+@param:date | str | None end - last trading date included (YYYY-MM-DD); None for no upper bound
+@param:list[str] | None symbols - instruments to keep; None for all
+@param:list[str] | None columns - cols to keep; None for all
+@param:Path root - root of the partitioned dataset (silver normalize or gold fact_prices)
+@param:Path ipc_root - root of the IPC mirrors
+@param:int | None version - snapshot of a logged table; None for the latest
+@returns: pa.Table - zero-copy table over the mapped files
+"""
+def read_arrow(start=None, end=None, symbols: list[str] | None = None, columns: list[str] | None = None,
+               root: Path = SILVER_NORMALIZE, ipc_root: Path = IPC_ROOT, version: int | None = None) -> pa.Table:
+
+    start = parse_date(start)
+    end = parse_date(end)
+
+    start_ts, end_ts = dim_time.trading_date_bounds(start, end)
+
+    blocks = []
+
+    for parquet in partition_files(start, end, root, version):
+        blocks.extend(restrict(open_ipc(ensure_ipc(parquet, ipc_root)), start_ts, end_ts, symbols))
+
+    if not blocks:
+        return pa.table({col: pa.array([], pa.string()) for col in columns or []})
+
+    # Chunks are kept as is; Concatenation copies no buffers
+    table = pa.concat_tables(blocks)
+
+    return table.select(columns) if columns else table
+
+
+"""
+Read partitions through their IPC mirrors as a df. Polars and pandas (split blocks) wrap the mapped buffers where the
+type allows; Strings and nullable cols are converted
+
+@param:str backend - "arrow", "polars" or "pandas"
+@param:dict kwargs - read_arrow arguments
+@returns: pa.Table | pl.DataFrame | pd.DataFrame - result
+"""
+def read_frame(backend: str = "polars", **kwargs):
+
+    if backend not in BACKENDS:
+        raise Exception(f"Unknown backend {backend}; Expected one of {BACKENDS}")
+
+    table = read_arrow(**kwargs)
+
+    if backend == "polars":
+        return pl.from_arrow(table, rechunk=False)
+
+    if backend == "pandas":
+        return table.to_pandas(split_blocks=True)
+
+    return table
+
+
+"""
+Build the IPC mirror of every partition of a dataset and drop mirrors whose parquet no longer exists
+
+@param:Path root - root of the partitioned dataset
+@param:Path ipc_root - root of the IPC mirrors
+@returns: tuple[int, int] - mirrors kept, mirrors removed
+"""
+def sync_ipc(root: Path = SILVER_NORMALIZE, ipc_root: Path = IPC_ROOT) -> tuple[int, int]:
+
+    files = partition_files(None, None, root)
+
+    current = {ensure_ipc(parquet, ipc_root) for parquet in files}
+
+    removed = 0
+
+    mirror_root = ipc_path(Path(root) / "_", ipc_root).parent
+
+    # Mirrors of snapshot files sit under the table's data folder
+    for path in mirror_root.rglob("*.arrow"):
+        if path not in current:
+            path.unlink()
+            removed += 1
+
+    return len(current), removed
 
 
 
 if __name__ == "__main__":
 
-    read_all_parquets_in_folder("data/silver/normalize")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Read silver/gold partitions through memory-mapped Arrow IPC mirrors")
+    parser.add_argument("--root", type=Path, default=SILVER_NORMALIZE, help="Root of the partitioned dataset")
+    parser.add_argument("--start", default=None, help="First date (YYYY-MM-DD)")
+    parser.add_argument("--end", default=None, help="Last date (YYYY-MM-DD)")
+    parser.add_argument("--symbols", nargs="*", default=None, help="Instruments to keep")
+    parser.add_argument("--sync", action="store_true", help="Build every mirror of the dataset and drop stale ones")
+
+    args = parser.parse_args()
+
+    if args.sync:
+        kept, removed = sync_ipc(args.root)
+        print(f"IPC mirrors: {kept} up to date, {removed} removed")
+    else:
+        print(read_frame(start=args.start, end=args.end, symbols=args.symbols, root=args.root))
@@ -7,30 +7,57 @@ import pandas as pd
 from pathlib import Path
 
 
-    
+
+import argparse
 import shutil
 import os
 
+import table_log
+
+
+"""
+Delete every parquet of a folder. A logged table commits the removal and garbage collects the files, keeping the ones
+a reader still has pinned; Other folders are deleted outright
+@param: str folder_path - folder to empty
+@returns: None
+"""
 def main(folder_path: str) -> None:
-    
+
     if not input(f"Are you sure you want to eliminate all data in folder path {folder_path}? (Y/N)") == "Y":
         print("No files have been deleted")
-        return 
+        return
 
 
     # Check if the folder exists before attempting to delete to prevent FileNotFoundError
-    if os.path.exists(folder_path) and os.path.isdir(folder_path):
-        try:
-            shutil.rmtree(folder_path)
-            print(f"Folder and all contents at '{folder_path}' deleted successfully.")
-        except OSError as e:
-            print(f"Error: {folder_path} : {e.strerror}")
-    else:
+    if not (os.path.exists(folder_path) and os.path.isdir(folder_path)):
         print(f"Folder not found or is not a directory at '{folder_path}'.")
+        return
+
+    if table_log.has_log(folder_path):
+        version = table_log.truncate(Path(folder_path))
+
+        # Only pinned snapshots survive
+        removed = table_log.gc(Path(folder_path), retain_versions=1, retain_hours=0)
+
+        print(f"Removed all files of '{folder_path}' as version {version}; "
+              f"{removed['files']} data files deleted, {removed['versions']} snapshot(s) retained")
+        return
+
+    try:
+        shutil.rmtree(folder_path)
+        print(f"Folder and all contents at '{folder_path}' deleted successfully.")
+    except OSError as e:
+        print(f"Error: {folder_path} : {e.strerror}")
 
 
 
 
 
 if __name__ == "__main__":
-    main("data/silver/intraday_prices")
+
+    parser = argparse.ArgumentParser(description="Delete the parquet files of a bronze/silver table")
+    parser.add_argument("--table", choices=list(table_log.TABLES), default="intraday_prices", help="Table to empty")
+
+    args = parser.parse_args()
+
+    main(str(table_log.TABLES[args.table]))
@@ -0,0 +1,235 @@
+"""
+Helper for per-file stage metrics (time, rows, bytes, memory) and optional per-stage profiling
+"""
+
+from contextlib import contextmanager
+from pathlib import Path
+import cProfile
+import json
+import os
+import time
+
+
+# Set to "cprofile" or "pyinstrument" to dump a profile per stage
+PROFILE_ENV = "PIPELINE_PROFILE"
+
+# Peak RSS of this process (VmHWM) and its reset; Linux only, peak memory is not recorded elsewhere
+PROC_STATUS = "/proc/self/status"
+PROC_CLEAR_REFS = "/proc/self/clear_refs"
+
+# Peak RSS reached by scopes nested in each open measure block; The mark is reset per block, so an enclosing block
+# takes the max of its own mark and the peaks of the blocks nested in it
+_open_peaks = []
+
+
+"""
+Metrics record for one file and sub_process; Mirrors add_metadata.add_clean_metadata_instance
+
+@returns: dict - metrics record
+"""
+def add_metrics_instance(file: str, layer: str, process: str, sub_process: str,
+                         wall_s: float, cpu_s: float, rows_in: int | None, rows_out: int | None,
+                         bytes_read: int | None, bytes_written: int | None, peak_rss_mb: float | None):
+
+    return {
+        "file": file,
+        "layer": layer,
+        "process": process,
+        "sub_process": sub_process,
+        "wall_s": wall_s,
+        "cpu_s": cpu_s,
+        "rows_in": rows_in,
+        "rows_out": rows_out,
+        "bytes_read": bytes_read,
+        "bytes_written": bytes_written,
+        "peak_rss_mb": peak_rss_mb,
+    }
+
+
+"""
+High-water mark of this process' resident memory since start or the last reset_peak_rss
+
+@returns: float | None - MB; None where unavailable
+"""
+def peak_rss_mb() -> float | None:
+    try:
+        with open(PROC_STATUS) as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+
+    return None
+
+
+"""
+Reset the resident memory high-water mark to the current RSS (Linux 4.0+)
+
+@returns: bool - False where the mark cannot be reset
+"""
+def reset_peak_rss() -> bool:
+    try:
+        with open(PROC_CLEAR_REFS, "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        return False
+
+    return True
+
+
+"""
+Largest of several memory readings
+
+@param:float | None values - MB readings; None for no reading
+@returns: float | None - max; None if no reading
+"""
+def max_mb(*values) -> float | None:
+    return max((value for value in values if value is not None), default=None)
+
+
+"""
+Size of a file, or of several files
+
+@param:str | Path | list paths - file path(s)
+@returns: int | None - bytes; None if a file does not exist
+"""
+def file_bytes(paths) -> int | None:
+    if not isinstance(paths, (list, tuple)):
+        paths = [paths]
+
+    try:
+        return sum(os.path.getsize(path) for path in paths)
+    except OSError:
+        return None
+
+
+"""
+Measure a block of work for one file; Yields a dict the caller fills with rows/bytes counts.
+The record is appended to metrics when the block exits, also when it raises
+
+@param:list metrics - list the record is appended to
+@param:str file - file being processed
+@param:str layer - bronze / silver / gold
+@param:str process - stage process (ingest, cleaning, normalize...)
+@param:str sub_process - sub process (col_existence, col_type, normalize...) or "total"
+@returns: Iterator[dict] - counts to fill: rows_in, rows_out, bytes_read, bytes_written
+"""
+@contextmanager
+def measure(metrics: list, file: str, layer: str, process: str, sub_process: str):
+
+    counts = {"rows_in": None, "rows_out": None, "bytes_read": None, "bytes_written": None}
+
+    # Peak of the enclosing block so far, kept before the mark is reset for this one
+    if _open_peaks:
+        _open_peaks[-1] = max_mb(_open_peaks[-1], peak_rss_mb())
+
+    per_block = reset_peak_rss()
+
+    _open_peaks.append(None)
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    try:
+        yield counts
+    finally:
+        nested = _open_peaks.pop()
+
+        peak = max_mb(nested, peak_rss_mb()) if per_block else None
+
+        if _open_peaks:
+            _open_peaks[-1] = max_mb(_open_peaks[-1], peak)
+
+        metrics.append(add_metrics_instance(file=str(file),
+                                            layer=layer,
+                                            process=process,
+                                            sub_process=sub_process,
+                                            wall_s=round(time.perf_counter() - wall_start, 4),
+                                            cpu_s=round(time.process_time() - cpu_start, 4),
+                                            peak_rss_mb=peak,
+                                            **counts))
+
+
+"""
+Write metrics records next to a stage's metadata json
+
+@param:Path meta_dir - metadata folder of the stage
+@param:str name - json file name (e.g. cleaning_metrics.json)
+@param:list metrics - metrics records
+@returns: None
+"""
+def write_metrics(meta_dir: Path, name: str, metrics: list) -> None:
+    Path(meta_dir).mkdir(parents=True, exist_ok=True)
+
+    with open(Path(meta_dir) / name, "w") as json_file:
+        json.dump(metrics, json_file, indent=4)
+
+
+"""
+Print the slowest files of a run
+
+@param:list metrics - metrics records
+@param:str sub_process - sub process to rank on
+@param:int n - number of files
+@returns: None
+"""
+def print_slowest(metrics: list, sub_process: str = "total", n: int = 5) -> None:
+    ranked = sorted((m for m in metrics if m["sub_process"] == sub_process), key=lambda m: m["wall_s"], reverse=True)
+
+    for m in ranked[:n]:
+        print(f"  {m['wall_s']:.3f}s {m['file']}")
+
+
+"""
+Profile a whole stage when PIPELINE_PROFILE is set; Dumps to <meta_dir>/profiles/.
+Only the calling process is profiled, so run with 1 worker for a complete picture
+
+@param:str stage - stage name used for the dump file
+@param:Path meta_dir - metadata folder of the stage
+@returns: Iterator[None]
+"""
+@contextmanager
+def profile_stage(stage: str, meta_dir: Path):
+
+    mode = os.getenv(PROFILE_ENV, "").lower()
+
+    if mode not in ("cprofile", "pyinstrument"):
+        yield
+        return
+
+    out_dir = Path(meta_dir) / "profiles"
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    stamp = time.strftime("%Y%m%d_%H%M%S")
+
+    if mode == "pyinstrument":
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+
+        try:
+            yield
+        finally:
+            profiler.stop()
+
+            out_path = out_dir / f"{stage}_{stamp}.html"
+            out_path.write_text(profiler.output_html())
+
+            print(f"Profile written to {out_path}")
+
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    try:
+        yield
+    finally:
+        profiler.disable()
+
+        out_path = out_dir / f"{stage}_{stamp}.prof"
+        profiler.dump_stats(out_path)
+
+        print(f"Profile written to {out_path}")
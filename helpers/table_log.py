@@ -0,0 +1,555 @@
+"""
+Helper for versioned bronze/silver tables; An append-only transaction log per table folder commits each stage's files
+as one atomic snapshot, readers pin a snapshot, and files no retained snapshot references are garbage collected
+"""
+
+from pathlib import Path
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+import argparse
+import json
+import os
+import re
+import shutil
+import uuid
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_ROOT = Path(os.getenv("DATA_ROOT", PROJECT_ROOT / "data"))
+
+# Logged tables; Folder names are the logical file paths readers already use
+TABLES = {
+    "intraday_prices": DATA_ROOT / "bronze" / "intraday_prices",
+    "cleaning": DATA_ROOT / "silver" / "cleaning",
+    "normalize": DATA_ROOT / "silver" / "normalize",
+}
+
+LOG_DIR = "_txn_log"
+DATA_DIR = "_data"
+PIN_DIR = "_pins"
+
+COMMIT_NAME = re.compile(r"^(\d{20})\.json$")
+CHECKPOINT_NAME = re.compile(r"^(\d{20})\.checkpoint\.json$")
+
+# Full file list written every n commits so a snapshot replays at most n commits
+CHECKPOINT_INTERVAL = 50
+
+# Snapshots kept by gc besides pinned ones; Overridden by TABLE_RETAIN_VERSIONS / TABLE_RETAIN_HOURS
+RETAIN_VERSIONS = int(os.getenv("TABLE_RETAIN_VERSIONS", 5))
+RETAIN_HOURS = float(os.getenv("TABLE_RETAIN_HOURS", 24 * 7))
+
+# Pins of a crashed reader stop protecting their snapshot after this many hours
+PIN_TTL_HOURS = float(os.getenv("TABLE_PIN_TTL_HOURS", 24))
+
+# Commits lost to a concurrent writer before giving up
+MAX_COMMIT_ATTEMPTS = 100
+
+
+# ----------------------------
+# Log
+# ----------------------------
+
+"""
+Log folder of a table
+
+@param:Path root - table folder
+@returns: Path - _txn_log folder
+"""
+def log_dir(root: Path) -> Path:
+    return Path(root) / LOG_DIR
+
+
+"""
+Versions of the commits in a table's log
+
+@param:Path root - table folder
+@returns: list[int] - versions, oldest first
+"""
+def commit_versions(root: Path) -> list[int]:
+    if not log_dir(root).is_dir():
+        return []
+
+    return sorted(int(match.group(1)) for match in map(COMMIT_NAME.match, os.listdir(log_dir(root))) if match)
+
+
+"""
+Whether a table folder has a transaction log
+
+@param:Path root - table folder
+@returns: bool - True once a commit exists
+"""
+def has_log(root: Path) -> bool:
+    return bool(commit_versions(root))
+
+
+"""
+Latest version of a table
+
+@param:Path root - table folder
+@returns: int | None - version; None without a log
+"""
+def current_version(root: Path) -> int | None:
+    versions = commit_versions(root)
+
+    return versions[-1] if versions else None
+
+
+"""
+Read one commit of a table's log
+
+@param:Path root - table folder
+@param:int version - commit version
+@returns: dict - {"version", "timestamp", "operation", "add", "remove"}
+"""
+def read_commit(root: Path, version: int) -> dict:
+    with open(log_dir(root) / f"{version:020d}.json") as json_file:
+        return json.load(json_file)
+
+
+"""
+Apply a commit to a file map
+
+@param:dict files - logical path -> add action
+@param:dict entry - commit
+@returns: None
+"""
+def apply_commit(files: dict, entry: dict) -> None:
+    for path in entry["remove"]:
+        files.pop(path, None)
+
+    for action in entry["add"]:
+        files[action["path"]] = action
+
+
+"""
+Replay a table's log into the file map of a version; Starts from the latest checkpoint at or before it
+
+@param:Path root - table folder
+@param:int | None version - version to read; None for the latest
+@returns: dict - {"version": int | None, "files": {logical path: add action}}
+"""
+def snapshot(root: Path, version: int | None = None) -> dict:
+    versions = commit_versions(root)
+
+    if not versions:
+        return {"version": None, "files": {}}
+
+    version = versions[-1] if version is None else version
+
+    if version not in versions:
+        raise Exception(f"Version {version} not in the log of {root}; Latest is {versions[-1]}")
+
+    checkpoints = [int(match.group(1)) for match in map(CHECKPOINT_NAME.match, os.listdir(log_dir(root)))
+                   if match and int(match.group(1)) <= version]
+
+    files = {}
+    first = 0
+
+    if checkpoints:
+        with open(log_dir(root) / f"{max(checkpoints):020d}.checkpoint.json") as json_file:
+            files = json.load(json_file)["files"]
+
+        first = max(checkpoints) + 1
+
+    for v in versions:
+        if first <= v <= version:
+            apply_commit(files, read_commit(root, v))
+
+    return {"version": version, "files": files}
+
+
+"""
+Physical files of a snapshot; Immutable, so a reader holding them never sees a later commit
+
+@param:Path root - table folder
+@param:int | None version - version to read; None for the latest
+@returns: dict - logical path -> physical Path, sorted by logical path
+"""
+def snapshot_files(root: Path, version: int | None = None) -> dict:
+    files = snapshot(root, version)["files"]
+
+    return {path: Path(root) / files[path]["data"] for path in sorted(files)}
+
+
+"""
+Live path of a file of a table; Snapshot files map back to the logical path they were committed under
+
+@param:Path root - table folder
+@param:Path path - live or snapshot file
+@returns: Path - resolved live path
+"""
+def live_path(root: Path, path: Path) -> Path:
+    root = Path(root).resolve()
+    path = Path(path).resolve()
+
+    relative = path.relative_to(root)
+
+    if relative.parts[:1] == (DATA_DIR,):
+        return root.joinpath(*relative.parts[2:])
+
+    return path
+
+
+"""
+Parquet files of a table's live folders; What a table holds before its first commit
+
+@param:Path root - table folder
+@returns: list[Path] - live files, log and data folders and temp files excluded
+"""
+def live_files(root: Path) -> list[Path]:
+    return sorted(
+        path for path in Path(root).rglob("*.parquet")
+        if not any(part.startswith(("_", ".")) for part in path.relative_to(root).parts)
+    )
+
+
+# ----------------------------
+# Commits
+# ----------------------------
+
+"""
+Link a live file into the table's data folder; The live name can then be replaced or removed without touching
+snapshots that hold the file
+
+@param:Path root - table folder
+@param:Path path - live file
+@param:str token - data folder of the commit
+@returns: dict - add action {"path", "data", "size", "mtime"}
+"""
+def add_action(root: Path, path: Path, token: str) -> dict:
+    logical = Path(path).relative_to(root)
+    data = Path(DATA_DIR) / token / logical
+
+    (Path(root) / data).parent.mkdir(parents=True, exist_ok=True)
+
+    try:
+        os.link(path, Path(root) / data)
+    except OSError:
+        # No hard links on this file system
+        shutil.copy2(path, Path(root) / data)
+
+    stat = os.stat(Path(root) / data)
+
+    return {"path": logical.as_posix(), "data": data.as_posix(), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+"""
+Write a commit as the next version of the log. The name is claimed with a hard link, which fails if it exists, so two
+writers never get the same version; The loser rereads the log and retries
+
+@param:Path root - table folder
+@param:str operation - what made the commit (e.g. ingest, cleaning, normalize)
+@param:list[dict] adds - add actions
+@param:list[str] removes - logical paths removed
+@returns: int - committed version
+"""
+def write_commit(root: Path, operation: str, adds: list[dict], removes: list[str]) -> int:
+    log_dir(root).mkdir(parents=True, exist_ok=True)
+
+    tmp_path = log_dir(root) / f".commit.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+
+    try:
+        for _ in range(MAX_COMMIT_ATTEMPTS):
+            latest = current_version(root)
+            version = 0 if latest is None else latest + 1
+
+            entry = {
+                "version": version,
+                "timestamp": datetime.now().isoformat(timespec="microseconds"),
+                "operation": operation,
+                "add": adds,
+                "remove": removes,
+            }
+
+            with open(tmp_path, "w") as json_file:
+                json.dump(entry, json_file, indent=4)
+
+            try:
+                os.link(tmp_path, log_dir(root) / f"{version:020d}.json")
+            except FileExistsError:
+                continue
+
+            if version and version % CHECKPOINT_INTERVAL == 0:
+                write_checkpoint(root, version)
+
+            return version
+
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    raise Exception(f"Could not commit to {root} after {MAX_COMMIT_ATTEMPTS} attempts")
+
+
+"""
+Write the full file map of a version; Same content whoever writes it, so a plain replace is safe
+
+@param:Path root - table folder
+@param:int version - committed version
+@returns: None
+"""
+def write_checkpoint(root: Path, version: int) -> None:
+    tmp_path = log_dir(root) / f".{version:020d}.checkpoint.{os.getpid()}.tmp"
+
+    with open(tmp_path, "w") as json_file:
+        json.dump({"version": version, "files": snapshot(root, version)["files"]}, json_file)
+
+    os.replace(tmp_path, log_dir(root) / f"{version:020d}.checkpoint.json")
+
+
+"""
+Commit files a stage wrote or removed as one snapshot. Stages keep writing live files (temp file then os.replace);
+The commit links them into an immutable data folder and appends one log entry, so readers of the log see every file
+of the commit or none. The first commit of a table records its existing live files as version 0
+
+@param:Path root - table folder
+@param:list[Path] added - live files written
+@param:list[Path] removed - live files removed
+@param:str operation - what made the commit
+@returns: int | None - committed version; None if there is nothing to commit
+"""
+def commit(root: Path, added: list, removed: list | None = None, operation: str = "write") -> int | None:
+    root = Path(root)
+
+    added = [Path(path) for path in added]
+    removed = [Path(path).relative_to(root).as_posix() for path in removed or [] if Path(path) not in added]
+
+    if not added and not removed:
+        return None
+
+    if not has_log(root):
+        existing = [path for path in live_files(root) if path not in added]
+
+        if existing:
+            token = uuid.uuid4().hex[:12]
+            write_commit(root, "init", [add_action(root, path, token) for path in existing], [])
+
+    token = uuid.uuid4().hex[:12]
+
+    version = write_commit(root, operation, [add_action(root, path, token) for path in added], removed)
+
+    print(f"Committed {len(added)} added, {len(removed)} removed files to {root.name} as version {version}")
+
+    return version
+
+
+"""
+Remove every file of a table; Live files are unlinked, data files stay for pinned readers until gc
+
+@param:Path root - table folder
+@returns: int | None - committed version; None if the table is empty
+"""
+def truncate(root: Path) -> int | None:
+    root = Path(root)
+
+    files = [root / path for path in snapshot(root)["files"]] if has_log(root) else live_files(root)
+
+    version = commit(root, [], files, operation="truncate")
+
+    for path in files:
+        path.unlink(missing_ok=True)
+
+    return version
+
+
+# ----------------------------
+# Pins
+# ----------------------------
+
+"""
+Pin a snapshot so gc keeps its files; Release with unpin
+
+@param:Path root - table folder
+@param:int | None version - version to pin; None for the latest
+@returns: dict - snapshot plus the pin file
+"""
+def pin(root: Path, version: int | None = None) -> dict:
+    # gc always keeps the latest version, so it cannot lose files before the pin is written
+    version = current_version(root) if version is None else version
+
+    # Nothing to protect in a table without a log
+    if version is None:
+        return {"version": None, "files": {}, "pin": None}
+
+    pin_dir = log_dir(root) / PIN_DIR
+    pin_dir.mkdir(parents=True, exist_ok=True)
+
+    pin_path = pin_dir / f"{os.getpid()}.{uuid.uuid4().hex[:8]}.json"
+
+    with open(pin_path, "w") as json_file:
+        json.dump({"version": version, "pid": os.getpid(), "created": datetime.now().isoformat()}, json_file)
+
+    return {**snapshot(root, version), "pin": pin_path}
+
+
+"""
+Release a pinned snapshot
+
+@param:dict pinned - return value of pin
+@returns: None
+"""
+def unpin(pinned: dict) -> None:
+    if pinned["pin"] is not None:
+        Path(pinned["pin"]).unlink(missing_ok=True)
+
+
+"""
+Pin a snapshot for the duration of a with block
+
+@param:Path root - table folder
+@param:int | None version - version to pin; None for the latest
+@returns: Iterator[dict] - pinned snapshot
+"""
+@contextmanager
+def pinned(root: Path, version: int | None = None):
+    snap = pin(root, version)
+
+    try:
+        yield snap
+    finally:
+        unpin(snap)
+
+
+"""
+Versions held by live pins; Pins of dead processes or older than PIN_TTL_HOURS are removed
+
+@param:Path root - table folder
+@returns: set[int] - pinned versions
+"""
+def pinned_versions(root: Path) -> set[int]:
+    pin_dir = log_dir(root) / PIN_DIR
+
+    if not pin_dir.is_dir():
+        return set()
+
+    cutoff = datetime.now() - timedelta(hours=PIN_TTL_HOURS)
+
+    versions = set()
+
+    for pin_path in pin_dir.glob("*.json"):
+        try:
+            with open(pin_path) as json_file:
+                entry = json.load(json_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+
+        try:
+            os.kill(entry["pid"], 0)
+            alive = True
+        except ProcessLookupError:
+            alive = False
+        except PermissionError:
+            alive = True
+
+        if alive and datetime.fromisoformat(entry["created"]) >= cutoff:
+            versions.add(entry["version"])
+        else:
+            pin_path.unlink(missing_ok=True)
+
+    return versions
+
+
+# ----------------------------
+# Garbage collection
+# ----------------------------
+
+"""
+Remove data files no retained snapshot references. A snapshot is retained while it is one of the last retain_versions,
+was current within the last retain_hours, or is pinned
+
+@param:Path root - table folder
+@param:int retain_versions - latest snapshots kept
+@param:float retain_hours - snapshots replaced less than this long ago are kept
+@param:bool dry_run - report without removing
+@returns: dict - {"files", "bytes"} removed and {"versions"} retained
+"""
+def gc(root: Path, retain_versions: int = RETAIN_VERSIONS, retain_hours: float = RETAIN_HOURS,
+       dry_run: bool = False) -> dict:
+
+    root = Path(root)
+
+    versions = commit_versions(root)
+
+    if not versions:
+        return {"files": 0, "bytes": 0, "versions": 0}
+
+    pins = pinned_versions(root)
+    cutoff = datetime.now() - timedelta(hours=retain_hours)
+
+    entries = [read_commit(root, version) for version in versions]
+
+    keep = set()
+    retained = 0
+
+    files = {}
+
+    for i, entry in enumerate(entries):
+        apply_commit(files, entry)
+
+        # Time the snapshot stopped being current; The latest one still is
+        replaced_at = datetime.fromisoformat(entries[i + 1]["timestamp"]) if i + 1 < len(entries) else None
+
+        if (i >= len(entries) - retain_versions or entry["version"] in pins
+                or replaced_at is None or replaced_at >= cutoff):
+            keep.update(action["data"] for action in files.values())
+            retained += 1
+
+    removed = 0
+    removed_bytes = 0
+
+    data_root = root / DATA_DIR
+
+    for path in sorted(data_root.rglob("*")) if data_root.is_dir() else []:
+        if path.is_file() and path.relative_to(root).as_posix() not in keep:
+            removed += 1
+            removed_bytes += path.stat().st_size
+
+            if not dry_run:
+                path.unlink()
+
+    # Empty commit folders, deepest first
+    if not dry_run and data_root.is_dir():
+        for folder in sorted((p for p in data_root.rglob("*") if p.is_dir()), key=lambda p: len(p.parts), reverse=True):
+            if not any(folder.iterdir()):
+                folder.rmdir()
+
+    return {"files": removed, "bytes": removed_bytes, "versions": retained}
+
+
+"""
+Log of a table as one line per commit
+
+@param:Path root - table folder
+@returns: list[dict] - version, timestamp, operation, files added and removed
+"""
+def history(root: Path) -> list[dict]:
+    return [
+        {"version": entry["version"], "timestamp": entry["timestamp"], "operation": entry["operation"],
+         "added": len(entry["add"]), "removed": len(entry["remove"])}
+        for entry in (read_commit(root, version) for version in commit_versions(root))
+    ]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Inspect and garbage collect the transaction logs of bronze/silver tables")
+    parser.add_argument("--table", choices=list(TABLES), nargs="*", default=list(TABLES), help="Tables to act on")
+    parser.add_argument("--history", action="store_true", help="Print the commits of each table")
+    parser.add_argument("--gc", action="store_true", help="Remove data files no retained snapshot references")
+    parser.add_argument("--retain-versions", type=int, default=RETAIN_VERSIONS, help="Latest snapshots kept by gc")
+    parser.add_argument("--retain-hours", type=float, default=RETAIN_HOURS, help="Hours a replaced snapshot is kept by gc")
+    parser.add_argument("--dry-run", action="store_true", help="Report what gc would remove")
+
+    args = parser.parse_args()
+
+    for table in args.table:
+        root = TABLES[table]
+
+        print(f"{table}: version {current_version(root)}, {len(snapshot(root)['files'])} files")
+
+        if args.history:
+            for entry in history(root):
+                print(f"  {entry['version']:>6} {entry['timestamp']} {entry['operation']:<10} "
+                      f"+{entry['added']} -{entry['removed']}")
+
+        if args.gc:
+            print(f"  gc: {gc(root, args.retain_versions, args.retain_hours, args.dry_run)}")
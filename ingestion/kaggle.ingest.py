@@ -1,12 +1,43 @@
-import kagglehub
+"""
+Resolve the Kaggle dataset through the local cache (See helpers/dataset_cache.py)
+"""
+
+from pathlib import Path
+import argparse
+import sys
+
 from dotenv import load_dotenv
-import os
 
 
-load_dotenv() 
+root_dir = Path(__file__).resolve().parent.parent
+helper_path = str(root_dir / "helpers")
+
+if helper_path not in sys.path:
+    sys.path.append(helper_path)
+
+
+import dataset_cache
+
+
+load_dotenv()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Cache the Kaggle dataset locally and print its path")
+    parser.add_argument("--version", default=None, help="Dataset version; KAGGLE_VERSION or the newest cached/latest when omitted")
+    parser.add_argument("--offline-dir", default=None, help="Use a local dataset folder as is")
+    parser.add_argument("--refresh", action="store_true", help="Download again even if cached")
+    parser.add_argument("--verify", action="store_true", help="Check cached files against their checksums")
+    parser.add_argument("--full", action="store_true", help="With --verify, re-hash every file instead of comparing size/mtime")
+
+    args = parser.parse_args()
+
+    path = dataset_cache.resolve_dataset(version=args.version, offline_dir=args.offline_dir, refresh=args.refresh)
 
+    if args.verify and not args.offline_dir:
+        bad = dataset_cache.verify_mirror(path.parent, full=args.full)
 
-# Download latest version
-path = kagglehub.dataset_download(os.getenv("KAGGLE_PATH"))
+        print(f"Verification: {len(bad)} missing or changed files" + (f" {bad}" if bad else ""))
 
-print("Path to dataset files:", path)
\ No newline at end of file
+    print("Path to dataset files:", path)
@@ -0,0 +1,605 @@
+"""
+End to end DAG runner - ingest -> bronze -> clean -> normalize -> fact per file, then quality checks, the gold marts and the warehouse.
+Each file moves to its next stage as soon as its previous task finishes; Independent tasks share one worker pool
+"""
+
+import os
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+import argparse
+import json
+import time
+
+
+import sys
+
+
+root_dir = Path(__file__).resolve().parent.parent
+
+for folder in ["helpers", "bronze", "silver", "gold", "warehouse"]:
+    folder_path = str(root_dir / folder)
+
+    if folder_path not in sys.path:
+        sys.path.append(folder_path)
+
+
+import dataset_cache
+import manifest
+import query_cache
+import stage_metrics
+import table_log
+import write_raw_parquet
+import clean_data
+import normalize_data
+import quality_checks
+import stitch_series
+import dim_time
+import fact_prices
+import mart_intraday_metrics
+import mart_correlations
+import ohlc_bars
+import load_gold
+
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_ROOT = Path(os.getenv("DATA_ROOT", PROJECT_ROOT / "data"))
+RUN_ROOT = DATA_ROOT / "orchestration"
+RUN_STATE = RUN_ROOT / "run_state.json"
+
+
+# Per file stages in DAG order; A stage is finished once no task of it or of a stage before it is in flight
+FILE_STAGES = ["bronze", "clean", "normalize", "fact"]
+
+# Whole-stage tasks and the last per file stage each one waits for
+STAGE_TASKS = {
+    "dim_time": None,
+    "quality_checks": "normalize",
+    "stitch_series": "normalize",
+    "mart_correlations": "normalize",
+    "ohlc_bars": "normalize",
+    "mart_intraday_metrics": "fact",
+    "load_gold": "fact",
+}
+
+# Whole-stage tasks that must finish before another one starts
+STAGE_TASK_DEPS = {
+    "mart_intraday_metrics": ["dim_time"],
+    "load_gold": ["dim_time"],
+}
+
+# Metadata folder and metadata/metrics json of each per file stage; Same files the stage's own main writes
+STAGE_OUTPUTS = {
+    "bronze": (write_raw_parquet.BRONZE_META, "ingestion_metadata.json", "ingestion_metrics.json"),
+    "clean": (clean_data.SILVER_META, "cleaning_metadata.json", "cleaning_metrics.json"),
+    "normalize": (normalize_data.SILVER_META, "normalize_metadata.json", "normalize_metrics.json"),
+    "fact": (fact_prices.GOLD_META, "fact_prices_metadata.json", "fact_prices_metrics.json"),
+}
+
+# Table folder of each logged per file stage; Every finished file is committed to the table's log
+STAGE_TABLES = {
+    "bronze": write_raw_parquet.BRONZE_ROOT,
+    "clean": clean_data.SILVER_ROOT,
+    "normalize": normalize_data.SILVER_ROOT,
+}
+
+# ----------------------------
+# Whole-stage task entry points; Module level so worker processes can run them
+# ----------------------------
+
+"""
+Build dim_time when it is missing
+
+@returns: None
+"""
+def run_dim_time() -> None:
+    if not dim_time.DIM_TIME_PATH.is_file():
+        dim_time.main()
+
+
+STAGE_TASK_FUNCS = {
+    "dim_time": run_dim_time,
+    "quality_checks": quality_checks.main,
+    "stitch_series": stitch_series.main,
+    "mart_correlations": mart_correlations.main,
+    "ohlc_bars": ohlc_bars.main,
+    "mart_intraday_metrics": mart_intraday_metrics.main,
+    "load_gold": load_gold.main,
+}
+
+
+# ----------------------------
+# Helpers
+# ----------------------------
+
+"""
+Write the run state atomically; Read back by nothing but humans and the next run's summary
+
+@param:dict state - run state
+@returns: None
+"""
+def save_state(state: dict) -> None:
+    RUN_ROOT.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = RUN_ROOT / f".{RUN_STATE.name}.tmp"
+
+    with open(tmp_path, "w") as json_file:
+        json.dump(state, json_file, indent=4)
+
+    os.replace(tmp_path, RUN_STATE)
+
+
+"""
+Resolve the local dataset folder (ingest task)
+
+@param:Path | None dataset_path - local folder of the dataset; Resolved through the dataset cache when None
+@returns: Path - dataset folder
+"""
+def ingest(dataset_path: Path | None) -> Path:
+    if dataset_path is None:
+        return dataset_cache.resolve_dataset(write_raw_parquet.DATASET_ID)
+
+    return Path(dataset_path)
+
+
+# ----------------------------
+# Scheduler
+# ----------------------------
+
+"""
+DAG scheduler state of one run. Stage manifests are updated and saved by the scheduler after every finished task,
+so they double as the checkpoint: rerunning after a crash skips every task that completed
+"""
+class Pipeline:
+
+    """
+    @param:ProcessPoolExecutor executor - worker pool
+    @param:bool overwrite - rebuild every file regardless of the manifests
+    @param:list[str] stage_tasks - whole-stage tasks to run once their inputs are done
+    """
+    def __init__(self, executor: ProcessPoolExecutor, overwrite: bool, stage_tasks: list[str]):
+        self.executor = executor
+        self.overwrite = overwrite
+
+        self.futures = {}
+        self.stage_tasks = list(stage_tasks)
+        self.waiting = list(stage_tasks)
+        self.finished = set()
+
+        self.manifests = {stage: manifest.load_manifest(meta) for stage, (meta, _, _) in STAGE_OUTPUTS.items()}
+        self.metadata = {stage: {} for stage in FILE_STAGES}
+        self.metrics = {stage: [] for stage in FILE_STAGES}
+
+        self.state = {
+            "run_id": datetime.now().strftime("%Y%m%d_%H%M%S"),
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "finished": None,
+            "tasks": {},
+        }
+
+    # -----------------
+    # Bookkeeping
+    # -----------------
+
+    """
+    Record the status of a task and checkpoint the run state
+
+    @param:str task_id - task id (<stage>:<file>)
+    @param:str status - skipped / running / done / failed
+    @param:dict details - extra values for the task
+    @returns: None
+    """
+    def mark(self, task_id: str, status: str, **details) -> None:
+        self.state["tasks"].setdefault(task_id, {}).update(status=status, **details)
+
+        if status != "running":
+            save_state(self.state)
+
+    """
+    Submit a task to the pool
+
+    @param:str stage - stage of the task
+    @param:str file - file the task works on ("" for whole-stage tasks)
+    @param:Callable func - module level function to run
+    @param:tuple args - arguments
+    @param:dict context - values the completion handler needs
+    @returns: None
+    """
+    def submit(self, stage: str, file: str, func, args: tuple, context: dict | None = None) -> None:
+        task_id = f"{stage}:{file}" if file else stage
+
+        future = self.executor.submit(func, *args)
+
+        self.futures[future] = {"id": task_id, "stage": stage, "file": file, "start": time.perf_counter(), **(context or {})}
+
+        self.mark(task_id, "running", stage=stage, file=file)
+
+    """
+    Check if a per file stage and every stage before it have no task in flight
+
+    @param:str stage - per file stage
+    @returns: bool - True when finished
+    """
+    def stage_done(self, stage: str) -> bool:
+        last = FILE_STAGES.index(stage)
+
+        return not any(task["stage"] in FILE_STAGES[:last + 1] for task in self.futures.values())
+
+    """
+    Skip an up to date file; Its stored records are kept and its downstream task is scheduled
+
+    @param:str stage - per file stage
+    @param:str key - manifest key
+    @returns: None
+    """
+    def skip(self, stage: str, key: str) -> None:
+        self.metadata[stage][key] = manifest.stored_records(self.manifests[stage], key)
+
+        self.mark(f"{stage}:{key}", "skipped", stage=stage, file=key)
+
+    """
+    Record a finished per file task in its stage manifest and checkpoint the manifest
+
+    @param:dict task - finished task
+    @param:list records - metadata records
+    @param:list metrics - metrics records
+    @param:Path | list[Path] | None output - outputs; None for a failed file, which stays out of the manifest
+    @param:dict | None extra - stage specific values cached with the entry
+    @returns: None
+    """
+    def record(self, task: dict, records: list, metrics: list, output, extra: dict | None = None) -> None:
+        stage = task["stage"]
+
+        self.metadata[stage][task["key"]] = records
+        self.metrics[stage].extend(metrics)
+
+        if output is not None:
+            manifest.record_build(self.manifests[stage], task["key"], task["fingerprint"], output, task["version"],
+                                  records, extra)
+
+            manifest.save_manifest(STAGE_OUTPUTS[stage][0], self.manifests[stage])
+
+    # -----------------
+    # Per file stages
+    # -----------------
+
+    """
+    Schedule the bronze task of a csv
+
+    @param:Path path - csv in the dataset
+    @returns: None
+    """
+    def schedule_bronze(self, path: Path) -> None:
+        out_path = write_raw_parquet.BRONZE_ROOT / f"{write_raw_parquet.resolve_dataset_name(path)}.parquet"
+        key = out_path.name
+
+        stale, fp = manifest.needs_rebuild(self.manifests["bronze"], key, path, out_path, write_raw_parquet.CODE_VERSION)
+
+        if not (self.overwrite or stale):
+            self.skip("bronze", key)
+            self.schedule_clean(out_path)
+            return
+
+        self.submit("bronze", key, write_raw_parquet.convert_csv, (path,),
+                    {"key": key, "fingerprint": fp, "version": write_raw_parquet.CODE_VERSION, "out_path": out_path})
+
+    """
+    Schedule the cleaning task of a bronze parquet
+
+    @param:Path parquet - bronze parquet
+    @returns: None
+    """
+    def schedule_clean(self, parquet: Path) -> None:
+        out_path = clean_data.SILVER_ROOT / f"{parquet.stem}_cleaning.parquet"
+        key = out_path.name
+
+        stale, fp = manifest.needs_rebuild(self.manifests["clean"], key, parquet, out_path, clean_data.CODE_VERSION)
+
+        if not (self.overwrite or stale):
+            self.skip("clean", key)
+            self.schedule_normalize(out_path)
+            return
+
+        schema_class = manifest.cached_value(self.manifests["clean"], key, "schema_class", fp)
+
+        self.submit("clean", key, clean_data.clean_parquet, (str(parquet), out_path, schema_class),
+                    {"key": key, "fingerprint": fp, "version": clean_data.CODE_VERSION, "out_path": out_path})
+
+    """
+    Schedule the normalize task of a cleaned parquet
+
+    @param:Path parquet - cleaned parquet
+    @returns: None
+    """
+    def schedule_normalize(self, parquet: Path) -> None:
+        key = f"{parquet.stem.replace('_cleaning', '_normalized')}.parquet"
+        build_manifest = self.manifests["normalize"]
+
+        stale, fp = manifest.needs_rebuild(build_manifest, key, parquet, None, normalize_data.CODE_VERSION)
+
+        if not (self.overwrite or stale):
+            self.skip("normalize", key)
+
+            for out_path in manifest.stored_outputs(build_manifest, key):
+                self.schedule_fact(Path(out_path))
+            return
+
+        args = (str(parquet), manifest.cached_value(build_manifest, key, "timestamp_format", fp),
+                manifest.stored_outputs(build_manifest, key))
+
+        self.submit("normalize", key, normalize_data.normalize_file, args,
+                    {"key": key, "fingerprint": fp, "version": normalize_data.CODE_VERSION, "previous_outputs": args[2]})
+
+    """
+    Schedule the fact task of a silver partition file
+
+    @param:Path parquet - silver partition file
+    @returns: None
+    """
+    def schedule_fact(self, parquet: Path) -> None:
+        out_path, key = fact_prices.fact_path(parquet, normalize_data.SILVER_ROOT)
+
+        stale, fp = manifest.needs_rebuild(self.manifests["fact"], key, parquet, out_path, fact_prices.CODE_VERSION)
+
+        if not (self.overwrite or stale):
+            self.skip("fact", key)
+            return
+
+        self.submit("fact", key, fact_prices.build_fact_file, (parquet, out_path),
+                    {"key": key, "fingerprint": fp, "version": fact_prices.CODE_VERSION, "out_path": out_path})
+
+    """
+    Delete the fact files of silver partition files a normalize task no longer produces, with their manifest entries;
+    Otherwise they stay on disk and load_gold keeps loading them next to the new partitions
+
+    @param:list[Path] removed - silver partition files removed
+    @returns: None
+    """
+    def drop_facts(self, removed: list[Path]) -> None:
+        if not removed:
+            return
+
+        for parquet in removed:
+            out_path, key = fact_prices.fact_path(parquet, normalize_data.SILVER_ROOT)
+
+            out_path.unlink(missing_ok=True)
+
+            self.manifests["fact"]["entries"].pop(key, None)
+            self.metadata["fact"].pop(key, None)
+
+        manifest.save_manifest(STAGE_OUTPUTS["fact"][0], self.manifests["fact"])
+
+    """
+    Handle a finished per file task; Records it and schedules the file's next stage
+
+    @param:dict task - finished task
+    @param:Any result - return value of the task
+    @returns: bool - True if the file succeeded
+    """
+    def complete_file_task(self, task: dict, result) -> bool:
+        stage = task["stage"]
+
+        if stage == "bronze":
+            record, metrics = result
+            ok = record["action"] == "processed"
+
+            self.record(task, [record], metrics, task["out_path"] if ok else None)
+
+            if ok:
+                table_log.commit(STAGE_TABLES[stage], [task["out_path"]], operation="ingest")
+                self.schedule_clean(task["out_path"])
+
+        elif stage == "clean":
+            ok, records, metrics, schema_class = result
+
+            self.record(task, records, metrics, task["out_path"] if ok else None, extra={"schema_class": schema_class})
+
+            if ok:
+                table_log.commit(STAGE_TABLES[stage], [task["out_path"]], operation="cleaning")
+                self.schedule_normalize(task["out_path"])
+
+        elif stage == "normalize":
+            records, metrics, out_paths, timestamp_format = result
+            ok = True
+
+            self.record(task, records, metrics, out_paths, extra={"timestamp_format": timestamp_format})
+
+            # The file's new partitions and the ones it no longer produces land as one snapshot
+            table_log.commit(STAGE_TABLES[stage], out_paths, task["previous_outputs"], operation="normalize")
+
+            # Cached query results over the rewritten or removed partitions
+            query_cache.invalidate([*out_paths, *task["previous_outputs"]])
+
+            # Partitions the file no longer produces (e.g. after a repartition) take their fact files with them
+            self.drop_facts([Path(path) for path in task["previous_outputs"] if str(path) not in {str(out) for out in out_paths}])
+
+            for out_path in out_paths:
+                self.schedule_fact(out_path)
+
+        else:
+            records, metrics = result
+            ok = True
+
+            self.record(task, records, metrics, task["out_path"])
+
+        return ok
+
+    # -----------------
+    # Whole-stage tasks
+    # -----------------
+
+    """
+    Submit every waiting whole-stage task whose inputs are finished
+
+    @returns: None
+    """
+    def schedule_stage_tasks(self) -> None:
+        for name in list(self.waiting):
+            after = STAGE_TASKS[name]
+
+            if after is not None and not self.stage_done(after):
+                continue
+
+            # Dependencies left out of this run do not block
+            if not all(dep in self.finished for dep in STAGE_TASK_DEPS.get(name, []) if dep in self.stage_tasks):
+                continue
+
+            self.waiting.remove(name)
+
+            self.submit(name, "", STAGE_TASK_FUNCS[name], ())
+
+    # -----------------
+    # Run loop
+    # -----------------
+
+    """
+    Run until no task is in flight or waiting
+
+    @param:list[Path] csv_files - csv files of the dataset
+    @returns: list[str] - ids of failed tasks
+    """
+    def run(self, csv_files: list[Path]) -> list[str]:
+
+        for path in csv_files:
+            self.schedule_bronze(path)
+
+        failed = []
+
+        self.schedule_stage_tasks()
+
+        while self.futures:
+            done, _ = wait(self.futures, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                task = self.futures.pop(future)
+                wall_s = round(time.perf_counter() - task["start"], 4)
+
+                try:
+                    result = future.result()
+
+                    ok = self.complete_file_task(task, result) if task["stage"] in FILE_STAGES else True
+
+                except Exception as error:
+                    ok = False
+
+                    self.mark(task["id"], "failed", wall_s=wall_s, error=repr(error))
+
+                    print(f"Task {task['id']} failed: {error!r}")
+
+                else:
+                    self.mark(task["id"], "done" if ok else "failed", wall_s=wall_s)
+
+                if ok:
+                    self.finished.add(task["id"])
+                else:
+                    failed.append(task["id"])
+
+            self.schedule_stage_tasks()
+
+        # Whole-stage tasks whose dependency failed never start
+        for name in self.waiting:
+            self.mark(name, "not_started", stage=name, file="")
+
+        return failed
+
+    """
+    Write each per file stage's metadata and metrics json, in file order
+
+    @returns: None
+    """
+    def write_metadata(self) -> None:
+        for stage, (meta_dir, metadata_name, metrics_name) in STAGE_OUTPUTS.items():
+            if not self.metadata[stage]:
+                continue
+
+            Path(meta_dir).mkdir(parents=True, exist_ok=True)
+
+            metadata = [record for key in sorted(self.metadata[stage]) for record in self.metadata[stage][key]]
+
+            with open(Path(meta_dir) / metadata_name, "w") as json_file:
+                json.dump(metadata, json_file, indent=4)
+
+            stage_metrics.write_metrics(meta_dir, metrics_name, self.metrics[stage])
+
+
+# -----------------------
+# Main func for run_pipeline
+# ----------------------
+
+"""
+Main func for run_pipeline - Runs the whole pipeline as a DAG of per file tasks on a worker pool.
+Up to date files are skipped through the stage manifests, so an interrupted run resumes where it stopped
+@param: Path | None dataset_path - local folder of the dataset; Resolved through the dataset cache when None
+@param: int workers - worker processes
+@param: bool overwrite - rebuild every file regardless of the manifests; False by default
+@param: bool gold_marts - also build the marts and bars; True by default
+@param: bool warehouse - also build dim_time and load the warehouse; True by default
+@returns: dict - run state
+"""
+def main(dataset_path: Path | None = None, workers: int = os.cpu_count() or 1, overwrite: bool = False,
+         gold_marts: bool = True, warehouse: bool = True) -> dict:
+
+    start = time.perf_counter()
+
+    dataset_path = ingest(dataset_path)
+
+    csv_files = [path for path in sorted(write_raw_parquet.list_csv_files(dataset_path))
+                 if not write_raw_parquet.is_skip_file(path, write_raw_parquet.resolve_dataset_name(path))]
+
+    if not csv_files:
+        raise FileNotFoundError("No CSV files found in Kaggle dataset")
+
+    for folder in [write_raw_parquet.BRONZE_ROOT, clean_data.SILVER_ROOT, normalize_data.SILVER_ROOT, fact_prices.GOLD_ROOT]:
+        Path(folder).mkdir(parents=True, exist_ok=True)
+
+    stage_tasks = ["quality_checks", "stitch_series"]
+
+    if warehouse or gold_marts:
+        stage_tasks.append("dim_time")
+
+    if gold_marts:
+        stage_tasks.extend(["mart_correlations", "ohlc_bars", "mart_intraday_metrics"])
+
+    if warehouse:
+        stage_tasks.append("load_gold")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pipeline = Pipeline(executor, overwrite, stage_tasks)
+
+        try:
+            failed = pipeline.run(csv_files)
+        finally:
+            pipeline.state["finished"] = datetime.now().isoformat(timespec="seconds")
+            save_state(pipeline.state)
+
+            pipeline.write_metadata()
+
+            # Data files of snapshots past retention and not pinned by a reader
+            for root in STAGE_TABLES.values():
+                table_log.gc(root)
+
+    statuses = [task["status"] for task in pipeline.state["tasks"].values()]
+
+    print(f"Pipeline finished in {time.perf_counter() - start:.2f}s with {workers} worker(s): "
+          f"{statuses.count('done')} done, {statuses.count('skipped')} skipped, {len(failed)} failed")
+
+    if failed:
+        raise Exception(f"Pipeline tasks failed: {failed}")
+
+    return pipeline.state
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run the pipeline end to end as a DAG of per file tasks")
+    parser.add_argument("--dataset-path", type=Path, default=None, help="Local dataset folder; Resolved through the dataset cache when omitted")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    parser.add_argument("--overwrite", action="store_true", help="Rebuild every file, ignoring the manifests")
+    parser.add_argument("--no-gold-marts", action="store_true", help="Skip the marts and bars")
+    parser.add_argument("--no-warehouse", action="store_true", help="Skip dim_time and the warehouse load")
+
+    args = parser.parse_args()
+
+    main(dataset_path=args.dataset_path, workers=args.workers, overwrite=args.overwrite,
+         gold_marts=not args.no_gold_marts, warehouse=not args.no_warehouse)
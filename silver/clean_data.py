@@ -1,7 +1,13 @@
 import pandas as pd
+import numpy as np
 import os
+from concurrent.futures import ProcessPoolExecutor
+import argparse
 from pathlib import Path
-import pyarrow as pq
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import json
 
 
@@ -16,16 +22,44 @@ if helper_path not in sys.path:
 
 
 import add_metadata
+import manifest
+import stage_metrics
+import table_log
 
 
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
-SILVER_ROOT = PROJECT_ROOT / "data" / "silver" / "cleaning"
-SILVER_META = PROJECT_ROOT / "data" / "silver" / "cleaning_metadata"
+DATA_ROOT = Path(os.getenv("DATA_ROOT", PROJECT_ROOT / "data"))
+SILVER_ROOT = DATA_ROOT / "silver" / "cleaning"
+SILVER_META = DATA_ROOT / "silver" / "cleaning_metadata"
 
 
 VALID_COLS = ['ID', 'TimeStamp', '/ES', '/NQ', '/RTY', 'SPY', 'QQQ', 'IWM']
 
+# Target dtype of each necassary col after cleaning
+TARGET_SCHEMA = {
+    "ID": "int64",
+    "TimeStamp": "str",
+    "/ES": "float64",
+    "/NQ": "float64",
+    "/RTY": "float64",
+    "SPY": "float64",
+    "QQQ": "float64",
+    "IWM": "float64",
+}
+
+# Schema class of a bronze parquet (See README.md); Sniffed from the parquet footer and cached in the manifest
+SCHEMA_CONFORMING = "conforming"
+SCHEMA_ISSUE_1 = "schema_issue_1"
+SCHEMA_ISSUE_2 = "schema_issue_2"
+SCHEMA_UNKNOWN = "unknown"
+
+# Number of failed row positions kept in metadata notes per col
+FAILED_ROWS_SAMPLE = 20
+
+# Version of this stage's logic; Bumps whenever this file or a helper it builds its outputs with changes
+CODE_VERSION = manifest.code_version(__file__, add_metadata.__file__, table_log.__file__)
+
 # ----------------------------
 # Helpers
 # ----------------------------
@@ -62,269 +96,461 @@ def list_files_alphabetically(folder_path: Path, substring:str = "") -> list[Pat
 
 
 
-# -----------------------
-# Main func for cleaing parquets
-# ----------------------
+"""
+Classify a bronze parquet by its header; Reads the parquet footer only, no rows
+
+@param:str parquet - path to bronze parquet
+@returns: str - SCHEMA_CONFORMING, SCHEMA_ISSUE_1, SCHEMA_ISSUE_2 or SCHEMA_UNKNOWN
+"""
+def sniff_schema_class(parquet: str) -> str:
+
+    names = pq.read_schema(parquet).names
+
+    if all(col in names for col in VALID_COLS):
+        return SCHEMA_CONFORMING
+
+    # A .tsv read as .csv: One col whose name holds every tab separated header
+    if len(names) == 1 and "\t" in names[0]:
+        return SCHEMA_ISSUE_2
+
+    # First data row read as the header
+    if len(names) == len(VALID_COLS):
+        return SCHEMA_ISSUE_1
+
+    return SCHEMA_UNKNOWN
 
 
 """
-Main func for cleaning - Makes cleaned silver parquet files
-@param: str folder_path - path to bronze parquet files 
-@returns: None
+Schema issue 1 - Rename the cols to VALID_COLS and prepend the misplaced header as a single row.
+Renaming only touches the schema and the extra row is a new chunk, so no existing row is copied; A col whose header
+text does not fit its type is turned back into text, so col typing reports that row like any other bad value
+
+@param:pa.Table table - bronze table
+@returns: pa.Table - repaired table
 """
-def main(folder_path:str):    
-    
-    sorted_parquet_paths = list_files_alphabetically(folder_path=folder_path)
+def repair_schema_issue_1(table: pa.Table) -> pa.Table:
+
+    header = table.column_names
+
+    table = table.rename_columns(VALID_COLS)
+
+    first_row = []
+
+    for i, (value, field) in enumerate(zip(header, table.schema)):
+        try:
+            first_row.append(pa.array([value]).cast(field.type))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            # Left for col typing to report (silver_cleaning_col_4); Only this col is copied
+            table = table.set_column(i, pa.field(field.name, pa.string()), table.column(i).cast(pa.string()))
+            first_row.append(pa.array([value], pa.string()))
+
+    return pa.concat_tables([pa.Table.from_arrays(first_row, schema=table.schema), table])
+
+
+"""
+Schema issue 2 - Re-read the single col of tab separated lines as a .tsv with its own header
+
+@param:pa.Table table - bronze table
+@returns: pa.Table - repaired table; Every col a string, typed later by coerce_to_schema
+"""
+def repair_schema_issue_2(table: pa.Table) -> pa.Table:
+
+    col_name = table.column_names[0]
+    headers = col_name.split("\t")
+
+    lines = table.column(0).combine_chunks().cast(pa.large_string()).fill_null("")
+
+    # Join every line into one buffer for the csv reader
+    whole = pa.LargeListArray.from_arrays(pa.array([0, len(lines)], pa.int64()), lines)
+    buffer = pc.binary_join(whole, pa.scalar("\n", pa.large_string()))[0].as_buffer()
+
+    return pacsv.read_csv(
+        pa.BufferReader(buffer),
+        read_options=pacsv.ReadOptions(column_names=headers),
+        parse_options=pacsv.ParseOptions(delimiter="\t"),
+        convert_options=pacsv.ConvertOptions(column_types={name: pa.string() for name in headers},
+                                             strings_can_be_null=True),
+    )
+
+
+"""
+Read a bronze parquet with its schema repaired at read time
+
+@param:str parquet - path to bronze parquet
+@param:str schema_class - class from sniff_schema_class
+@returns: pd.DataFrame - df with VALID_COLS
+"""
+def read_repaired(parquet: str, schema_class: str) -> pd.DataFrame:
+
+    if schema_class == SCHEMA_UNKNOWN:
+        raise Exception(f"An unknown error has occured on parquet {parquet}")
+
+    table = pq.read_table(parquet)
+
+    if schema_class == SCHEMA_ISSUE_1:
+        table = repair_schema_issue_1(table)
+
+    elif schema_class == SCHEMA_ISSUE_2:
+        table = repair_schema_issue_2(table)
+
+    return table.to_pandas()
+
+
+"""
+Coerce a single col to a numeric dtype without a string round trip
+
+@param:pd.Series series - col to coerce
+@param:str dtype - "int64" or "float64"
+@returns: tuple[pd.Series, np.ndarray] - coerced col (float64 for ints, cast by caller) and mask of rows that failed
+"""
+def coerce_numeric(series: pd.Series, dtype: str) -> tuple[pd.Series, np.ndarray]:
+
+    coerced = pd.to_numeric(series, errors="coerce")
+
+    failed = (coerced.isna() & series.notna()).to_numpy()
+
+    if dtype == "int64":
+        # Nulls and fractional values cannot be held by int64
+        failed = coerced.isna().to_numpy() | (coerced.fillna(0) % 1 != 0).to_numpy()
+
+    return coerced.astype("float64"), failed
+
+
+"""
+Coerce the necassary cols of a df to TARGET_SCHEMA; Cols already typed correctly are untouched
+
+@param:pd.DataFrame df - df to coerce
+@returns: tuple[pd.DataFrame, bool, dict] - coerced df, True if no col needed a cast, {col: failed row positions}
+"""
+def coerce_to_schema(df: pd.DataFrame) -> tuple[pd.DataFrame, bool, dict]:
+
+    conforming = True
+    failures = {}
+    drop_mask = np.zeros(len(df), dtype=bool)
+
+    for col, dtype in TARGET_SCHEMA.items():
+
+        if str(df[col].dtype) == dtype:
+            continue
+
+        conforming = False
+
+        if dtype == "str":
+            df[col] = df[col].astype("str")
+            continue
+
+        coerced, failed = coerce_numeric(df[col], dtype)
+
+        if failed.any():
+            failures[col] = np.flatnonzero(failed).tolist()
+
+        # Rows with an unusable ID are dropped; Prices become NaN
+        if dtype == "int64":
+            drop_mask |= failed
+            coerced = coerced.where(~failed, 0)
+
+        df[col] = coerced.astype(dtype)
+
+    if drop_mask.any():
+        df = df[~drop_mask].reset_index(drop=True)
+
+    # Mixed object cols outside the schema cannot be written by pyarrow
+    for col in df.columns:
+        if col not in TARGET_SCHEMA and df[col].dtype == "object":
+            df[col] = df[col].astype("str")
+
+    return df, conforming, failures
+
+
+"""
+Clean a single bronze parquet into a silver parquet; Safe to run within a worker process.
+A file that cannot be cleaned yields a non_conforming record instead of aborting the run
+
+@param:str parquet - path to bronze parquet
+@param:Path out_path - path of cleaned parquet to write
+@param:str | None schema_class - cached schema class of the parquet; Sniffed when None
+@returns: tuple[bool, list, list, str | None] - success flag, metadata records, metrics records, schema class
+"""
+def clean_parquet(parquet: str, out_path: Path, schema_class: str | None = None) -> tuple[bool, list, list, str | None]:
 
-    ensure_dir(SILVER_ROOT)
-    
-    
     metadata = []
-    
-    
-    
-    # Itterate through each bronze parquet
-    for parquet in sorted_parquet_paths:
 
-        print(f"Analyzing parquet {parquet}")
+    metrics = []
 
-        df = pd.read_parquet(parquet)
-          
-        # ------------------------
-        # Verify necassary cols existence ['ID', 'TimeStamp', '/ES', '/NQ', '/RTY', 'SPY', 'QQQ', 'IWM'] 
-        # ------------------------
+    try:
+        with stage_metrics.measure(metrics, parquet, "silver", "cleaning", "total") as total:
+            print(f"Analyzing parquet {parquet}")
 
-        """
-        Helper func for cleaning cols; Ensures necassary cols in df; Appends to metadata
-        @param:pd.DataFrame df - df to clean
-        @returns: pd.DataFrame - Col cleaned df
-        """
-        def clean_cols_for_existence(df: pd.DataFrame) -> pd.DataFrame:
-        
-     
+            total["bytes_read"] = stage_metrics.file_bytes(parquet)
+
+            # ------------------------
+            # Verify necassary cols existence ['ID', 'TimeStamp', '/ES', '/NQ', '/RTY', 'SPY', 'QQQ', 'IWM']
+            # Schema issues are repaired while reading (See README.md)
+            # ------------------------
+
+            """
+            Helper func for cleaning cols; Reads the parquet with necassary cols ensured; Appends to metadata
+            @returns: pd.DataFrame - Col cleaned df
             """
-            Attempt access of valid cols; Fails if col does not exist
+            def clean_cols_for_existence() -> pd.DataFrame:
+                nonlocal schema_class
+
+                if schema_class is None:
+                    schema_class = sniff_schema_class(parquet)
+
+                df = read_repaired(parquet, schema_class)
+
+                if schema_class == SCHEMA_CONFORMING:
+                    metadata.append(add_metadata.add_clean_metadata_instance(file=parquet,
+                                                                layer= "silver",
+                                                                process= "cleaning",
+                                                                sub_process= "col_existence",
+                                                                status= "conforming",
+                                                                issue= "N/A",
+                                                                action="processed",
+                                                                notes="N/A"))
+
+                #Handles schema issue 1 (See README.md)
+                elif schema_class == SCHEMA_ISSUE_1:
+                    metadata.append(add_metadata.add_clean_metadata_instance(file=parquet,
+                                                                layer= "silver",
+                                                                process= "cleaning",
+                                                                sub_process= "col_existence",
+                                                                status= "non_conforming",
+                                                                issue= "silver_cleaning_col_1",
+                                                                action="adjusted",
+                                                                notes="Incorrect headers"))
+
+                # Handles schema issue 2 (See README.md)
+                else:
+                    metadata.append(add_metadata.add_clean_metadata_instance(file=parquet,
+                                                                layer= "silver",
+                                                                process= "cleaning",
+                                                                sub_process= "col_existence",
+                                                                status= "non_conforming",
+                                                                issue= "silver_cleaning_col_2",
+                                                                action="adjusted",
+                                                                notes=".tsv"))
+
+                # Reverify cols; Error if fails
+                if any(c not in df.columns for c in VALID_COLS):
+                    raise Exception(f"An unknown error has occured on parquet {parquet}")
+
+                return df
+
+
+            with stage_metrics.measure(metrics, parquet, "silver", "cleaning", "col_existence") as counts:
+
+                df = clean_cols_for_existence()
+
+                counts["rows_in"] = counts["rows_out"] = len(df)
+
+            total["rows_in"] = len(df)
+
 
-            @param:pd.DataFrame df - df to verify col exists in
-            @returns: None
+
+            # ------------------
+            # Verify necassary col's types
+            # --------------------
+        
             """
-            def verify_cols(df:pd.DataFrame) -> None:
+            Helper func for cleaning cols; Coerces necassary cols to TARGET_SCHEMA; Appends to metadata
+            @param:pd.DataFrame df - df to clean
+            @returns: pd.DataFrame - Col cleaned df
+            """ 
+            def clean_cols_for_type(df: pd.DataFrame) -> pd.DataFrame:
+
+                df, confoming_flag, failures = coerce_to_schema(df)
+
+                # Reverify cols; Error if fails 
+                for col, dtype in TARGET_SCHEMA.items():
+                    if str(df[col].dtype) != dtype:
+                        raise Exception(f"An error has occured with col typing in parquet {parquet}")
                 
-                    
-                for c in VALID_COLS:
-                    temp = df[c]
-                    
-                return None
-        
-            # Verify Cols exist; Handle otherwise
-            try:
-                verify_cols(df=df)
                 
-                metadata.append(add_metadata.add_clean_metadata_instance(file=parquet,
+                # Add metadata for status
+                if confoming_flag:
+                    metadata.append(add_metadata.add_clean_metadata_instance(file=parquet,
                                                             layer= "silver",
                                                             process= "cleaning",
-                                                            sub_process= "col_existence",
+                                                            sub_process= "col_type",
                                                             status= "conforming",
                                                             issue= "N/A",
                                                             action="processed",
                                                             notes="N/A"))
-            except:
-                
-                #Handles schema issue 1 (See README.md)
-                if len(df.columns) > 1:
-                                                
-                    # Step 1: Save current headers as first row
-                    header_row = pd.DataFrame([df.columns], columns=df.columns)
-
-                    # Step 2: Concatenate
-                    df = pd.concat([header_row, df], ignore_index=True)
-
-                    # Step 3: Let pandas auto-name columns (0, 1, 2, 3...)
-                    df.columns = range(len(df.columns))
-
-                    # Now you have numbered columns and old headers as first row
-                
-                    df.rename(columns={0: 'ID',
-                                    1: 'TimeStamp',
-                                    2: '/ES',
-                                    3: '/NQ', 
-                                    4: '/RTY', 
-                                    5: 'SPY', 
-                                    6: 'QQQ', 
-                                    7: 'IWM'}, inplace=True)
-                    
-                    
+                else:
                     metadata.append(add_metadata.add_clean_metadata_instance(file=parquet,
                                                             layer= "silver",
                                                             process= "cleaning",
-                                                            sub_process= "col_existence",
+                                                            sub_process= "col_type",
                                                             status= "non_conforming",
-                                                            issue= "silver_cleaning_col_1",
+                                                            issue= "silver_cleaning_col_3",
                                                             action="adjusted",
-                                                            notes="Incorrect headers")) 
-                                    
-                    
-                # Handles schema issue 2 (See README.md)
-                else:
-            
-                    # Step 2: Get the problematic column name (the one with \t in it)
-                    col_name = df.columns[0]
+                                                            notes="Convert col types")) 
 
-                    # Step 3: Split the column on tabs
-                    df = df[col_name].str.split('\t', expand=True)
-
-                    # Step 4: Split the header on tabs to get proper column names
-                    proper_headers = col_name.split('\t')
-                    df.columns = proper_headers
-
-                    # Step 5: Save as properly structured parquet
-                    df.to_parquet('fixed_file.parquet', index=False)
-                    
+                # One record per col with values that could not be coerced
+                for col, rows in failures.items():
                     metadata.append(add_metadata.add_clean_metadata_instance(file=parquet,
                                                             layer= "silver",
                                                             process= "cleaning",
-                                                            sub_process= "col_existence",
+                                                            sub_process= "col_type",
                                                             status= "non_conforming",
-                                                            issue= "silver_cleaning_col_2",
-                                                            action="adjusted",
-                                                            notes=".tsv"))
+                                                            issue= "silver_cleaning_col_4",
+                                                            action= "dropped" if col == "ID" else "nulled",
+                                                            notes=f"{len(rows)} rows of {col} not coercible to {TARGET_SCHEMA[col]}; "
+                                                                  f"rows {rows[:FAILED_ROWS_SAMPLE]}"))
             
+                return df
             
-            # Reverify cols; Error if fails   
-            try:
-                verify_cols(df=df)
-            except:
-                raise Exception(f"An unknown error has occured on parquet {parquet}")
-            
-            
-            
-            return df
-            
-                
-        df = clean_cols_for_existence(df)
-        
-        
-        
-        # ------------------
-        # Verify necassary col's types
-        # --------------------
-        
-        """
-        Helper func for cleaning cols; Ensures necassary types in df; Appends to metadata
-        @param:pd.DataFrame df - df to clean
-        @returns: pd.DataFrame - Col cleaned df
-        """ 
-        def clean_cols_for_type(df: pd.DataFrame) -> pd.DataFrame:
+                            
+            with stage_metrics.measure(metrics, parquet, "silver", "cleaning", "col_type") as counts:
+                counts["rows_in"] = len(df)
+
+                df = clean_cols_for_type(df=df)
+
+                counts["rows_out"] = len(df)
+
+            print(f"Coerced col types in {metrics[-1]['wall_s']:.3f}s")
         
-            confoming_flag = True
+            # --------------
+            # Write prquets to folder
+            # --------------
+            print("Adding file")
+    
+            # Replaced, never rewritten in place; Committed snapshots share the old file
+            tmp_path = out_path.with_name(f".{out_path.name}.tmp")
 
-            # Temporary convert all types to string to avoid parquet writing errs
-            for col in df.columns:
-                df[col] = df[col].astype(str)
+            df.to_parquet(tmp_path, engine="pyarrow")
 
+            os.replace(tmp_path, out_path)
 
+            total["rows_out"] = len(df)
+            total["bytes_written"] = stage_metrics.file_bytes(out_path)
 
-            # Verify col types
-            for col in VALID_COLS:
-            
-                col_type = df[col].dtype
-            
-                if col == "ID":
-                    
-                    try:
-                        assert(col_type == "int64")
-                        
-                    except:
-                        confoming_flag = False
-                        
-                        df[col] = df[col].astype("int64")
-                        
-                               
-                elif col == "TimeStamp":
-                    try:
-                        assert(col_type == "object")
-                    except:
-                        confoming_flag = False
+    except Exception as e:
+        print(f"Unexpected error on parquet {parquet}: {e}")
+
+        metadata.append(add_metadata.add_clean_metadata_instance(file=parquet,
+                                                layer= "silver",
+                                                process= "cleaning",
+                                                sub_process= "N/A",
+                                                status= "non_conforming",
+                                                issue= "Unknown",
+                                                action="skipped",
+                                                notes=str(e)))
+
+        return False, metadata, metrics, schema_class
+
+    return True, metadata, metrics, schema_class
+
+
+# -----------------------
+# Main func for cleaing parquets
+# ----------------------
+
+
+"""
+Main func for cleaning - Makes cleaned silver parquet files
+@param: str folder_path - path to bronze parquet files 
+@param: bool overwrite - rebuild every file regardless of the manifest; False by default
+@param: int workers - number of worker processes; 1 runs serially in process
+@returns: None
+"""
+def main(folder_path:str, overwrite: bool = False, workers: int = 1):    
     
-                        df[col] = df[col].astype("object")
+    sorted_parquet_paths = list_files_alphabetically(folder_path=folder_path)
+
+    ensure_dir(SILVER_ROOT)
     
-                else:
-                    try:
-                        assert(col_type == "float64")
-            
-                    except:
-                        confoming_flag = False
-                        
-                        df[col] = df[col].astype("float64")
-                        
+    build_manifest = manifest.load_manifest(SILVER_META)
 
-                # Reverify cols; Error if fails 
-                
-                col_type = df[col].dtype
-            
-                try:
-                    if col == "ID":
-                        assert(col_type == "int64")
+    # Ignore in-progress temp files from the bronze writer
+    sorted_parquet_paths = [parquet for parquet in sorted_parquet_paths if parquet.endswith(".parquet")]
+
+    out_paths = {parquet: SILVER_ROOT / f"{Path(parquet).stem}_cleaning.parquet" for parquet in sorted_parquet_paths}
+
+    to_clean = []
+    fingerprints = {}
+    schema_classes = {}
     
-                    elif col == "TimeStamp":
-                        assert(col_type == "object")
-                            
-                    else:
-                        assert(col_type == "float64")
-                
-                except:
-                    raise Exception(f"An error has occured with col typing in parquet {parquet}")
-                
-                
-            # Add metadata for status
-            if confoming_flag:
-                metadata.append(add_metadata.add_clean_metadata_instance(file=parquet,
-                                                        layer= "silver",
-                                                        process= "cleaning",
-                                                        sub_process= "col_type",
-                                                        status= "conforming",
-                                                        issue= "N/A",
-                                                        action="processed",
-                                                        notes="N/A"))
-            else:
-                metadata.append(add_metadata.add_clean_metadata_instance(file=parquet,
-                                                        layer= "silver",
-                                                        process= "cleaning",
-                                                        sub_process= "col_type",
-                                                        status= "non_conforming",
-                                                        issue= "silver_cleaning_col_3",
-                                                        action="adjusted",
-                                                        notes="Convert col types")) 
-            
-            return df
-            
-                            
-        df = clean_cols_for_type(df=df)
-        
-        # --------------
-        # Write prquets to folder
-        # --------------
-        dataset_name = Path(parquet).stem        
+    for parquet in sorted_parquet_paths:
 
-        dataset_name = dataset_name + "_cleaning"
+        out_path = out_paths[parquet]
+
+        # Skip files whose bronze input and cleaning logic are unchanged
+        stale, fingerprints[parquet] = manifest.needs_rebuild(build_manifest, out_path.name, Path(parquet), out_path, CODE_VERSION)
+
+        if overwrite or stale:
+            to_clean.append(parquet)
+
+            # Header sniff of an unchanged input is reused
+            schema_classes[parquet] = manifest.cached_value(build_manifest, out_path.name, "schema_class", fingerprints[parquet])
+
+
+    # Itterate through each stale bronze parquet; Files are independent so they can fan out
+    with stage_metrics.profile_stage("cleaning", SILVER_META):
+        if workers > 1 and len(to_clean) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(clean_parquet, to_clean, [out_paths[parquet] for parquet in to_clean],
+                                            [schema_classes[parquet] for parquet in to_clean]))
+        else:
+            results = [clean_parquet(parquet, out_paths[parquet], schema_classes[parquet]) for parquet in to_clean]
+
+    cleaned = dict(zip(to_clean, results))
+
+
+    # Merge records in file order so metadata is the same for any worker count
+    metadata = []
+
+    metrics = []
+
+    committed = []
+
+    for parquet in sorted_parquet_paths:
+
+        out_path = out_paths[parquet]
+
+        if parquet not in cleaned:
+            metadata.extend(manifest.stored_records(build_manifest, out_path.name))
+            continue
+
+        ok, records, file_metrics, schema_class = cleaned[parquet]
+
+        metadata.extend(records)
+        metrics.extend(file_metrics)
+
+        # Failed files stay out of the manifest so the next run retries them
+        if ok:
+            manifest.record_build(build_manifest, out_path.name, fingerprints[parquet], out_path, CODE_VERSION, records,
+                                  extra={"schema_class": schema_class})
+            committed.append(out_path)
+
+    # One snapshot for the whole run; Readers of the log see every new file or none
+    table_log.commit(SILVER_ROOT, committed, operation="cleaning")
+    table_log.gc(SILVER_ROOT)
 
-        if not os.path.isfile(f"{SILVER_ROOT}/{dataset_name}.parquet"):
-            print("Adding file")
-        
-            df.to_parquet(f"{SILVER_ROOT}/{dataset_name}.parquet", engine="pyarrow")
-        
-        
-        
-        
 
     # -----------------
     # Write metadata
     # -----------------
 
+    coerce_times = [m["wall_s"] for m in metrics if m["sub_process"] == "col_type"]
+
+    if coerce_times:
+        print(f"Col type coercion: {len(coerce_times)} files in {sum(coerce_times):.2f}s "
+              f"(slowest {max(coerce_times):.3f}s)")
+
+        print("Slowest files:")
+        stage_metrics.print_slowest(metrics)
+
     ensure_dir(SILVER_META)
 
+    manifest.save_manifest(SILVER_META, build_manifest)
+
     with open(SILVER_META / "cleaning_metadata.json", "w") as json_file:
         json.dump(metadata, json_file, indent=4)
+
+    stage_metrics.write_metrics(SILVER_META, "cleaning_metrics.json", metrics)
     
     json_file.close()
     
@@ -340,8 +566,15 @@ def main(folder_path:str):
             
 
 if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Clean bronze parquets into silver")
+    parser.add_argument("--folder-path", default="data/bronze/intraday_prices/", help="Folder of bronze parquets")
+    parser.add_argument("--overwrite", action="store_true", help="Rebuild every parquet, ignoring the manifest")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+
+    args = parser.parse_args()
     
-    main(folder_path="data/bronze/intraday_prices/")
+    main(folder_path=args.folder_path, overwrite=args.overwrite, workers=args.workers)
     
     
     pass
\ No newline at end of file
@@ -0,0 +1,231 @@
+"""
+Minute grain time dimension (trading date, ETH/RTH session, holidays, exchange time) and its integer surrogate key.
+TimeStamps are the wall clock of the source (US Eastern); Futures sessions open at 18:00 ET and belong to the next trading date
+"""
+
+import os
+from pathlib import Path
+from datetime import date, datetime, time, timedelta
+import argparse
+import numpy as np
+import polars as pl
+
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_ROOT = Path(os.getenv("DATA_ROOT", PROJECT_ROOT / "data"))
+DIM_TIME_ROOT = DATA_ROOT / "gold" / "dim_time"
+DIM_TIME_PATH = DIM_TIME_ROOT / "dim_time.parquet"
+
+
+# Range of the Kaggle dataset; time_key 0 is the first minute
+DIM_START = datetime(2020, 1, 26)
+DIM_END = datetime(2026, 2, 6, 23, 59)
+
+SOURCE_TZ = "America/New_York"
+# CME Globex, where the futures trade
+EXCHANGE_TZ = "America/Chicago"
+
+# Regular trading hours of the ETFs (source wall clock)
+RTH_START = time(9, 30)
+RTH_END = time(16, 0)
+HALF_DAY_END = time(13, 0)
+
+# Futures: daily maintenance break from 17:00 and the evening session from 18:00
+ETH_BREAK_START = time(17, 0)
+ETH_START = time(18, 0)
+
+# NYSE full closures
+HOLIDAYS = [
+    date(2020, 1, 1), date(2020, 1, 20), date(2020, 2, 17), date(2020, 4, 10), date(2020, 5, 25),
+    date(2020, 7, 3), date(2020, 9, 7), date(2020, 11, 26), date(2020, 12, 25),
+    date(2021, 1, 1), date(2021, 1, 18), date(2021, 2, 15), date(2021, 4, 2), date(2021, 5, 31),
+    date(2021, 7, 5), date(2021, 9, 6), date(2021, 11, 25), date(2021, 12, 24),
+    date(2022, 1, 17), date(2022, 2, 21), date(2022, 4, 15), date(2022, 5, 30), date(2022, 6, 20),
+    date(2022, 7, 4), date(2022, 9, 5), date(2022, 11, 24), date(2022, 12, 26),
+    date(2023, 1, 2), date(2023, 1, 16), date(2023, 2, 20), date(2023, 4, 7), date(2023, 5, 29),
+    date(2023, 6, 19), date(2023, 7, 4), date(2023, 9, 4), date(2023, 11, 23), date(2023, 12, 25),
+    date(2024, 1, 1), date(2024, 1, 15), date(2024, 2, 19), date(2024, 3, 29), date(2024, 5, 27),
+    date(2024, 6, 19), date(2024, 7, 4), date(2024, 9, 2), date(2024, 11, 28), date(2024, 12, 25),
+    date(2025, 1, 1), date(2025, 1, 9), date(2025, 1, 20), date(2025, 2, 17), date(2025, 4, 18),
+    date(2025, 5, 26), date(2025, 6, 19), date(2025, 7, 4), date(2025, 9, 1), date(2025, 11, 27),
+    date(2025, 12, 25),
+    date(2026, 1, 1), date(2026, 1, 19),
+]
+
+# NYSE early closes (13:00)
+HALF_DAYS = [
+    date(2020, 11, 27), date(2020, 12, 24),
+    date(2021, 11, 26),
+    date(2022, 11, 25),
+    date(2023, 7, 3), date(2023, 11, 24),
+    date(2024, 7, 3), date(2024, 11, 29), date(2024, 12, 24),
+    date(2025, 7, 3), date(2025, 11, 28), date(2025, 12, 24),
+]
+
+SESSIONS = ["RTH", "ETH", "CLOSED"]
+
+# ----------------------------
+# Surrogate key
+# ----------------------------
+
+"""
+Integer surrogate key of a datetime column; Minutes since DIM_START, null outside the dimension.
+Computed arithmetically, so joining silver to dim_time needs no lookup
+
+@param:str col - datetime column
+@returns: pl.Expr - Int32 time_key
+"""
+def time_key(col: str = "TimeStamp") -> pl.Expr:
+    minutes = (pl.col(col).dt.truncate("1m") - pl.lit(DIM_START)).dt.total_minutes()
+
+    return (
+        pl.when((pl.col(col) >= DIM_START) & (pl.col(col) < DIM_END + timedelta(minutes=1)))
+        .then(minutes)
+        .otherwise(None)
+        .cast(pl.Int32)
+        .alias("time_key")
+    )
+
+
+# ----------------------------
+# Dimension
+# ----------------------------
+
+"""
+Next exchange business day on or after each date (skips weekends and full holidays)
+
+@param:pl.Expr day - date expression
+@returns: pl.Expr - business day
+"""
+def roll_to_business_day(day: pl.Expr) -> pl.Expr:
+    return day.dt.add_business_days(0, holidays=HOLIDAYS, roll="forward")
+
+
+"""
+Trading date of a datetime column; Evening sessions from 18:00 and non-business days roll to the next business day
+
+@param:str col - datetime column
+@returns: pl.Expr - Date trading_date
+"""
+def trading_date(col: str = "TimeStamp") -> pl.Expr:
+    day = pl.col(col).dt.date()
+
+    return roll_to_business_day(
+        pl.when(pl.col(col).dt.time() >= ETH_START).then(day + timedelta(days=1)).otherwise(day)
+    ).alias("trading_date")
+
+
+"""
+TimeStamp range of a range of trading dates. Trading dates never decrease with time, so the range is one interval:
+from 18:00 of the business day before start to 18:00 of the last business day up to end
+
+@param:date | None start - first trading date included; None for no lower bound
+@param:date | None end - last trading date included; None for no upper bound
+@returns: tuple[datetime | None, datetime | None] - first TimeStamp included, first TimeStamp excluded
+"""
+def trading_date_bounds(start: date | None, end: date | None) -> tuple[datetime | None, datetime | None]:
+    holidays = [np.datetime64(day) for day in HOLIDAYS]
+
+    lower = upper = None
+
+    if start is not None:
+        previous = np.busday_offset(np.datetime64(start, "D"), -1, roll="forward", holidays=holidays)
+        lower = datetime.combine(previous.astype(date), ETH_START)
+
+    if end is not None:
+        last = np.busday_offset(np.datetime64(end, "D"), 0, roll="backward", holidays=holidays)
+        upper = datetime.combine(last.astype(date), ETH_START)
+
+    return lower, upper
+
+
+"""
+Build the minute grain time dimension
+
+@param:datetime start - first minute
+@param:datetime end - last minute
+@returns: pl.DataFrame - time_key, minute_ts, trading_date, day_of_week, session, is_holiday, is_half_day, exchange_ts
+"""
+def build_dim_time(start: datetime = DIM_START, end: datetime = DIM_END) -> pl.DataFrame:
+
+    minutes = pl.datetime_range(start, end, interval="1m", time_unit="ms", eager=True).alias("minute_ts")
+
+    clock = pl.col("minute_ts").dt.time()
+    day = pl.col("minute_ts").dt.date()
+
+    return (
+        pl.DataFrame(minutes)
+        .with_columns(time_key("minute_ts"))
+        .with_columns(
+            # Evening session trades for the next business day
+            trading_date("minute_ts"),
+            day.is_in(HOLIDAYS).alias("calendar_holiday"),
+            day.is_in(HALF_DAYS).alias("calendar_half_day"),
+            day.dt.weekday().alias("calendar_weekday"),
+        )
+        .with_columns(
+            pl.when(
+                # Weekend: Friday 17:00 until Sunday 18:00, plus the daily break
+                ((pl.col("calendar_weekday") == 5) & (clock >= ETH_BREAK_START))
+                | (pl.col("calendar_weekday") == 6)
+                | ((pl.col("calendar_weekday") == 7) & (clock < ETH_START))
+                | ((clock >= ETH_BREAK_START) & (clock < ETH_START))
+            ).then(pl.lit("CLOSED"))
+            .when(
+                ~pl.col("calendar_holiday")
+                & (clock >= RTH_START)
+                & (clock < pl.when(pl.col("calendar_half_day")).then(pl.lit(HALF_DAY_END)).otherwise(pl.lit(RTH_END)))
+            ).then(pl.lit("RTH"))
+            .otherwise(pl.lit("ETH"))
+            .cast(pl.Enum(SESSIONS))
+            .alias("session"),
+            pl.col("trading_date").dt.weekday().cast(pl.Int8).alias("day_of_week"),
+            # Of the calendar day; A trading date is never a full holiday
+            pl.col("calendar_holiday").alias("is_holiday"),
+            pl.col("calendar_half_day").alias("is_half_day"),
+            # The one DST hour that does not exist in New York is shifted like its neighbours
+            pl.col("minute_ts")
+            .dt.replace_time_zone(SOURCE_TZ, ambiguous="earliest", non_existent="null")
+            .dt.convert_time_zone(EXCHANGE_TZ)
+            .dt.replace_time_zone(None)
+            .fill_null(pl.col("minute_ts") - timedelta(hours=1))
+            .alias("exchange_ts"),
+        )
+        .select("time_key", "minute_ts", "trading_date", "day_of_week", "session", "is_holiday", "is_half_day", "exchange_ts")
+    )
+
+
+# -----------------------
+# Main func for dim_time
+# ----------------------
+
+"""
+Main func for dim_time - Writes the dimension to DIM_TIME_PATH
+@param: Path out_path - parquet path
+@returns: None
+"""
+def main(out_path: Path = DIM_TIME_PATH):
+
+    dim_time = build_dim_time()
+
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = out_path.with_name(f".{out_path.name}.tmp")
+
+    dim_time.write_parquet(tmp_path)
+
+    os.replace(tmp_path, out_path)
+
+    print(f"dim_time: {dim_time.height} minutes written to {out_path}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Build the minute grain dim_time dimension")
+    parser.add_argument("--out", type=Path, default=DIM_TIME_PATH, help="Parquet path")
+
+    args = parser.parse_args()
+
+    main(out_path=args.out)
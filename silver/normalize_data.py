@@ -1,13 +1,10 @@
 
 
 
-import pandas as pd
 import os
 from pathlib import Path
-import pyarrow as pq
 import json
 import polars as pl
-from datetime import datetime
 
 
 import sys
@@ -15,22 +12,37 @@ import sys
 
 root_dir = Path(__file__).resolve().parent.parent
 helper_path = str(root_dir / "helpers")
+silver_path = str(root_dir / "silver")
 
 if helper_path not in sys.path:
     sys.path.append(helper_path)
 
+if silver_path not in sys.path:
+    sys.path.append(silver_path)
+
 
 import add_metadata
+import manifest
+import stage_metrics
+import query_cache
+import table_log
+import normalize_times
+import dim_time
 
 
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
-SILVER_ROOT = PROJECT_ROOT / "data" / "silver" / "normalize"
-SILVER_META = PROJECT_ROOT / "data" / "silver" / "normalize_metadata"
+DATA_ROOT = Path(os.getenv("DATA_ROOT", PROJECT_ROOT / "data"))
+SILVER_ROOT = DATA_ROOT / "silver" / "normalize"
+SILVER_META = DATA_ROOT / "silver" / "normalize_metadata"
 
 
 VALID_COLS = ['ID', 'TimeStamp', '/ES', '/NQ', '/RTY', 'SPY', 'QQQ', 'IWM']
 
+# Version of this stage's logic; Bumps whenever this file or a helper it builds its outputs with changes
+CODE_VERSION = manifest.code_version(__file__, add_metadata.__file__, table_log.__file__, normalize_times.__file__,
+                                     dim_time.__file__)
+
 # ----------------------------
 # Helpers
 # ----------------------------
@@ -68,115 +80,318 @@ def list_files_alphabetically(folder_path: Path, substring:str = "") -> list[Pat
     return sorted(paths)
 
 
-def main(folder_path:str, substring: str = ""):
-        
-    sorted_parquet_paths = list_files_alphabetically(folder_path=folder_path, substring=substring)
+# ----------------------------
+# Lazy normalization plan
+# ----------------------------
 
-    ensure_dir(SILVER_ROOT)
+# Expected polars dtypes of the cleaned cols
+EXPECTED_DTYPES = {
+    "ID": pl.Int64,
+    "TimeStamp": pl.String,
+    "/ES": pl.Float64,
+    "/NQ": pl.Float64,
+    "/RTY": pl.Float64,
+    "SPY": pl.Float64,
+    "QQQ": pl.Float64,
+    "IWM": pl.Float64,
+}
+
+# Rows per row group; Sorted TimeStamps make row group min/max usable for pruning
+ROW_GROUP_SIZE = 100_000
+
+
+"""
+Build the lazy normalization plan for a cleaned parquet; Validates types from the schema alone
+
+@param:str parquet - path to cleaned parquet
+@param:str timestamp_format - TimeStamp format of the file (See normalize_times.TIMESTAMP_FORMATS)
+@returns: pl.LazyFrame - plan projecting VALID_COLS with TimeStamp parsed to a datetime, plus the dim_time key
+"""
+def build_normalize_plan(parquet: str, timestamp_format: str) -> pl.LazyFrame:
 
-    for parquet in sorted_parquet_paths:
-        
-        df = pd.read_parquet(parquet)
-        
-        df = df[VALID_COLS]
-        
-        
-        # --------------
-        # Write parquets to folder w/ only necassary cols
-        # --------------
-        dataset_name = Path(parquet).stem   
-        
-        dataset_name = dataset_name.replace("_cleaning", "_normalized")
-        
-        if not os.path.isfile(f"{SILVER_ROOT}/{dataset_name}.parquet"):
-            print(f"Adding parquet {parquet}")
-        
-            df.to_parquet(f"{SILVER_ROOT}/{dataset_name}.parquet", engine="pyarrow")
-        
-        
-    # ---------------------
-    # Switch to polars for efficiency, now that cols are normalized
-    # ----------------------
-    
     lazy_df = (
-        pl.scan_parquet(SILVER_ROOT)
+        pl.scan_parquet(parquet)
         .select(VALID_COLS)
     )
 
-    df = lazy_df.collect()
+    # -------------
+    # Validate types; Only the parquet footer is read
+    # -------------
 
+    schema = lazy_df.collect_schema()
 
+    for col, dtype in EXPECTED_DTYPES.items():
+        if schema[col] != dtype:
+            raise Exception(f"Error in data types in silver normalization; {col} is {schema[col]} in {parquet}")
 
-    # -------------
-    # Validate types
-    # -------------
+    return (
+        lazy_df
+        .with_columns(normalize_times.parse_timestamp(timestamp_format))
+        .with_columns(dim_time.time_key("TimeStamp"))
+    )
 
-    for i in VALID_COLS:
-        try:
-            if i == "ID":
-                assert(str(df[i].dtype) == "Int64")
-            elif i == "TimeStamp":
-                assert(str(df[i].dtype) == "String")
-            else:
-                assert(str(df[i].dtype) == "Float64")
-        except:
-            raise Exception("Error in data types in silver normalization")
-       
-       
-
-    # -----------
-    # Standardize timestamps
-    # -----------
-
-    # Define the regex patterns for the two 'messy' formats
-    pattern_short = r"^\d{1,2}/\d{1,2}/\d{2} \d{2}:\d{2}$"            # 8/9/20 17:59
-    pattern_medium = r"^\d{1,2}/\d{1,2}/\d{4} \d{2}:\d{2}:\d{2}$"    # 11/22/2022 18:45:39
-
-    df_standardized = df.with_columns(
-        pl.when(pl.col("TimeStamp").str.contains(pattern_short))
-        .then(
-            # Convert 8/9/20 17:59 -> 2020-08-09 17:59:00.000
-            pl.col("TimeStamp").str.to_datetime("%m/%d/%y %H:%M", strict=False)
-        )
-        .when(pl.col("TimeStamp").str.contains(pattern_medium))
-        .then(
-            # Convert 11/22/2022 18:45:39 -> 2022-11-22 18:45:39.000
-            pl.col("TimeStamp").str.to_datetime("%m/%d/%Y %H:%M:%S", strict=False)
-        )
-        .otherwise(
-            # Keep the already 'correct' ones or parse them directly
-            pl.col("TimeStamp").str.to_datetime("%Y-%m-%d %H:%M:%S%.3f", strict=False)
-        )
-        .dt.strftime("%Y-%m-%d %H:%M:%S.000") # Force back to your regex-conformant string
-        .alias("TimeStamp")
+
+"""
+Expressions for the Hive partition keys of a parsed TimeStamp (trading date year/month); An evening session opening
+on the last day of a month belongs to the next month's partition
+
+@returns: list[pl.Expr] - year and month expressions
+"""
+def partition_keys() -> list[pl.Expr]:
+    return [
+        dim_time.trading_date("TimeStamp").dt.year().alias("year"),
+        dim_time.trading_date("TimeStamp").dt.month().alias("month"),
+    ]
+
+
+"""
+Rows of one partition
+
+@param:int year - partition year
+@param:int month - partition month
+@returns: pl.Expr - filter expression
+"""
+def in_partition(year: int, month: int) -> pl.Expr:
+    year_key, month_key = partition_keys()
+
+    return (year_key == year) & (month_key == month)
+
+
+"""
+Single streaming pass over a plan; Row count per partition plus non-conforming TimeStamps
+
+@param:pl.LazyFrame plan - normalization plan
+@returns: tuple[list[tuple[int, int]], int, int] - (year, month) partitions present, count of unparsed TimeStamps, total rows
+"""
+def plan_partitions(plan: pl.LazyFrame) -> tuple[list[tuple[int, int]], int, int]:
+
+    # Failed parses are null; They fall into the null partition
+    counts = (
+        plan
+        .select("TimeStamp")
+        .with_columns(pl.col("TimeStamp").is_null().alias("issue"))
+        .with_columns(partition_keys())
+        .group_by("year", "month")
+        .agg(pl.len().alias("rows"), pl.col("issue").sum().alias("issues"))
+        .collect(engine="streaming")
     )
-            
 
-    # The 'Gold Standard' pattern: YYYY-MM-DD HH:MM:SS.mmm
-    target_regex = r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{3}$"
+    issue_count = int(counts["issues"].sum())
 
-    # Filter for anything that STILL doesn't match
-    remaining_issues = df_standardized.filter(
-        ~pl.col("TimeStamp").str.contains(target_regex)
+    partitions = sorted(
+        (row["year"], row["month"]) for row in counts.iter_rows(named=True) if row["year"] is not None
     )
 
-    print(f"Remaining non-conforming rows: {remaining_issues.height}")
+    return partitions, issue_count, int(counts["rows"].sum())
 
-    if remaining_issues.height > 0:
-        print("Sample of stubborn rows:")
-        print(remaining_issues.select("TimeStamp").unique().head(5))
-        
-        raise Exception("TimeStamp conformity issue")
 
+"""
+Path of a week's file within a Hive partition
+
+@param:int year - partition year
+@param:int month - partition month
+@param:str dataset_name - normalized dataset name of the week
+@returns: Path - year=YYYY/month=MM/<dataset_name>.parquet under SILVER_ROOT
+"""
+def partition_path(year: int, month: int, dataset_name: str) -> Path:
+    return SILVER_ROOT / f"year={year}" / f"month={month:02d}" / f"{dataset_name}.parquet"
+
+
+"""
+Normalize one cleaned parquet into its year/month partition files; Safe to run within a worker process
+
+@param:str parquet - path to cleaned parquet
+@param:str | None timestamp_format - TimeStamp format cached for an unchanged input; Detected when None
+@param:list[str] previous_outputs - partition files of the previous build; Those no longer produced are removed
+@returns: tuple[list, list, list[Path], str] - metadata records, metrics records, partition files written, TimeStamp format used
+"""
+def normalize_file(parquet: str, timestamp_format: str | None = None,
+                   previous_outputs: list[str] | None = None) -> tuple[list, list, list[Path], str]:
+
+    dataset_name = Path(parquet).stem.replace("_cleaning", "_normalized")
+
+    metrics = []
+
+    with stage_metrics.measure(metrics, parquet, "silver", "normalize", "normalize") as counts:
+
+        counts["bytes_read"] = stage_metrics.file_bytes(parquet)
+
+        # -----------
+        # Detect the TimeStamp format once per file; Reused from the manifest while the input is unchanged
+        # -----------
+        if timestamp_format is None:
+            timestamp_format = normalize_times.detect_file_format(parquet)
+
+        # -----------
+        # Validate parsed timestamps and find partitions before writing anything
+        # -----------
+        plan = build_normalize_plan(parquet, timestamp_format)
+
+        try:
+            partitions, issue_count, rows = plan_partitions(plan)
+
+        # Sample missed a second format; Fall back to the per-row path
+        except pl.exceptions.PolarsError:
+            timestamp_format = normalize_times.MIXED_FORMAT
+
+            plan = build_normalize_plan(parquet, timestamp_format)
+
+            partitions, issue_count, rows = plan_partitions(plan)
+
+        if issue_count > 0:
+            print(f"Remaining non-conforming rows in {parquet}: {issue_count}")
+            print("Sample of stubborn rows:")
+            print(
+                pl.scan_parquet(parquet)
+                .select("TimeStamp")
+                .filter(normalize_times.parse_timestamp(normalize_times.MIXED_FORMAT).is_null())
+                .unique()
+                .head(5)
+                .collect()
+            )
+
+        # --------------
+        # Write one TimeStamp-sorted file per year/month partition w/ only necassary cols
+        # Unparsed TimeStamps fall in no partition, so they are dropped; Reported below instead of aborting the run
+        # --------------
+        print(f"Adding parquet {parquet} to {len(partitions)} partition(s); TimeStamp format {timestamp_format}")
+
+        out_paths = []
+
+        for year, month in partitions:
+            out_path = partition_path(year, month, dataset_name)
+            tmp_path = out_path.with_name(f".{out_path.name}.tmp")
+
+            ensure_dir(out_path.parent)
+
+            (
+                plan
+                .filter(in_partition(year, month))
+                .sort("TimeStamp")
+                .sink_parquet(tmp_path, row_group_size=ROW_GROUP_SIZE)
+            )
+
+            os.replace(tmp_path, out_path)
+
+            out_paths.append(out_path)
+
+        counts["rows_in"] = rows
+        counts["rows_out"] = rows - issue_count
+        counts["bytes_written"] = stage_metrics.file_bytes(out_paths)
+
+        # Drop partition files of a previous build that this build no longer produces
+        for stale_path in previous_outputs or []:
+            if Path(stale_path) not in out_paths:
+                Path(stale_path).unlink(missing_ok=True)
+
+    records = [add_metadata.add_clean_metadata_instance(file=parquet,
+                                            layer= "silver",
+                                            process= "normalize",
+                                            sub_process= "normalize",
+                                            status= "conforming",
+                                            issue= "N/A",
+                                            action="processed",
+                                            notes=f"TimeStamp format {timestamp_format}")]
+
+    if issue_count > 0:
+        records = [add_metadata.add_clean_metadata_instance(file=parquet,
+                                                layer= "silver",
+                                                process= "normalize",
+                                                sub_process= "normalize",
+                                                status= "non_conforming",
+                                                issue= "silver_normalize_timestamp_1",
+                                                action="dropped",
+                                                notes=f"{issue_count} rows w/ unparsed TimeStamp; TimeStamp format {timestamp_format}")]
+
+    return records, metrics, out_paths, timestamp_format
+
+
+"""
+Main func for normalization - Makes a year/month Hive partitioned silver dataset and validates it.
+Each week file is one lazy plan sunk to parquet, so the dataset is never materialized in memory
+@param: str folder_path - path to cleaned silver parquet files
+@param: str substring - optional substring that file path must abide by
+@param: bool overwrite - rebuild every file regardless of the manifest; False by default
+@returns: None
+"""
+def main(folder_path:str, substring: str = "", overwrite: bool = False):
         
-    
-        
-        
-    
+    sorted_parquet_paths = list_files_alphabetically(folder_path=folder_path, substring=substring)
+
+    ensure_dir(SILVER_ROOT)
 
+    build_manifest = manifest.load_manifest(SILVER_META)
+
+    metadata = []
+
+    metrics = []
+
+    added = []
+    removed = []
+
+    try:
+        with stage_metrics.profile_stage("normalize", SILVER_META):
+            for parquet in sorted_parquet_paths:
+
+                if not parquet.endswith(".parquet"):
+                    continue
+            
+                dataset_name = Path(parquet).stem   
+            
+                dataset_name = dataset_name.replace("_cleaning", "_normalized")
+
+                key = f"{dataset_name}.parquet"
+
+                # Skip files whose cleaned input and normalization logic are unchanged
+                stale, input_fingerprint = manifest.needs_rebuild(build_manifest, key, Path(parquet), None, CODE_VERSION)
+
+                if not (overwrite or stale):
+                    metadata.extend(manifest.stored_records(build_manifest, key))
+                    continue
+
+                previous_outputs = manifest.stored_outputs(build_manifest, key)
+
+                records, file_metrics, out_paths, timestamp_format = normalize_file(
+                    parquet,
+                    manifest.cached_value(build_manifest, key, "timestamp_format", input_fingerprint),
+                    previous_outputs,
+                )
+
+                # Cached query results over the rewritten or removed partitions
+                query_cache.invalidate([*out_paths, *previous_outputs])
+
+                metadata.extend(records)
+                metrics.extend(file_metrics)
+
+                manifest.record_build(build_manifest, key, input_fingerprint, out_paths, CODE_VERSION, records,
+                                      extra={"timestamp_format": timestamp_format})
+
+                added.extend(out_paths)
+                removed.extend(Path(path) for path in previous_outputs if Path(path) not in out_paths)
+
+    # Keep progress of files already normalized, even when a later file aborts the run
+    finally:
+        # One snapshot for the files normalized so far
+        table_log.commit(SILVER_ROOT, added, removed, operation="normalize")
+        table_log.gc(SILVER_ROOT)
+
+        manifest.save_manifest(SILVER_META, build_manifest)
+
+    print(f"Files w/ non-conforming TimeStamps: {sum(m['status'] == 'non_conforming' for m in metadata)}")
+
+    # -----------------
+    # Write metadata
+    # -----------------
+
+    with open(SILVER_META / "normalize_metadata.json", "w") as json_file:
+        json.dump(metadata, json_file, indent=4)
+
+    stage_metrics.write_metrics(SILVER_META, "normalize_metrics.json", metrics)
+
+    if metrics:
+        print("Slowest files:")
+        stage_metrics.print_slowest(metrics, sub_process="normalize")
 
-       
 
-    
 if __name__ == "__main__":
     main(folder_path="data/silver/cleaning")
\ No newline at end of file
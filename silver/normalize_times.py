@@ -0,0 +1,95 @@
+"""
+Timestamp normalization for silver; Detects the TimeStamp format of a file once and parses it with a single strict parse
+"""
+
+from pathlib import Path
+import polars as pl
+
+
+# Known TimeStamp formats of the Kaggle files; Regex used for detection, strptime format used for parsing
+TIMESTAMP_FORMATS = {
+    "short": (r"^\d{1,2}/\d{1,2}/\d{2} \d{2}:\d{2}$", "%m/%d/%y %H:%M"),                # 8/9/20 17:59
+    "medium": (r"^\d{1,2}/\d{1,2}/\d{4} \d{2}:\d{2}:\d{2}$", "%m/%d/%Y %H:%M:%S"),      # 11/22/2022 18:45:39
+    "iso": (r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{3}$", "%Y-%m-%d %H:%M:%S%.3f"),  # 2022-11-22 18:45:39.000
+}
+
+# Format name used when a file mixes formats; Parsed with the slow per-row path
+MIXED_FORMAT = "mixed"
+
+# Rows sampled from the head and tail of a file to detect its format
+SAMPLE_SIZE = 1_000
+
+TIME_UNIT = "ms"
+
+
+"""
+Detect the single format shared by a sample of TimeStamps
+
+@param:pl.Series sample - TimeStamp strings
+@returns: str - key of TIMESTAMP_FORMATS, or MIXED_FORMAT if no single format matches every value
+"""
+def detect_format(sample: pl.Series) -> str:
+
+    sample = sample.drop_nulls()
+
+    if sample.len() == 0:
+        return MIXED_FORMAT
+
+    for name, (pattern, _) in TIMESTAMP_FORMATS.items():
+        if sample.str.contains(pattern).all():
+            return name
+
+    return MIXED_FORMAT
+
+
+"""
+Sample TimeStamps from the head and tail of a parquet; Reads only the TimeStamp col of the edge row groups
+
+@param:str | Path parquet - path to parquet
+@returns: pl.Series - sampled TimeStamp strings
+"""
+def sample_timestamps(parquet) -> pl.Series:
+
+    lazy_df = pl.scan_parquet(parquet).select("TimeStamp")
+
+    return pl.concat([
+        lazy_df.head(SAMPLE_SIZE).collect(),
+        lazy_df.tail(SAMPLE_SIZE).collect(),
+    ]).to_series()
+
+
+"""
+Detect the TimeStamp format of a parquet
+
+@param:str | Path parquet - path to parquet
+@returns: str - key of TIMESTAMP_FORMATS or MIXED_FORMAT
+"""
+def detect_file_format(parquet) -> str:
+    return detect_format(sample_timestamps(parquet))
+
+
+"""
+Expression parsing TimeStamp strings into a datetime col
+
+@param:str fmt - key of TIMESTAMP_FORMATS for a single strict parse, or MIXED_FORMAT for the per-row path
+@returns: pl.Expr - datetime TimeStamp expression
+"""
+def parse_timestamp(fmt: str) -> pl.Expr:
+
+    col = pl.col("TimeStamp")
+
+    if fmt != MIXED_FORMAT:
+        return col.str.to_datetime(TIMESTAMP_FORMATS[fmt][1], strict=True, time_unit=TIME_UNIT).alias("TimeStamp")
+
+    # Slow path; Every row is tested against each format. Unparseable values become null
+    expr = pl.when(col.str.contains(TIMESTAMP_FORMATS["short"][0])).then(
+        col.str.to_datetime(TIMESTAMP_FORMATS["short"][1], strict=False, time_unit=TIME_UNIT)
+    )
+
+    expr = expr.when(col.str.contains(TIMESTAMP_FORMATS["medium"][0])).then(
+        col.str.to_datetime(TIMESTAMP_FORMATS["medium"][1], strict=False, time_unit=TIME_UNIT)
+    )
+
+    return expr.otherwise(
+        col.str.to_datetime(TIMESTAMP_FORMATS["iso"][1], strict=False, time_unit=TIME_UNIT)
+    ).alias("TimeStamp")
@@ -0,0 +1,292 @@
+"""
+Data quality checks for the normalized silver dataset; Declarative checks evaluated as one vectorized aggregation per run
+"""
+
+import os
+from pathlib import Path
+from datetime import timedelta
+import argparse
+import json
+import polars as pl
+
+
+import sys
+
+
+root_dir = Path(__file__).resolve().parent.parent
+helper_path = str(root_dir / "helpers")
+
+if helper_path not in sys.path:
+    sys.path.append(helper_path)
+
+
+import add_metadata
+import manifest
+import stage_metrics
+
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_ROOT = Path(os.getenv("DATA_ROOT", PROJECT_ROOT / "data"))
+SILVER_NORMALIZE = DATA_ROOT / "silver" / "normalize"
+QUALITY_ROOT = DATA_ROOT / "silver" / "quality_checks"
+QUALITY_META = DATA_ROOT / "silver" / "quality_checks_metadata"
+
+
+VALID_COLS = ['ID', 'TimeStamp', '/ES', '/NQ', '/RTY', 'SPY', 'QQQ', 'IWM']
+SYMBOLS = ['/ES', '/NQ', '/RTY', 'SPY', 'QQQ', 'IWM']
+
+# Log return further than this many standard deviations from the file mean is a jump
+JUMP_SIGMA = 8
+
+# Largest gap between consecutive rows within one day
+MAX_SESSION_GAP = timedelta(minutes=15)
+
+# Version of this stage's logic; Bumps whenever this file or a helper it builds its outputs with changes
+CODE_VERSION = manifest.code_version(__file__, add_metadata.__file__)
+
+# ----------------------------
+# Check definitions
+# ----------------------------
+
+"""
+Log returns of a price column in TimeStamp order
+
+@param:str col - price column
+@returns: pl.Expr - log returns
+"""
+def log_returns(col: str) -> pl.Expr:
+    prices = pl.col(col).sort_by("TimeStamp")
+
+    return (prices / prices.shift(1)).log()
+
+
+"""
+Rows with a price jump beyond JUMP_SIGMA standard deviations
+
+@param:str col - price column
+@returns: pl.Expr - failing row count
+"""
+def price_jumps(col: str) -> pl.Expr:
+    returns = log_returns(col)
+
+    return ((returns - returns.mean()).abs() > JUMP_SIGMA * returns.std()).sum()
+
+
+"""
+Gaps above MAX_SESSION_GAP between consecutive rows of the same day
+
+@param:str col - TimeStamp column
+@returns: pl.Expr - failing row count
+"""
+def session_gaps(col: str) -> pl.Expr:
+    timestamps = pl.col(col).sort()
+
+    same_day = timestamps.dt.date() == timestamps.dt.date().shift(1)
+
+    return ((timestamps.diff() > MAX_SESSION_GAP) & same_day).sum()
+
+
+# Check name -> (severity, columns, failing row count expression of a column, threshold shown in the results)
+CHECKS = {
+    "nulls": ("error", VALID_COLS, lambda col: pl.col(col).is_null().sum(), "0"),
+    "non_positive_price": ("error", SYMBOLS, lambda col: (pl.col(col) <= 0).sum(), "price > 0"),
+    # Rows are sorted by TimeStamp in silver; Order is checked against the source row ID
+    "out_of_order_timestamp": ("error", ["TimeStamp"],
+                               lambda col: (pl.col(col).sort_by("ID").diff() < timedelta(0)).sum(), "non decreasing by ID"),
+    # Minute grain source formats repeat TimeStamps legitimately
+    "duplicate_timestamp": ("warn", ["TimeStamp"], lambda col: pl.col(col).is_duplicated().sum(), "unique"),
+    "duplicate_id": ("error", ["ID"], lambda col: pl.col(col).is_duplicated().sum(), "unique"),
+    "price_jump": ("warn", SYMBOLS, price_jumps, f"|return - mean| <= {JUMP_SIGMA} sigma"),
+    "session_gap": ("warn", ["TimeStamp"], session_gaps, f"gap <= {MAX_SESSION_GAP}"),
+}
+
+# Separates check and column in expression names
+NAME_SEP = "|"
+
+# ----------------------------
+# Helpers
+# ----------------------------
+
+"""
+Ensure directory of root is estavlished correctly
+
+@param: Path path - Path of directory
+@returns: None
+"""
+def ensure_dir(path: Path) -> None:
+    path.mkdir(parents=True, exist_ok=True)
+
+
+"""
+Aggregation expressions of every check; One failing row count per check and column
+
+@returns: list[pl.Expr] - expressions named <check>|<column>
+"""
+def check_expressions() -> list[pl.Expr]:
+    return [
+        build(col).cast(pl.Int64).alias(f"{check}{NAME_SEP}{col}")
+        for check, (_, cols, build, _) in CHECKS.items()
+        for col in cols
+    ]
+
+
+"""
+Run every check over several silver files in one query; Files are the groups
+
+@param:list[Path] files - silver partition files
+@returns: pl.DataFrame - file, check, column, severity, threshold, failed_rows, total_rows, passed
+"""
+def run_checks(files: list[Path]) -> pl.DataFrame:
+
+    wide = (
+        pl.scan_parquet(files, include_file_paths="file")
+        .select(["file", *VALID_COLS])
+        .group_by("file")
+        .agg(pl.len().cast(pl.Int64).alias("total_rows"), *check_expressions())
+        .collect()
+    )
+
+    severity = {check: spec[0] for check, spec in CHECKS.items()}
+    threshold = {check: spec[3] for check, spec in CHECKS.items()}
+
+    return (
+        wide
+        .unpivot(index=["file", "total_rows"], variable_name="name", value_name="failed_rows")
+        .with_columns(pl.col("name").str.split_exact(NAME_SEP, 1).struct.rename_fields(["check", "column"]))
+        .unnest("name")
+        .with_columns(
+            pl.col("check").replace_strict(severity).alias("severity"),
+            pl.col("check").replace_strict(threshold).alias("threshold"),
+            (pl.col("failed_rows") == 0).alias("passed"),
+        )
+        .select("file", "check", "column", "severity", "threshold", "failed_rows", "total_rows", "passed")
+        .sort("file", "check", "column")
+    )
+
+
+# -----------------------
+# Main func for quality_checks
+# ----------------------
+
+"""
+Main func for quality_checks - Checks every new or changed silver file and writes the per file/per check results table.
+Failed checks are reported, never raised, so one bad file does not stop the others
+@param: Path folder_path - root of the partitioned silver dataset
+@param: bool overwrite - recheck every file regardless of the manifest; False by default
+@returns: pl.DataFrame - results of every file
+"""
+def main(folder_path: Path = SILVER_NORMALIZE, overwrite: bool = False) -> pl.DataFrame:
+
+    folder_path = Path(folder_path)
+
+    silver_files = sorted(folder_path.glob("year=*/month=*/*.parquet"))
+
+    build_manifest = manifest.load_manifest(QUALITY_META)
+
+    results_path = QUALITY_ROOT / "quality_checks.parquet"
+
+    to_check = []
+    fingerprints = {}
+
+    for parquet in silver_files:
+        key = str(parquet.relative_to(folder_path))
+
+        stale, fingerprints[key] = manifest.needs_rebuild(build_manifest, key, parquet, results_path, CODE_VERSION)
+
+        if overwrite or stale:
+            to_check.append(parquet)
+
+    metrics = []
+
+    with stage_metrics.profile_stage("quality_checks", QUALITY_META):
+        with stage_metrics.measure(metrics, folder_path, "silver", "quality_checks", "checks") as counts:
+
+            counts["bytes_read"] = stage_metrics.file_bytes(to_check)
+
+            checked = run_checks(to_check) if to_check else None
+
+            counts["rows_in"] = int(checked.unique("file")["total_rows"].sum()) if checked is not None else 0
+
+    # -----------------
+    # Merge with the stored results of unchanged files
+    # -----------------
+
+    results = []
+    metadata = []
+
+    for parquet in silver_files:
+        key = str(parquet.relative_to(folder_path))
+
+        if checked is not None and parquet in to_check:
+            rows = checked.filter(pl.col("file") == str(parquet)).to_dicts()
+
+            failed = [f"{row['check']}({row['column']}): {row['failed_rows']}" for row in rows if not row["passed"]]
+            errors = any(row["severity"] == "error" for row in rows if not row["passed"])
+
+            records = [add_metadata.add_clean_metadata_instance(file=str(parquet),
+                                                    layer= "silver",
+                                                    process= "quality_checks",
+                                                    sub_process= "checks",
+                                                    status= "non_conforming" if errors else "conforming",
+                                                    issue= "; ".join(failed) if failed else "N/A",
+                                                    action="checked",
+                                                    notes=f"{len(rows)} checks")]
+
+            manifest.record_build(build_manifest, key, fingerprints[key], results_path, CODE_VERSION, records,
+                                  extra={"results": rows})
+        else:
+            rows = build_manifest["entries"][key]["results"]
+            records = manifest.stored_records(build_manifest, key)
+
+        results.extend(rows)
+        metadata.extend(records)
+
+    # Entries of files that no longer exist
+    current = {str(parquet.relative_to(folder_path)) for parquet in silver_files}
+
+    for key in list(build_manifest["entries"]):
+        if key not in current:
+            del build_manifest["entries"][key]
+
+    table = pl.DataFrame(results, schema={"file": pl.String, "check": pl.String, "column": pl.String,
+                                          "severity": pl.String, "threshold": pl.String, "failed_rows": pl.Int64,
+                                          "total_rows": pl.Int64, "passed": pl.Boolean})
+
+    # -----------------
+    # Write results
+    # -----------------
+
+    ensure_dir(QUALITY_ROOT)
+
+    tmp_path = results_path.with_name(f".{results_path.name}.tmp")
+
+    table.write_parquet(tmp_path)
+
+    os.replace(tmp_path, results_path)
+
+    manifest.save_manifest(QUALITY_META, build_manifest)
+
+    with open(QUALITY_META / "quality_checks_metadata.json", "w") as json_file:
+        json.dump(metadata, json_file, indent=4)
+
+    stage_metrics.write_metrics(QUALITY_META, "quality_checks_metrics.json", metrics)
+
+    failing = table.filter(~pl.col("passed"))
+
+    print(f"Quality checks: {len(to_check)} of {len(silver_files)} files checked, "
+          f"{failing.filter(pl.col('severity') == 'error').height} error and "
+          f"{failing.filter(pl.col('severity') == 'warn').height} warning results")
+
+    return table
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run data quality checks over the normalized silver dataset")
+    parser.add_argument("--overwrite", action="store_true", help="Recheck every file, ignoring the manifest")
+
+    args = parser.parse_args()
+
+    with pl.Config(tbl_rows=50):
+        print(main(overwrite=args.overwrite).filter(~pl.col("passed")))
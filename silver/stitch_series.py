@@ -0,0 +1,465 @@
+"""
+Stitch the weekly silver files into one continuous, deduplicated series per instrument.
+Each week is already sorted by TimeStamp, so the weeks are k-way merged batch by batch in bounded memory
+"""
+
+import os
+from pathlib import Path
+from datetime import timedelta
+import argparse
+import json
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+import sys
+
+
+root_dir = Path(__file__).resolve().parent.parent
+helper_path = str(root_dir / "helpers")
+
+if helper_path not in sys.path:
+    sys.path.append(helper_path)
+
+
+import add_metadata
+import manifest
+import stage_metrics
+
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_ROOT = Path(os.getenv("DATA_ROOT", PROJECT_ROOT / "data"))
+SILVER_NORMALIZE = DATA_ROOT / "silver" / "normalize"
+STITCHED_ROOT = DATA_ROOT / "silver" / "stitched"
+STITCHED_META = DATA_ROOT / "silver" / "stitched_metadata"
+
+
+VALID_COLS = ['ID', 'TimeStamp', '/ES', '/NQ', '/RTY', 'SPY', 'QQQ', 'IWM']
+SYMBOLS = ['/ES', '/NQ', '/RTY', 'SPY', 'QQQ', 'IWM']
+
+# Rows read from a week per step; Memory is bounded by about this many rows per week in flight
+BATCH_ROWS = 65_536
+
+# Boundary gaps above this are flagged; A weekend close is about 49 hours
+MAX_BOUNDARY_GAP = timedelta(days=3)
+
+# Schema of every stitched instrument file
+SERIES_SCHEMA = pa.schema([
+    ("TimeStamp", pa.timestamp("ms")),
+    ("price", pa.float64()),
+    ("source", pa.string()),
+    ("source_id", pa.int64()),
+])
+
+# Version of this stage's logic; Bumps whenever this file or a helper it builds its outputs with changes
+CODE_VERSION = manifest.code_version(__file__, add_metadata.__file__)
+
+# ----------------------------
+# Helpers
+# ----------------------------
+
+"""
+Ensure directory of root is estavlished correctly
+
+@param: Path path - Path of directory
+@returns: None
+"""
+def ensure_dir(path: Path) -> None:
+    path.mkdir(parents=True, exist_ok=True)
+
+
+"""
+Stitched file of an instrument
+
+@param:str symbol - instrument col (e.g. /ES)
+@param:Path out_root - root of the stitched series
+@returns: Path - parquet path
+"""
+def series_path(symbol: str, out_root: Path = STITCHED_ROOT) -> Path:
+    return Path(out_root) / f"{symbol.lstrip('/')}_stitched.parquet"
+
+
+"""
+Group the silver partition files by the Kaggle week they came from; A week split over two months has two files
+
+@param:Path folder_path - root of the partitioned silver dataset
+@returns: dict[str, list[Path]] - week name -> partition files in TimeStamp order, weeks oldest first
+"""
+def week_sources(folder_path: Path = SILVER_NORMALIZE) -> dict[str, list[Path]]:
+    weeks = {}
+
+    for parquet in sorted(Path(folder_path).glob("year=*/month=*/*.parquet")):
+        weeks.setdefault(parquet.stem.replace("_normalized", ""), []).append(parquet)
+
+    # Week names end in the week ending date (YYYY MM DD), so they sort chronologically
+    return dict(sorted(weeks.items()))
+
+
+"""
+Stream the rows of one week in record batches
+
+@param:int rank - position of the week; Lower ranks win duplicates
+@param:list[Path] paths - partition files of the week in TimeStamp order
+@param:int batch_rows - rows per batch
+@returns: Iterator[pl.DataFrame] - batches with a source col
+"""
+def source_batches(rank: int, paths: list[Path], batch_rows: int = BATCH_ROWS):
+    for path in paths:
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows, columns=VALID_COLS):
+            yield pl.from_arrow(pa.Table.from_batches([batch])).with_columns(pl.lit(rank, pl.Int32).alias("source"))
+
+
+"""
+Resolve duplicates of a merged chunk. A TimeStamp present in several weeks keeps the rows of the oldest week only;
+Repeats within one week are kept, minute grain formats repeat TimeStamps legitimately
+
+@param:pl.DataFrame chunk - rows of every week up to the merge frontier
+@returns: tuple[pl.DataFrame, pl.DataFrame] - kept rows in (TimeStamp, source, ID) order, per source dropped and conflicting row counts
+"""
+def dedupe(chunk: pl.DataFrame) -> tuple[pl.DataFrame, pl.DataFrame]:
+
+    chunk = chunk.sort("TimeStamp", "source", "ID").with_columns(
+        (pl.col("source") == pl.col("source").min().over("TimeStamp")).alias("kept")
+    )
+
+    # A dropped row conflicts when its prices differ from the first kept row of its TimeStamp
+    kept_prices = [pl.col(col).filter(pl.col("kept")).first().over("TimeStamp") for col in SYMBOLS]
+
+    conflict = pl.any_horizontal([pl.col(col).ne_missing(kept) for col, kept in zip(SYMBOLS, kept_prices)])
+
+    dropped = (
+        chunk
+        .with_columns(conflict.alias("conflict"))
+        .filter(~pl.col("kept"))
+        .group_by("source")
+        .agg(pl.len().alias("duplicates_dropped"), pl.col("conflict").sum().alias("conflicts"))
+    )
+
+    return chunk.filter(pl.col("kept")).drop("kept"), dropped
+
+
+"""
+K-way merge of sorted weeks on TimeStamp. The frontier is the smallest last TimeStamp buffered among open weeks;
+Every row below it is final, so it is deduplicated and emitted, and only the week at the frontier reads its next batch.
+A week is opened once the frontier reaches its first TimeStamp, so only overlapping weeks are held in memory
+
+@param:list[list[Path]] sources - partition files of each week, oldest week first
+@param:list first_ts - first TimeStamp of each week
+@param:int batch_rows - rows per batch
+@returns: Iterator[tuple[pl.DataFrame, pl.DataFrame]] - (kept rows, dropped counts) chunks in TimeStamp order
+"""
+def merge_sources(sources: list[list[Path]], first_ts: list, batch_rows: int = BATCH_ROWS):
+
+    pending = sorted(range(len(sources)), key=lambda rank: first_ts[rank])
+    streams = {}
+    buffers = {}
+
+    """
+    Append the next non empty batch of a week to its buffer; The week is closed when it runs out
+    @param:int rank - week
+    @returns: None
+    """
+    def pull(rank: int) -> None:
+        for batch in streams[rank]:
+            if batch.height:
+                buffers[rank] = pl.concat([buffers[rank], batch]) if rank in buffers else batch
+                return
+
+        del streams[rank]
+
+    """
+    Open the next pending week
+    @returns: None
+    """
+    def open_next() -> None:
+        rank = pending.pop(0)
+        streams[rank] = source_batches(rank, sources[rank], batch_rows)
+        pull(rank)
+
+    while streams or pending:
+        if not streams:
+            open_next()
+            continue
+
+        frontier_rank = min(streams, key=lambda rank: buffers[rank]["TimeStamp"][-1])
+        frontier = buffers[frontier_rank]["TimeStamp"][-1]
+
+        # A week starting at or before the frontier may hold rows below it
+        if pending and first_ts[pending[0]] <= frontier:
+            open_next()
+            continue
+
+        ready = []
+
+        for rank, buffer in list(buffers.items()):
+            split = buffer["TimeStamp"].search_sorted(frontier, side="left")
+
+            if split:
+                ready.append(buffer.slice(0, split))
+                buffers[rank] = buffer.slice(split)
+
+            # Closed weeks with nothing left are done
+            if rank not in streams and not buffers[rank].height:
+                del buffers[rank]
+
+        if ready:
+            yield dedupe(pl.concat(ready))
+
+        pull(frontier_rank)
+
+    # Every week is read; What is left is final
+    rest = [buffer for buffer in buffers.values() if buffer.height]
+
+    if rest:
+        yield dedupe(pl.concat(rest))
+
+
+"""
+Time range and row count of every week, plus the rows past each neighbour's bound; One lazy scan of the TimeStamp col
+
+@param:dict[str, list[Path]] weeks - week name -> partition files, oldest week first
+@returns: pl.DataFrame - source, first_ts, last_ts, rows, overlap_rows_next, overlap_rows_prev
+"""
+def week_spans(weeks: dict[str, list[Path]]) -> pl.DataFrame:
+
+    ranked = pl.concat([
+        pl.scan_parquet(paths).select("TimeStamp").with_columns(pl.lit(rank, pl.Int32).alias("source"))
+        for rank, paths in enumerate(weeks.values())
+    ])
+
+    spans = ranked.group_by("source").agg(
+        pl.col("TimeStamp").min().alias("first_ts"),
+        pl.col("TimeStamp").max().alias("last_ts"),
+        pl.len().alias("rows"),
+    )
+
+    # Neighbour bounds of each week: Rows before the previous week's end or after the next week's start overlap
+    bounds = spans.sort("source").select(
+        "source",
+        pl.col("last_ts").shift(1).alias("prev_last_ts"),
+        pl.col("first_ts").shift(-1).alias("next_first_ts"),
+    )
+
+    overlap = (
+        ranked.join(bounds, on="source")
+        .group_by("source")
+        .agg(
+            (pl.col("TimeStamp") <= pl.col("prev_last_ts")).sum().alias("overlap_rows_next"),
+            (pl.col("TimeStamp") >= pl.col("next_first_ts")).sum().alias("overlap_rows_prev"),
+        )
+    )
+
+    return spans.join(overlap, on="source").sort("source").collect()
+
+
+"""
+Report of every boundary between consecutive weeks: Gap or overlap and the rows on each side of it
+
+@param:pl.DataFrame spans - week_spans of the weeks
+@param:list[str] names - week names by rank
+@returns: pl.DataFrame - one row per boundary, keyed by the later week's rank (source)
+"""
+def boundary_report(spans: pl.DataFrame, names: list[str]) -> pl.DataFrame:
+
+    prev = spans.select(
+        (pl.col("source") + 1).alias("source"),
+        pl.col("source").alias("prev_source"),
+        pl.col("last_ts").alias("prev_last_ts"),
+        "overlap_rows_prev",
+    )
+
+    return (
+        spans.select("source", "first_ts", "overlap_rows_next")
+        .join(prev, on="source")
+        .with_columns(
+            pl.col("prev_source").replace_strict(dict(enumerate(names))).alias("prev_week"),
+            pl.col("source").replace_strict(dict(enumerate(names))).alias("next_week"),
+            pl.when(pl.col("first_ts") > pl.col("prev_last_ts"))
+            .then(pl.col("first_ts") - pl.col("prev_last_ts"))
+            .otherwise(timedelta(0))
+            .alias("gap"),
+            pl.when(pl.col("first_ts") <= pl.col("prev_last_ts"))
+            .then(pl.col("prev_last_ts") - pl.col("first_ts"))
+            .otherwise(None)
+            .alias("overlap"),
+        )
+        .select("source", "prev_week", "next_week", "prev_last_ts", pl.col("first_ts").alias("next_first_ts"),
+                "gap", "overlap", "overlap_rows_prev", "overlap_rows_next")
+        .sort("source")
+    )
+
+
+# -----------------------
+# Main func for stitch_series
+# ----------------------
+
+"""
+Main func for stitch_series - Merges every silver week into one monotonic series per instrument and reports every week boundary.
+Rebuilds when any week changed, was added or removed; Otherwise nothing is read
+@param: Path folder_path - root of the partitioned silver dataset
+@param: bool overwrite - rebuild regardless of the manifest; False by default
+@param: int batch_rows - rows read from a week per step
+@returns: pl.DataFrame | None - boundary report; None if nothing changed
+"""
+def main(folder_path: Path = SILVER_NORMALIZE, overwrite: bool = False, batch_rows: int = BATCH_ROWS):
+
+    folder_path = Path(folder_path)
+
+    weeks = week_sources(folder_path)
+
+    if not weeks:
+        print(f"No silver files in {folder_path}")
+        return None
+
+    build_manifest = manifest.load_manifest(STITCHED_META)
+
+    out_paths = [series_path(symbol) for symbol in SYMBOLS]
+
+    keys = {}
+    stale = overwrite
+
+    for paths in weeks.values():
+        for parquet in paths:
+            key = str(parquet.relative_to(folder_path))
+
+            file_stale, keys[key] = manifest.needs_rebuild(build_manifest, key, parquet, out_paths, CODE_VERSION)
+
+            stale = stale or file_stale
+
+    # Removed weeks change the series as much as new ones
+    stale = stale or set(build_manifest["entries"]) != set(keys)
+
+    if not stale:
+        print("Stitched series up to date")
+        return None
+
+    ensure_dir(STITCHED_ROOT)
+
+    metrics = []
+
+    with stage_metrics.profile_stage("stitch_series", STITCHED_META):
+        with stage_metrics.measure(metrics, folder_path, "silver", "stitch_series", "merge") as counts:
+
+            counts["bytes_read"] = stage_metrics.file_bytes([parquet for paths in weeks.values() for parquet in paths])
+
+            names = dict(enumerate(weeks))
+
+            spans = week_spans(weeks)
+
+            tmp_paths = [path.with_name(f".{path.name}.tmp") for path in out_paths]
+            writers = [pq.ParquetWriter(tmp_path, SERIES_SCHEMA) for tmp_path in tmp_paths]
+
+            dropped = []
+            rows_in = 0
+            rows_out = 0
+
+            try:
+                for kept, chunk_dropped in merge_sources(list(weeks.values()), spans["first_ts"].to_list(), batch_rows):
+
+                    rows_in += kept.height + int(chunk_dropped["duplicates_dropped"].sum())
+                    dropped.append(chunk_dropped)
+
+                    kept = kept.with_columns(pl.col("source").replace_strict(names, return_dtype=pl.String))
+
+                    for symbol, writer in zip(SYMBOLS, writers):
+                        series = (
+                            kept
+                            .select("TimeStamp", pl.col(symbol).alias("price"), "source", pl.col("ID").alias("source_id"))
+                            .filter(pl.col("price").is_not_null() & pl.col("price").is_not_nan())
+                        )
+
+                        rows_out += series.height
+
+                        writer.write_table(series.to_arrow().cast(SERIES_SCHEMA))
+            finally:
+                for writer in writers:
+                    writer.close()
+
+            for tmp_path, out_path in zip(tmp_paths, out_paths):
+                os.replace(tmp_path, out_path)
+
+            counts["rows_in"] = rows_in
+            counts["rows_out"] = rows_out
+            counts["bytes_written"] = stage_metrics.file_bytes(out_paths)
+
+        # -----------------
+        # Boundary report
+        # -----------------
+
+        merge_counts = (
+            pl.concat(dropped).group_by("source").agg(pl.col("duplicates_dropped").sum(), pl.col("conflicts").sum())
+            if dropped else pl.DataFrame(schema={"source": pl.Int32, "duplicates_dropped": pl.UInt32, "conflicts": pl.UInt32})
+        )
+
+        report = (
+            boundary_report(spans, list(weeks))
+            .join(merge_counts, on="source", how="left")
+            .with_columns(pl.col("duplicates_dropped", "conflicts").fill_null(0).cast(pl.Int64))
+            .drop("source")
+        ) if len(weeks) > 1 else None
+
+    # -----------------
+    # Write metadata
+    # -----------------
+
+    metadata = []
+
+    for row in report.to_dicts() if report is not None else []:
+        issues = []
+
+        if row["overlap"] is not None:
+            issues.append(f"overlap {row['overlap']} ({row['overlap_rows_prev']} + {row['overlap_rows_next']} rows)")
+        if row["duplicates_dropped"]:
+            issues.append(f"{row['duplicates_dropped']} duplicate rows dropped, {row['conflicts']} with different prices")
+        if row["gap"] > MAX_BOUNDARY_GAP:
+            issues.append(f"gap {row['gap']}")
+
+        metadata.append(add_metadata.add_clean_metadata_instance(file=f"{row['prev_week']} | {row['next_week']}",
+                                                    layer= "silver",
+                                                    process= "stitch_series",
+                                                    sub_process= "boundary",
+                                                    status= "non_conforming" if issues else "conforming",
+                                                    issue= "; ".join(issues) if issues else "N/A",
+                                                    action="merged",
+                                                    notes=f"gap {row['gap']}"))
+
+    build_manifest["entries"] = {}
+
+    for paths in weeks.values():
+        for parquet in paths:
+            key = str(parquet.relative_to(folder_path))
+            manifest.record_build(build_manifest, key, keys[key], out_paths, CODE_VERSION, [])
+
+    ensure_dir(STITCHED_META)
+
+    if report is not None:
+        report.write_parquet(STITCHED_META / "boundary_report.parquet")
+
+    manifest.save_manifest(STITCHED_META, build_manifest)
+
+    with open(STITCHED_META / "stitch_metadata.json", "w") as json_file:
+        json.dump(metadata, json_file, indent=4)
+
+    stage_metrics.write_metrics(STITCHED_META, "stitch_metrics.json", metrics)
+
+    print(f"Stitched {len(weeks)} weeks into {len(out_paths)} series: {counts['rows_in']} rows in, "
+          f"{sum(m['status'] == 'non_conforming' for m in metadata)} boundaries with overlaps, duplicates or gaps")
+
+    return report
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Stitch the weekly silver files into one deduplicated series per instrument")
+    parser.add_argument("--overwrite", action="store_true", help="Rebuild regardless of the manifest")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS, help="Rows read from a week per step")
+
+    args = parser.parse_args()
+
+    report = main(overwrite=args.overwrite, batch_rows=args.batch_rows)
+
+    if report is not None:
+        with pl.Config(tbl_rows=50):
+            print(report.filter((pl.col("duplicates_dropped") > 0) | pl.col("overlap").is_not_null()))
@@ -1,7 +1,19 @@
-
 # main.py
-print("Application starting...")
+from pathlib import Path
+import sys
+
+
+root_dir = Path(__file__).resolve().parent.parent
+orchestration_path = str(root_dir / "orchestration")
+
+if orchestration_path not in sys.path:
+    sys.path.append(orchestration_path)
+
+
+import run_pipeline
+
 
 if __name__ == "__main__":
-    # Your app logic here
-    print("Hello from Docker!")
\ No newline at end of file
+    print("Application starting...")
+
+    run_pipeline.main()
@@ -0,0 +1,15 @@
+"""
+Puts the stage folders on sys.path so tests import stage modules the way the stages import helpers
+"""
+
+from pathlib import Path
+import sys
+
+
+root_dir = Path(__file__).resolve().parent.parent
+
+for folder in ["helpers", "silver", "gold"]:
+    folder_path = str(root_dir / folder)
+
+    if folder_path not in sys.path:
+        sys.path.append(folder_path)
@@ -0,0 +1,99 @@
+"""
+Numeric coercion of bronze cols (silver/clean_data.py) over synthetic frames
+"""
+
+import numpy as np
+import pandas as pd
+
+import clean_data
+
+
+"""
+Build a bronze-like frame with every necassary col as text
+
+@param:list ids - ID values
+@param:list prices - /ES values; Other prices are valid
+@returns: pd.DataFrame - frame to coerce
+"""
+def bronze_frame(ids: list, prices: list) -> pd.DataFrame:
+    return pd.DataFrame({
+        "ID": pd.Series(ids, dtype="object"),
+        "TimeStamp": [f"2020-01-27 09:3{i}" for i in range(len(ids))],
+        "/ES": pd.Series(prices, dtype="object"),
+        **{symbol: ["1.5"] * len(ids) for symbol in ["/NQ", "/RTY", "SPY", "QQQ", "IWM"]},
+    })
+
+
+"""
+Price cols: unparsable values fail and become NaN, nulls stay NaN without failing
+"""
+def test_coerce_float_marks_unparsable_only():
+    coerced, failed = clean_data.coerce_numeric(pd.Series(["1.5", "2", "abc", None, 3], dtype="object"), "float64")
+
+    assert failed.tolist() == [False, False, True, False, False]
+    assert coerced.dtype == "float64"
+    assert coerced.iloc[[0, 1, 4]].tolist() == [1.5, 2.0, 3.0]
+    assert coerced.iloc[[2, 3]].isna().all()
+
+
+"""
+ID col: unparsable, null and fractional values all fail
+"""
+def test_coerce_int_fails_nulls_and_fractions():
+    _, failed = clean_data.coerce_numeric(pd.Series(["1", "2.5", "abc", None, "4.0"], dtype="object"), "int64")
+
+    assert failed.tolist() == [False, True, True, True, False]
+
+
+"""
+A row with an unusable ID is dropped; An unusable price keeps its row as NaN; Failures are reported by position
+"""
+def test_coerce_to_schema_drops_bad_ids_and_keeps_bad_prices():
+    df = bronze_frame(["1", "x", "3", "4"], ["10.5", "11", "oops", "12"])
+
+    coerced, conforming, failures = clean_data.coerce_to_schema(df)
+
+    assert not conforming
+    assert failures == {"ID": [1], "/ES": [2]}
+
+    assert coerced["ID"].tolist() == [1, 3, 4]
+    assert str(coerced["ID"].dtype) == "int64"
+    assert str(coerced["/ES"].dtype) == "float64"
+    assert coerced["/ES"].iloc[0] == 10.5 and np.isnan(coerced["/ES"].iloc[1]) and coerced["/ES"].iloc[2] == 12
+
+
+"""
+A frame already in TARGET_SCHEMA is conforming and untouched
+"""
+def test_coerce_to_schema_conforming_frame():
+    df = bronze_frame([1, 2], [10.5, 11.0]).astype({"ID": "int64", "/ES": "float64",
+                                                      **{symbol: "float64" for symbol in ["/NQ", "/RTY", "SPY", "QQQ", "IWM"]}})
+    df["TimeStamp"] = df["TimeStamp"].astype("str")
+
+    coerced, conforming, failures = clean_data.coerce_to_schema(df.copy())
+
+    assert conforming
+    assert failures == {}
+    pd.testing.assert_frame_equal(coerced, df)
+
+
+"""
+Schema issue 1: a misplaced header that does not fit its col's type is reported by col typing instead of becoming a
+silent null; A header that fits is kept as the first row
+"""
+def test_schema_issue_1_header_failure_is_reported():
+    header = ["7", "2020-01-27 09:30", "n/a", "10.5", "1.5", "2.5", "3.5", "4.5"]
+
+    table = clean_data.pa.table({name: clean_data.pa.array(values) for name, values in zip(header, [
+        [8, 9], ["2020-01-27 09:31", "2020-01-27 09:32"], [11.0, 12.0], [11.0, 12.0],
+        [1.5, 1.5], [1.5, 1.5], [1.5, 1.5], [1.5, 1.5],
+    ])})
+
+    df, conforming, failures = clean_data.coerce_to_schema(clean_data.repair_schema_issue_1(table).to_pandas())
+
+    assert not conforming
+    assert failures == {"/ES": [0]}
+
+    assert df["ID"].tolist() == [7, 8, 9]
+    assert np.isnan(df["/ES"].iloc[0]) and df["/ES"].iloc[1:].tolist() == [11.0, 12.0]
+    assert df["/NQ"].tolist() == [10.5, 11.0, 12.0]
@@ -0,0 +1,35 @@
+"""
+Build manifest entries (helpers/manifest.py) stored relative to DATA_ROOT
+"""
+
+import manifest
+
+
+"""
+Outputs are stored relative to DATA_ROOT and resolve under the current one, so a moved data folder stays up to date
+"""
+def test_outputs_follow_data_root(tmp_path, monkeypatch):
+    old_root, new_root = tmp_path / "old", tmp_path / "new"
+
+    for root in [old_root, new_root]:
+        (root / "silver").mkdir(parents=True)
+        (root / "silver" / "in.parquet").write_bytes(b"in")
+        (root / "silver" / "out.parquet").write_bytes(b"out")
+
+    monkeypatch.setattr(manifest, "DATA_ROOT", old_root)
+
+    build_manifest = {"version": manifest.MANIFEST_VERSION, "entries": {}}
+
+    fp = manifest.fingerprint(old_root / "silver" / "in.parquet")
+    manifest.record_build(build_manifest, "out.parquet", fp, old_root / "silver" / "out.parquet", "v1", [])
+
+    assert build_manifest["entries"]["out.parquet"]["output"] == "silver/out.parquet"
+
+    monkeypatch.setattr(manifest, "DATA_ROOT", new_root)
+
+    assert manifest.stored_outputs(build_manifest, "out.parquet") == [str(new_root / "silver" / "out.parquet")]
+
+    stale, _ = manifest.needs_rebuild(build_manifest, "out.parquet", new_root / "silver" / "in.parquet",
+                                      new_root / "silver" / "out.parquet", "v1")
+
+    assert not stale
@@ -0,0 +1,159 @@
+"""
+Mergeable sufficient statistics of the correlation mart (gold/mart_correlations.py) over synthetic returns
+"""
+
+from datetime import datetime, timedelta
+from functools import reduce
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+import mart_correlations
+
+
+"""
+Random walk prices of every symbol
+
+@param:int rows - minutes
+@param:int seed - random seed
+@returns: np.ndarray - (rows, symbols) prices
+"""
+def random_prices(rows: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+
+    return 100 * np.exp(np.cumsum(rng.normal(0, 0.001, (rows, len(mart_correlations.SYMBOLS))), axis=0))
+
+
+"""
+Write one synthetic normalized silver file of random walk prices
+
+@param:Path path - parquet to write
+@param:datetime start - first TimeStamp
+@param:int rows - minutes
+@param:int seed - random seed
+@param:np.ndarray | None prices - prices to write instead of a random walk
+@returns: Path - written parquet
+"""
+def write_silver(path: Path, start: datetime, rows: int, seed: int, prices: np.ndarray | None = None) -> Path:
+    prices = random_prices(rows, seed) if prices is None else prices
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    pl.DataFrame({
+        "TimeStamp": [start + timedelta(minutes=minute) for minute in range(rows)],
+        **{symbol: prices[:, i] for i, symbol in enumerate(mart_correlations.SYMBOLS)},
+    }, schema_overrides={"TimeStamp": pl.Datetime("ms")}).write_parquet(path)
+
+    return path
+
+
+"""
+Write the session stats of a silver file under a stats root
+
+@param:Path parquet - silver file
+@param:Path root - stats root
+@param:str name - stats file name
+@param:list[Path] | None older - overlapping files of older weeks
+@returns: None
+"""
+def write_stats(parquet: Path, root: Path, name: str, older: list[Path] | None = None) -> None:
+    out_path = root / "year=2020" / "month=01" / name
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    mart_correlations.session_stats(parquet, older).write_parquet(out_path)
+
+
+"""
+Merging block statistics in any split and order gives numpy.cov of the concatenated rows
+"""
+def test_merged_covariance_matches_numpy():
+    rng = np.random.default_rng(7)
+
+    x = rng.multivariate_normal(np.arange(6), np.eye(6) + 0.5, size=1000)
+
+    for splits in [[500], [1, 2, 3, 997], [100, 350, 351, 900, 999]]:
+        blocks = [mart_correlations.block_stats(block) for block in np.split(x, splits)]
+
+        for ordered in [blocks, blocks[::-1]]:
+            n, mean, comoment = reduce(mart_correlations.merge_stats, ordered)
+
+            assert n == len(x)
+            assert np.allclose(mean, x.mean(axis=0))
+            assert np.allclose(comoment / (n - 1), np.cov(x, rowvar=False))
+
+
+"""
+Empty blocks are neutral in a merge
+"""
+def test_merge_with_empty_block():
+    x = np.random.default_rng(1).normal(size=(50, 6))
+
+    stats = mart_correlations.block_stats(x)
+    empty = mart_correlations.block_stats(x[:0])
+
+    for merged in [mart_correlations.merge_stats(stats, empty), mart_correlations.merge_stats(empty, stats)]:
+        assert merged[0] == 50
+        assert np.allclose(merged[2], stats[2])
+
+
+"""
+Session stats of a file match numpy.cov of the session's within-session log returns
+"""
+def test_session_stats_match_numpy(tmp_path):
+    parquet = write_silver(tmp_path / "week.parquet", datetime(2020, 1, 27, 9, 30), 300, 3)
+    stats_root = tmp_path / "stats"
+
+    write_stats(parquet, stats_root, "week_stats.parquet")
+
+    (session_date, (n, _, comoment)), = mart_correlations.read_session_stats(root=stats_root)
+
+    prices = pl.read_parquet(parquet).select(mart_correlations.SYMBOLS).to_numpy()
+    returns = np.diff(np.log(prices), axis=0)
+
+    assert session_date == datetime(2020, 1, 27).date()
+    assert n == len(returns)
+    assert np.allclose(comoment / (n - 1), np.cov(returns, rowvar=False))
+
+
+"""
+Evening rows from 18:00 belong to the next trading date's session
+"""
+def test_sessions_are_trading_dates(tmp_path):
+    parquet = write_silver(tmp_path / "week.parquet", datetime(2020, 1, 27, 17, 0), 120, 5)
+
+    stats = mart_correlations.session_stats(parquet)
+
+    # 17:00-17:59 (60 rows, 59 returns) and 18:00-18:59 (60 rows, 59 returns)
+    assert stats["session_date"].to_list() == [datetime(2020, 1, 27).date(), datetime(2020, 1, 28).date()]
+    assert stats["n"].to_list() == [59, 59]
+
+
+"""
+Weeks overlapping by a few minutes count every row once: the merged stats equal numpy.cov of the deduplicated series,
+the newer week keeping its rows past the overlap
+"""
+def test_overlapping_weeks_count_rows_once(tmp_path):
+    start = datetime(2020, 1, 27, 9, 30)
+    prices = random_prices(500, 3)
+
+    # Week 1 holds minutes 0-299, week 2 minutes 280-499
+    week_1 = write_silver(tmp_path / "silver" / "week_1.parquet", start, 300, 0, prices[:300])
+    week_2 = write_silver(tmp_path / "silver" / "week_2.parquet", start + timedelta(minutes=280), 220, 0, prices[280:])
+
+    ranges = {path: mart_correlations.time_range(path) for path in [week_1, week_2]}
+
+    assert mart_correlations.older_overlaps(week_1, ranges) == []
+    assert mart_correlations.older_overlaps(week_2, ranges) == [week_1]
+
+    stats_root = tmp_path / "stats"
+    write_stats(week_1, stats_root, "week_1_stats.parquet")
+    write_stats(week_2, stats_root, "week_2_stats.parquet", [week_1])
+
+    (_, (n, _, comoment)), = mart_correlations.read_session_stats(root=stats_root)
+
+    returns = np.diff(np.log(prices), axis=0)
+
+    assert n == len(returns)
+    assert np.allclose(comoment / (n - 1), np.cov(returns, rowvar=False))
+
@@ -0,0 +1,28 @@
+"""
+Normalization of cleaned week files (silver/normalize_data.py) with unparsable TimeStamps
+"""
+
+import polars as pl
+
+import normalize_data
+
+
+"""
+A file with unparsable TimeStamps writes its parsed rows and is reported non_conforming instead of raising
+"""
+def test_unparsed_timestamps_are_reported(tmp_path, monkeypatch):
+    monkeypatch.setattr(normalize_data, "SILVER_ROOT", tmp_path / "normalize")
+
+    parquet = tmp_path / "week_cleaning.parquet"
+
+    pl.DataFrame({
+        "ID": [1, 2, 3],
+        "TimeStamp": ["2020-01-27 09:30:00", None, "2020-01-27 09:32:00"],
+        **{symbol: [1.0, 2.0, 3.0] for symbol in ["/ES", "/NQ", "/RTY", "SPY", "QQQ", "IWM"]},
+    }).write_parquet(parquet)
+
+    records, metrics, out_paths, _ = normalize_data.normalize_file(str(parquet))
+
+    assert [(record["status"], record["issue"]) for record in records] == [("non_conforming", "silver_normalize_timestamp_1")]
+    assert (metrics[0]["rows_in"], metrics[0]["rows_out"]) == (3, 2)
+    assert pl.read_parquet(out_paths)["ID"].to_list() == [1, 3]
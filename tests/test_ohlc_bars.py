@@ -0,0 +1,79 @@
+"""
+OHLC bars (gold/ohlc_bars.py) of synthetic week files whose bars span two files and the 18:00 session roll
+"""
+
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import polars as pl
+
+import ohlc_bars
+
+
+"""
+Write one synthetic normalized week with one price per minute, the same for every symbol
+
+@param:Path path - parquet to write
+@param:datetime start - first TimeStamp
+@param:list[float] prices - price of each minute
+@returns: Path - written parquet
+"""
+def write_silver(path: Path, start: datetime, prices: list[float]) -> Path:
+    pl.DataFrame({
+        "TimeStamp": [start + timedelta(minutes=minute) for minute in range(len(prices))],
+        "time_key": list(range(len(prices))),
+        **{symbol: prices for symbol in ohlc_bars.fact_prices.SYMBOLS},
+    }, schema_overrides={"TimeStamp": pl.Datetime("ms"), "time_key": pl.Int32}).write_parquet(path)
+
+    return path
+
+
+"""
+Partial bars of every resolution of a silver file, written like main does
+
+@param:Path parquet - silver file
+@param:Path root - partial bar root
+@returns: dict[str, Path] - resolution -> partial bar file
+"""
+def write_partials(parquet: Path, root: Path) -> dict[str, Path]:
+    paths = {}
+
+    for resolution, plan in ohlc_bars.build_bar_plans(parquet).items():
+        paths[resolution] = root / resolution / parquet.name.replace("_normalized", "_bars")
+        paths[resolution].parent.mkdir(parents=True, exist_ok=True)
+
+        plan.collect().write_parquet(paths[resolution])
+
+    return paths
+
+
+"""
+An hour split over two week files merges into one bar: first open, max high, min low, last close, summed ticks
+"""
+def test_bar_spanning_two_files_is_merged(tmp_path):
+    week_1 = write_silver(tmp_path / "week_1_normalized.parquet", datetime(2020, 1, 27, 10, 0), [10.0, 12.0, 9.0])
+    week_2 = write_silver(tmp_path / "week_2_normalized.parquet", datetime(2020, 1, 27, 10, 30), [11.0, 15.0, 13.0])
+
+    partials = [write_partials(week, tmp_path / "partial") for week in [week_1, week_2]]
+
+    bars = ohlc_bars.merge_partials([paths["1h"] for paths in partials]).filter(pl.col("symbol") == "/ES")
+
+    assert bars.height == 1
+    assert bars.row(0, named=True) == {"symbol": "/ES", "bar_start": datetime(2020, 1, 27, 10, 0), "open": 10.0,
+                                       "high": 15.0, "low": 9.0, "close": 13.0, "ticks": 6}
+
+
+"""
+Daily bars are trading dates: rows from 18:00 open the next business day's bar
+"""
+def test_daily_bars_follow_trading_date(tmp_path):
+    # Monday 17:58 - 18:01, then Friday 18:00 rolls over the weekend to Monday
+    monday = write_silver(tmp_path / "monday_normalized.parquet", datetime(2020, 1, 27, 17, 58), [1.0, 2.0, 3.0, 4.0])
+    friday = write_silver(tmp_path / "friday_normalized.parquet", datetime(2020, 1, 31, 18, 0), [5.0, 6.0])
+
+    bars = ohlc_bars.merge_partials([write_partials(week, tmp_path / "partial")["1d"] for week in [monday, friday]])
+
+    es = bars.filter(pl.col("symbol") == "/ES").select("bar_start", "open", "close", "ticks").rows()
+
+    assert es == [(datetime(2020, 1, 27), 1.0, 2.0, 2), (datetime(2020, 1, 28), 3.0, 4.0, 2),
+                  (datetime(2020, 2, 3), 5.0, 6.0, 2)]
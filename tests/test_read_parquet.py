@@ -0,0 +1,36 @@
+"""
+Partition listing of datasets (helpers/read_parquet.py) with files outside the Hive layout
+"""
+
+import polars as pl
+
+import read_parquet
+import table_log
+
+
+"""
+Only year=*/month=*/*.parquet files are listed, globbed or from a logged snapshot; Unpartitioned and deeper files are
+skipped instead of raising
+"""
+def test_list_partitions_skips_files_outside_layout(tmp_path):
+    paths = []
+
+    for relative in ["year=2020/month=01/a.parquet", "year=2020/month=02/b.parquet", "loose.parquet",
+                     "year=2020/month=01/extra/c.parquet", "year=2020/d.parquet"]:
+        path = tmp_path / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        pl.DataFrame({"value": [1]}).write_parquet(path)
+
+        paths.append(path)
+
+    expected = [(2020, 1, ["year=2020/month=01/a.parquet"]), (2020, 2, ["year=2020/month=02/b.parquet"])]
+
+    assert [(year, month, [path.relative_to(tmp_path).as_posix() for path in files])
+            for year, month, files in read_parquet.list_partitions(tmp_path, compacted=False)] == expected
+
+    table_log.commit(tmp_path, paths)
+
+    # Snapshot files live under _data/<commit>/; Only their logical paths are matched
+    assert [(year, month, len(files)) for year, month, files
+            in read_parquet.list_partitions(tmp_path, compacted=False)] == [(2020, 1, 1), (2020, 2, 1)]
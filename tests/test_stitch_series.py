@@ -0,0 +1,109 @@
+"""
+K-way merge of overlapping weeks (silver/stitch_series.py) over small synthetic week files
+"""
+
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import polars as pl
+
+import stitch_series
+
+
+START = datetime(2020, 1, 27, 9, 30)
+
+
+"""
+Write one synthetic normalized week; Prices encode the week so the kept source of a row is visible
+
+@param:Path path - parquet to write
+@param:list[int] minutes - TimeStamp offsets from START in minutes, sorted
+@param:int week - week number, used in IDs and prices
+@returns: Path - written parquet
+"""
+def write_week(path: Path, minutes: list[int], week: int) -> Path:
+    pl.DataFrame({
+        "ID": [week * 1000 + i for i in range(len(minutes))],
+        "TimeStamp": [START + timedelta(minutes=minute) for minute in minutes],
+        **{symbol: [float(week)] * len(minutes) for symbol in stitch_series.SYMBOLS},
+    }, schema_overrides={"TimeStamp": pl.Datetime("ms")}).write_parquet(path)
+
+    return path
+
+
+"""
+Run the merge and collect its chunks
+
+@param:list[list[Path]] sources - partition files of each week, oldest week first
+@param:int batch_rows - rows per batch
+@returns: tuple[pl.DataFrame, pl.DataFrame] - kept rows, dropped counts per source
+"""
+def merge(sources: list[list[Path]], batch_rows: int) -> tuple[pl.DataFrame, pl.DataFrame]:
+    first_ts = [pl.read_parquet(paths[0], columns=["TimeStamp"])["TimeStamp"][0] for paths in sources]
+
+    chunks = list(stitch_series.merge_sources(sources, first_ts, batch_rows))
+
+    kept = pl.concat([chunk for chunk, _ in chunks])
+    dropped = pl.concat([counts for _, counts in chunks]).group_by("source").agg(pl.col("duplicates_dropped").sum())
+
+    return kept, dropped
+
+
+"""
+Output is in TimeStamp order, every TimeStamp shared by two weeks keeps the older week's row, whatever the batch size
+"""
+def test_merge_is_sorted_and_keeps_oldest_week(tmp_path):
+    sources = [
+        [write_week(tmp_path / "w0.parquet", [0, 1, 2, 3, 4, 5], 0)],
+        # Overlaps minutes 4 and 5 of week 0
+        [write_week(tmp_path / "w1.parquet", [4, 5, 6, 7, 8], 1)],
+        # Overlaps minutes 7 and 8 of week 1
+        [write_week(tmp_path / "w2.parquet", [7, 8, 9, 10], 2)],
+    ]
+
+    for batch_rows in [1, 2, 3, 100]:
+        kept, dropped = merge(sources, batch_rows)
+
+        minutes = [int((ts - START).total_seconds() // 60) for ts in kept["TimeStamp"]]
+
+        assert minutes == list(range(11))
+        assert kept["source"].to_list() == [0] * 6 + [1] * 3 + [2] * 2
+        assert kept["/ES"].to_list() == [float(source) for source in kept["source"]]
+
+        assert dict(dropped.sort("source").iter_rows()) == {1: 2, 2: 2}
+
+
+"""
+Repeated TimeStamps within one week are kept; Only cross week duplicates are dropped
+"""
+def test_merge_keeps_repeats_within_a_week(tmp_path):
+    sources = [
+        [write_week(tmp_path / "w0.parquet", [0, 1, 1, 2], 0)],
+        [write_week(tmp_path / "w1.parquet", [1, 2, 3, 3], 1)],
+    ]
+
+    kept, dropped = merge(sources, 2)
+
+    minutes = [int((ts - START).total_seconds() // 60) for ts in kept["TimeStamp"]]
+
+    assert minutes == [0, 1, 1, 2, 3, 3]
+    assert kept["source"].to_list() == [0, 0, 0, 0, 1, 1]
+    assert kept["ID"].is_unique().all()
+    assert dict(dropped.iter_rows()) == {1: 2}
+
+
+"""
+A week split over two partition files is merged as one sorted source
+"""
+def test_merge_reads_weeks_split_over_partitions(tmp_path):
+    sources = [
+        [write_week(tmp_path / "w0_a.parquet", [0, 1], 0), write_week(tmp_path / "w0_b.parquet", [2, 3], 0)],
+        [write_week(tmp_path / "w1.parquet", [3, 4], 1)],
+    ]
+
+    kept, _ = merge(sources, 1)
+
+    minutes = [int((ts - START).total_seconds() // 60) for ts in kept["TimeStamp"]]
+
+    assert minutes == [0, 1, 2, 3, 4]
+    assert kept["source"].to_list() == [0, 0, 0, 0, 1]
@@ -0,0 +1,113 @@
+"""
+Snapshot isolation of versioned tables (helpers/table_log.py) across commits and gc
+"""
+
+from pathlib import Path
+import os
+
+import polars as pl
+
+import table_log
+
+
+"""
+Write a live file of a table the way stages do (temp file then os.replace)
+
+@param:Path root - table folder
+@param:str name - file path relative to the table
+@param:int value - value of the single row
+@returns: Path - live file
+"""
+def write_live(root: Path, name: str, value: int) -> Path:
+    path = root / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = path.with_name(f".{path.name}.tmp")
+
+    pl.DataFrame({"value": [value]}).write_parquet(tmp_path)
+
+    os.replace(tmp_path, path)
+
+    return path
+
+
+"""
+Values of every file of a snapshot
+
+@param:dict files - logical path -> physical Path
+@returns: dict - logical path -> value
+"""
+def read_values(files: dict) -> dict:
+    return {name: pl.read_parquet(path)["value"][0] for name, path in files.items()}
+
+
+"""
+A pinned snapshot keeps reading its own files after a later commit rewrites, adds and removes files, and after gc
+"""
+def test_pinned_snapshot_survives_commit_and_gc(tmp_path):
+    root = tmp_path / "normalize"
+
+    first = table_log.commit(root, [write_live(root, "year=2020/month=01/a.parquet", 1),
+                                    write_live(root, "year=2020/month=01/b.parquet", 2)])
+
+    with table_log.pinned(root) as snap:
+        assert snap["version"] == first
+
+        files = table_log.snapshot_files(root, first)
+
+        # Rewrite a, remove b, add c
+        second = table_log.commit(root, [write_live(root, "year=2020/month=01/a.parquet", 10),
+                                         write_live(root, "year=2020/month=02/c.parquet", 30)],
+                                  [root / "year=2020/month=01/b.parquet"])
+        (root / "year=2020/month=01/b.parquet").unlink()
+
+        assert second > first
+
+        table_log.gc(root, retain_versions=1, retain_hours=0)
+
+        assert read_values(files) == {"year=2020/month=01/a.parquet": 1, "year=2020/month=01/b.parquet": 2}
+        assert read_values(table_log.snapshot_files(root, first)) == read_values(files)
+
+    assert read_values(table_log.snapshot_files(root)) == {"year=2020/month=01/a.parquet": 10,
+                                                           "year=2020/month=02/c.parquet": 30}
+
+    # Released, so the first snapshot's files are collected
+    removed = table_log.gc(root, retain_versions=1, retain_hours=0)
+
+    assert removed["files"] == 2
+    assert not any(path.exists() for path in files.values())
+    assert read_values(table_log.snapshot_files(root)) == {"year=2020/month=01/a.parquet": 10,
+                                                           "year=2020/month=02/c.parquet": 30}
+
+
+"""
+Snapshot files map back to their live paths, so caches keyed on them survive a rebuild
+"""
+def test_snapshot_files_map_to_live_paths(tmp_path):
+    root = tmp_path / "normalize"
+
+    live = write_live(root, "year=2020/month=01/a.parquet", 1)
+
+    table_log.commit(root, [live])
+    first = table_log.snapshot_files(root)
+
+    table_log.commit(root, [write_live(root, "year=2020/month=01/a.parquet", 2)])
+    second = table_log.snapshot_files(root)
+
+    assert first["year=2020/month=01/a.parquet"] != second["year=2020/month=01/a.parquet"]
+    assert {table_log.live_path(root, path) for path in [*first.values(), *second.values()]} == {live.resolve()}
+
+
+"""
+The first commit to a table records the files it already held as their own version
+"""
+def test_first_commit_records_existing_files(tmp_path):
+    root = tmp_path / "cleaning"
+
+    write_live(root, "old.parquet", 1)
+
+    version = table_log.commit(root, [write_live(root, "new.parquet", 2)])
+
+    assert [entry["operation"] for entry in table_log.history(root)] == ["init", "write"]
+    assert set(table_log.snapshot_files(root, version - 1)) == {"old.parquet"}
+    assert read_values(table_log.snapshot_files(root, version)) == {"old.parquet": 1, "new.parquet": 2}
@@ -0,0 +1,11 @@
+-- Calendar and trading session attributes at minute grain
+CREATE TABLE IF NOT EXISTS dim_time (
+    time_key        INTEGER   PRIMARY KEY,
+    minute_ts       TIMESTAMP NOT NULL,
+    trading_date    DATE      NOT NULL,
+    day_of_week     TINYINT   NOT NULL,
+    session         VARCHAR   NOT NULL,
+    is_holiday      BOOLEAN   NOT NULL,
+    is_half_day     BOOLEAN   NOT NULL,
+    exchange_ts     TIMESTAMP NOT NULL
+);
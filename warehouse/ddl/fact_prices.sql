@@ -0,0 +1,30 @@
+-- Long format prices; One row per instrument and snapshot (gold/fact_prices.py)
+CREATE TYPE IF NOT EXISTS symbol_t AS ENUM ('/ES', '/NQ', '/RTY', 'SPY', 'QQQ', 'IWM');
+
+CREATE TABLE IF NOT EXISTS fact_prices (
+    "timestamp"  TIMESTAMP NOT NULL,
+    -- Surrogate key of the minute; Joins dim_time.time_key, null outside the dim_time range (flagged in fact_prices metadata)
+    time_key     INTEGER,
+    symbol       symbol_t  NOT NULL,
+    price        DOUBLE    NOT NULL,
+    -- Gold file (year=YYYY/month=MM/<week>_fact_prices.parquet) the row was loaded from; Unit of incremental append
+    source_file  VARCHAR   NOT NULL
+);
+
+-- Warehouses created before time_key; Rows loaded then are reloaded once their gold file is rebuilt
+ALTER TABLE fact_prices ADD COLUMN IF NOT EXISTS time_key INTEGER;
+
+-- Warehouses created while time_key was NOT NULL; Same nullable col on every path
+ALTER TABLE fact_prices ALTER COLUMN time_key DROP NOT NULL;
+
+-- Gold files loaded into the warehouse; A file is reloaded when its content hash changes
+CREATE TABLE IF NOT EXISTS loaded_files (
+    table_name   VARCHAR   NOT NULL,
+    source_file  VARCHAR   NOT NULL,
+    size         BIGINT    NOT NULL,
+    mtime        BIGINT    NOT NULL,
+    sha256       VARCHAR   NOT NULL,
+    row_count    BIGINT    NOT NULL,
+    loaded_at    TIMESTAMP NOT NULL,
+    PRIMARY KEY (table_name, source_file)
+);
@@ -0,0 +1,322 @@
+"""
+Load the gold layer into an embedded DuckDB warehouse and query it
+"""
+
+import os
+from pathlib import Path
+from datetime import datetime
+import argparse
+import json
+import duckdb
+import polars as pl
+import pyarrow.parquet as pq
+
+
+import sys
+
+
+root_dir = Path(__file__).resolve().parent.parent
+helper_path = str(root_dir / "helpers")
+
+if helper_path not in sys.path:
+    sys.path.append(helper_path)
+
+
+import add_metadata
+import manifest
+import stage_metrics
+
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_ROOT = Path(os.getenv("DATA_ROOT", PROJECT_ROOT / "data"))
+GOLD_FACT_PRICES = DATA_ROOT / "gold" / "fact_prices"
+GOLD_DIM_TIME = DATA_ROOT / "gold" / "dim_time" / "dim_time.parquet"
+WAREHOUSE_ROOT = DATA_ROOT / "warehouse"
+WAREHOUSE_META = DATA_ROOT / "warehouse" / "load_metadata"
+WAREHOUSE_DB = WAREHOUSE_ROOT / "intraday.duckdb"
+
+DDL_ROOT = Path(__file__).resolve().parent / "ddl"
+
+# Applied in order on every load; Every statement is idempotent
+DDL_FILES = ["fact_prices.sql", "dim_time.sql"]
+
+# ----------------------------
+# Helpers
+# ----------------------------
+
+"""
+Ensure directory of root is estavlished correctly
+
+@param: Path path - Path of directory
+@returns: None
+"""
+def ensure_dir(path: Path) -> None:
+    path.mkdir(parents=True, exist_ok=True)
+
+
+"""
+Open the warehouse database
+
+@param:Path db_path - database file
+@param:bool read_only - open without write access; Several readers can share the file
+@returns: duckdb.DuckDBPyConnection - connection
+"""
+def connect(db_path: Path = WAREHOUSE_DB, read_only: bool = False) -> duckdb.DuckDBPyConnection:
+    if not read_only:
+        ensure_dir(Path(db_path).parent)
+
+    return duckdb.connect(str(db_path), read_only=read_only)
+
+
+"""
+Create the warehouse schema from the ddl folder
+
+@param:duckdb.DuckDBPyConnection con - warehouse connection
+@returns: None
+"""
+def create_schema(con: duckdb.DuckDBPyConnection) -> None:
+    for name in DDL_FILES:
+        con.execute((DDL_ROOT / name).read_text())
+
+
+"""
+Fingerprints of the files already loaded into a table
+
+@param:duckdb.DuckDBPyConnection con - warehouse connection
+@param:str table - table name
+@returns: dict[str, dict] - source_file -> {"size", "mtime", "sha256"}
+"""
+def loaded_files(con: duckdb.DuckDBPyConnection, table: str) -> dict[str, dict]:
+    rows = con.execute("SELECT source_file, size, mtime, sha256 FROM loaded_files WHERE table_name = ?", [table]).fetchall()
+
+    return {source_file: {"size": size, "mtime": mtime, "sha256": sha256} for source_file, size, mtime, sha256 in rows}
+
+
+"""
+Replace the rows of one gold file in fact_prices; The parquet is handed to DuckDB as an Arrow table (no row inserts).
+Runs in one transaction, so a failed load leaves the previous rows in place
+
+@param:duckdb.DuckDBPyConnection con - warehouse connection
+@param:Path parquet - gold fact_prices file
+@param:str source_file - file key (path relative to the fact_prices root)
+@param:dict input_fingerprint - fingerprint of the file
+@returns: int - rows loaded
+"""
+def load_fact_file(con: duckdb.DuckDBPyConnection, parquet: Path, source_file: str, input_fingerprint: dict) -> int:
+
+    batch = pq.read_table(parquet, columns=["timestamp", "time_key", "symbol", "price"])
+
+    con.execute("BEGIN TRANSACTION")
+
+    try:
+        con.execute("DELETE FROM fact_prices WHERE source_file = ?", [source_file])
+
+        con.register("fact_batch", batch)
+
+        con.execute("""
+            INSERT INTO fact_prices ("timestamp", time_key, symbol, price, source_file)
+            SELECT "timestamp", time_key, CAST(symbol AS VARCHAR), price, ? FROM fact_batch
+        """, [source_file])
+
+        con.unregister("fact_batch")
+
+        con.execute("""
+            INSERT OR REPLACE INTO loaded_files
+            VALUES ('fact_prices', ?, ?, ?, ?, ?, ?)
+        """, [source_file, input_fingerprint["size"], input_fingerprint["mtime"], input_fingerprint["sha256"],
+              batch.num_rows, datetime.now()])
+
+        con.execute("COMMIT")
+
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+    return batch.num_rows
+
+
+"""
+Replace dim_time with the generated dimension (silver/dim_time.py); Same Arrow path as the facts
+
+@param:duckdb.DuckDBPyConnection con - warehouse connection
+@param:Path parquet - dim_time parquet
+@param:dict input_fingerprint - fingerprint of the file
+@returns: int - rows loaded
+"""
+def load_dim_time(con: duckdb.DuckDBPyConnection, parquet: Path, input_fingerprint: dict) -> int:
+
+    batch = pq.read_table(parquet)
+
+    con.execute("BEGIN TRANSACTION")
+
+    try:
+        con.execute("DELETE FROM dim_time")
+
+        con.register("dim_batch", batch)
+
+        con.execute("""
+            INSERT INTO dim_time
+            SELECT time_key, minute_ts, trading_date, day_of_week, CAST(session AS VARCHAR),
+                   is_holiday, is_half_day, exchange_ts
+            FROM dim_batch
+        """)
+
+        con.unregister("dim_batch")
+
+        con.execute("""
+            INSERT OR REPLACE INTO loaded_files
+            VALUES ('dim_time', ?, ?, ?, ?, ?, ?)
+        """, [parquet.name, input_fingerprint["size"], input_fingerprint["mtime"], input_fingerprint["sha256"],
+              batch.num_rows, datetime.now()])
+
+        con.execute("COMMIT")
+
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+    return batch.num_rows
+
+
+"""
+Drop the rows of gold files that no longer exist
+
+@param:duckdb.DuckDBPyConnection con - warehouse connection
+@param:str table - table name
+@param:list[str] source_files - files to drop
+@returns: None
+"""
+def drop_files(con: duckdb.DuckDBPyConnection, table: str, source_files: list[str]) -> None:
+    for source_file in source_files:
+        con.execute("BEGIN TRANSACTION")
+        con.execute(f"DELETE FROM {table} WHERE source_file = ?", [source_file])
+        con.execute("DELETE FROM loaded_files WHERE table_name = ? AND source_file = ?", [table, source_file])
+        con.execute("COMMIT")
+
+
+# ----------------------------
+# Query entry point
+# ----------------------------
+
+"""
+Run a SQL query against the warehouse (read only)
+
+@param:str sql - query; Use ? placeholders for params
+@param:list | None params - query parameters
+@param:Path db_path - database file
+@returns: pl.DataFrame - result
+"""
+def query(sql: str, params: list | None = None, db_path: Path = WAREHOUSE_DB) -> pl.DataFrame:
+    with connect(db_path, read_only=True) as con:
+        return con.execute(sql, params or []).pl()
+
+
+# -----------------------
+# Main func for load_gold
+# ----------------------
+
+"""
+Main func for load_gold - Creates the schema and appends every new or changed gold fact file; Unchanged files are skipped
+@param: Path folder_path - root of the gold fact_prices dataset
+@param: Path db_path - database file
+@param: Path dim_time_path - generated dim_time parquet; Loaded when it exists and changed
+@param: bool overwrite - reload every file; False by default
+@returns: None
+"""
+def main(folder_path: Path = GOLD_FACT_PRICES, db_path: Path = WAREHOUSE_DB, dim_time_path: Path = GOLD_DIM_TIME,
+         overwrite: bool = False):
+
+    folder_path = Path(folder_path)
+
+    fact_files = sorted(folder_path.glob("year=*/month=*/*.parquet"))
+
+    metadata = []
+
+    metrics = []
+
+    with connect(db_path) as con, stage_metrics.profile_stage("load_gold", WAREHOUSE_META):
+
+        create_schema(con)
+
+        dim_time_path = Path(dim_time_path)
+
+        if dim_time_path.is_file():
+            loaded = loaded_files(con, "dim_time")
+
+            input_fingerprint = manifest.fingerprint(dim_time_path, loaded.get(dim_time_path.name))
+
+            if overwrite or loaded.get(dim_time_path.name, {}).get("sha256") != input_fingerprint["sha256"]:
+                print(f"Loading {dim_time_path}")
+
+                with stage_metrics.measure(metrics, dim_time_path, "warehouse", "load_gold", "dim_time") as counts:
+                    counts["bytes_read"] = stage_metrics.file_bytes(dim_time_path)
+                    counts["rows_in"] = counts["rows_out"] = load_dim_time(con, dim_time_path, input_fingerprint)
+
+        loaded = loaded_files(con, "fact_prices")
+
+        for parquet in fact_files:
+
+            source_file = str(parquet.relative_to(folder_path))
+
+            input_fingerprint = manifest.fingerprint(parquet, loaded.get(source_file))
+
+            if not overwrite and loaded.get(source_file, {}).get("sha256") == input_fingerprint["sha256"]:
+                continue
+
+            print(f"Loading {parquet}")
+
+            with stage_metrics.measure(metrics, parquet, "warehouse", "load_gold", "fact_prices") as counts:
+
+                counts["bytes_read"] = stage_metrics.file_bytes(parquet)
+                counts["rows_in"] = counts["rows_out"] = load_fact_file(con, parquet, source_file, input_fingerprint)
+
+            metadata.append(add_metadata.add_clean_metadata_instance(file=str(parquet),
+                                                        layer= "warehouse",
+                                                        process= "load_gold",
+                                                        sub_process= "fact_prices",
+                                                        status= "conforming",
+                                                        issue= "N/A",
+                                                        action="loaded",
+                                                        notes=f"{counts['rows_out']} rows"))
+
+        # Rows of gold files that were removed since the last load
+        removed = sorted(set(loaded) - {str(parquet.relative_to(folder_path)) for parquet in fact_files})
+
+        drop_files(con, "fact_prices", removed)
+
+        for source_file in removed:
+            metadata.append(add_metadata.add_clean_metadata_instance(file=source_file,
+                                                        layer= "warehouse",
+                                                        process= "load_gold",
+                                                        sub_process= "fact_prices",
+                                                        status= "N/A",
+                                                        issue= "N/A",
+                                                        action="dropped",
+                                                        notes="gold file no longer exists"))
+
+    # -----------------
+    # Write metadata
+    # -----------------
+
+    ensure_dir(WAREHOUSE_META)
+
+    with open(WAREHOUSE_META / "load_metadata.json", "w") as json_file:
+        json.dump(metadata, json_file, indent=4)
+
+    stage_metrics.write_metrics(WAREHOUSE_META, "load_metrics.json", metrics)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Load gold into the DuckDB warehouse, or query it")
+    parser.add_argument("--overwrite", action="store_true", help="Reload every gold file")
+    parser.add_argument("--query", default=None, help="Run a SQL query instead of loading")
+
+    args = parser.parse_args()
+
+    if args.query:
+        with pl.Config(tbl_rows=50):
+            print(query(args.query))
+    else:
+        main(overwrite=args.overwrite)